@@ -0,0 +1,222 @@
+"""
+Asynchronous structured access log.
+
+Request threads only append a small tuple to an in-memory buffer; a
+background thread formats the records as JSON lines and writes them in
+batches, so neither string formatting nor a slow stdout/journald pipe sits
+on the response path.
+
+Features:
+- JSON lines: time, method, path, route, status, bytes, range, duration, client
+- Slow requests (see profiling.RequestTimings) as {"type": "slow", ...} lines
+- Sampling of 206 (PMTiles range) responses, which dominate playback traffic
+- Size-based rotation (access.log -> access.log.1 -> ... access.log.N)
+- Never blocks: when the buffer is full, records are dropped and counted
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import threading
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+
+from admission import TRUSTED_PROXIES
+from profiling import route_key
+
+# Destination: a file path, or "-" for stdout (journald under systemd)
+DEFAULT_ACCESS_LOG = os.getenv("APP_ACCESS_LOG", "-")
+# Fraction of 206 responses that are logged (1 = all)
+DEFAULT_SAMPLE_206 = float(os.getenv("APP_ACCESS_LOG_SAMPLE_206", "1"))
+
+MAX_BUFFERED_RECORDS = int(os.getenv("APP_ACCESS_LOG_BUFFER", "20000"))
+FLUSH_INTERVAL = 0.5          # Seconds between writer wake-ups
+MAX_BATCH_RECORDS = 5000      # Records formatted per write
+ROTATE_BYTES = int(os.getenv("APP_ACCESS_LOG_MAX_MB", "50")) * 1024 * 1024
+ROTATE_BACKUPS = int(os.getenv("APP_ACCESS_LOG_BACKUPS", "5"))
+
+
+def client_of(client_address, headers) -> str:
+    """Client IP, trusting X-Real-IP only from the local proxy (as admission does)."""
+    peer = client_address[0] if client_address else '-'
+    real_ip = headers.get('X-Real-IP') if headers is not None else None
+    if real_ip and peer in TRUSTED_PROXIES:
+        return real_ip
+    return peer
+
+
+class AccessLog:
+    """Buffered JSON-lines access log written by a background thread."""
+
+    def __init__(self, path: str = DEFAULT_ACCESS_LOG, sample_206: float = DEFAULT_SAMPLE_206,
+                 max_buffered: int = MAX_BUFFERED_RECORDS, rotate_bytes: int = ROTATE_BYTES,
+                 backups: int = ROTATE_BACKUPS):
+        self.path = None if path in (None, "", "-") else Path(path)
+        self.sample_206 = min(max(sample_206, 0.0), 1.0)
+        self.max_buffered = max_buffered
+        self.rotate_bytes = rotate_bytes
+        self.backups = backups
+
+        # deque.append/popleft are atomic, so request threads take no lock
+        self._buffer = deque()
+        self._stop = threading.Event()
+        self._file = None
+        self._size = 0
+        self._stats_lock = threading.Lock()
+        self._stats = {"written": 0, "dropped": 0, "sampledOut": 0, "rotations": 0, "writeErrors": 0}
+        self._failing = False
+        self._last_error = None
+
+        # Open up front so a path the service user cannot write is reported at startup
+        if self.path is not None:
+            try:
+                self._open()
+            except OSError as e:
+                self._record_error(e)
+                print(f"[AccessLog] Cannot open {self.path}: {e}; records are dropped until it is writable")
+
+        self._thread = threading.Thread(target=self._writer_loop, name="access-log", daemon=True)
+        self._thread.start()
+
+    def log(self, method: str, path: str, status, size, range_header: str,
+            duration: float, client: str):
+        """Queue one record; returns immediately (drops the record if the buffer is full)."""
+        sample_rate = None
+        if status == 206 and self.sample_206 < 1.0:
+            if random.random() >= self.sample_206:
+                self._count("sampledOut")
+                return
+            sample_rate = self.sample_206
+
+        if len(self._buffer) >= self.max_buffered:
+            self._count("dropped")
+            return
+        self._buffer.append((time.time(), method, path, status, size,
+                             range_header, duration, client, sample_rate))
+
+    def log_slow(self, entry: dict):
+        """Queue a slow-request entry (profiling.RequestTimings) as a "slow" record."""
+        if len(self._buffer) >= self.max_buffered:
+            self._count("dropped")
+            return
+        self._buffer.append({"type": "slow", **entry})
+
+    def get_stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                **self._stats,
+                "failing": self._failing,
+                "lastError": self._last_error,
+                "buffered": len(self._buffer),
+                "path": str(self.path) if self.path else "stdout",
+                "sample206": self.sample_206,
+            }
+
+    def close(self):
+        """Flush what is buffered and stop the writer."""
+        self._stop.set()
+        self._thread.join(timeout=5)
+
+    @property
+    def failing(self) -> bool:
+        """True while the most recent write failed."""
+        return self._failing
+
+    def _count(self, name: str, amount: int = 1):
+        with self._stats_lock:
+            self._stats[name] += amount
+
+    def _record_error(self, error: Exception):
+        with self._stats_lock:
+            self._failing = True
+            self._last_error = {"time": datetime.now().isoformat(timespec="seconds"), "error": str(error)}
+
+    # ------------------------------------------------------------------
+    # Writer thread
+    # ------------------------------------------------------------------
+
+    def _writer_loop(self):
+        while not self._stop.wait(FLUSH_INTERVAL):
+            self._drain()
+        self._drain()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _drain(self):
+        while self._buffer:
+            batch = []
+            try:
+                while len(batch) < MAX_BATCH_RECORDS:
+                    batch.append(self._buffer.popleft())
+            except IndexError:
+                pass
+            self._write(batch)
+
+    def _write(self, batch: list):
+        data = "".join(self._format(record) for record in batch).encode("utf-8")
+        try:
+            if self.path is None:
+                sys.stdout.buffer.write(data)
+                sys.stdout.flush()
+            else:
+                if self._file is None:
+                    self._open()
+                if self._size and self._size + len(data) > self.rotate_bytes:
+                    self._rotate()
+                self._file.write(data)
+                self._file.flush()
+                self._size += len(data)
+            self._count("written", len(batch))
+            self._failing = False
+        except (OSError, ValueError) as e:
+            # Disk full, closed stdout, ... : count the loss, keep serving
+            self._record_error(e)
+            self._count("writeErrors")
+            self._count("dropped", len(batch))
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    @staticmethod
+    def _format(record) -> str:
+        if isinstance(record, dict):
+            return json.dumps(record, separators=(",", ":")) + "\n"
+        timestamp, method, path, status, size, range_header, duration, client, sample_rate = record
+        entry = {
+            "time": datetime.fromtimestamp(timestamp).isoformat(timespec="milliseconds"),
+            "method": method,
+            "path": path,
+            "route": route_key(path),
+            "status": int(status) if isinstance(status, int) else status,
+            "bytes": size if isinstance(size, int) else None,
+            "range": range_header,
+            "durationMs": round(duration * 1000, 3) if duration is not None else None,
+            "client": client,
+        }
+        if sample_rate is not None:
+            entry["sampleRate"] = sample_rate
+        return json.dumps(entry, separators=(",", ":")) + "\n"
+
+    def _open(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "ab")
+        self._size = self._file.tell()
+
+    def _rotate(self):
+        """access.log -> access.log.1, .1 -> .2, ...; the oldest backup is removed."""
+        self._file.close()
+        self._file = None
+        for i in range(self.backups - 1, 0, -1):
+            older = self.path.with_name(f"{self.path.name}.{i}")
+            if older.exists():
+                os.replace(older, self.path.with_name(f"{self.path.name}.{i + 1}"))
+        if self.backups > 0:
+            os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+        else:
+            self.path.unlink(missing_ok=True)
+        self._count("rotations")
+        self._open()
@@ -0,0 +1,483 @@
+"""
+Admission control for the PMTiles HTTP server.
+
+Connections are accepted immediately and placed on a bounded priority queue
+that a fixed pool of worker threads drains. Under overload the server sheds
+work with a fast `503 Retry-After` instead of letting requests pile up in the
+listen backlog until clients time out.
+
+The accept thread never waits on a client: it peeks at whatever request bytes
+have already arrived, and connections that have not sent anything yet are
+handed to a selector thread that classifies them once their head arrives.
+
+Features:
+- Bounded work queue with a fixed number of worker threads
+- Priority for /api/* and PMTiles directory ranges over bulk tile ranges
+- Per-client concurrency caps (honours X-Real-IP from the local nginx proxy)
+- Queue-latency target: requests that waited too long are shed, and bulk
+  requests are refused up-front while the (time-decayed) queue delay stays
+  above target
+- Shed requests are reported to an optional access-log hook
+"""
+
+import os
+import socket
+import struct
+import selectors
+import threading
+import itertools
+import time
+import queue
+import posixpath
+from collections import deque
+from http.server import HTTPServer
+from urllib.parse import urlparse, unquote
+
+# Priority classes (lower value is served first)
+PRIORITY_INTERACTIVE = 0  # /api/* and PMTiles header/directory ranges
+PRIORITY_STATIC = 1       # viewer assets, other static files and raster tiles
+PRIORITY_BULK = 2         # PMTiles tile-data ranges
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_STATIC: "static",
+    PRIORITY_BULK: "bulk",
+}
+
+# Defaults (overridable from the environment or the command line)
+DEFAULT_WORKERS = int(os.getenv("APP_WORKERS", "16"))
+DEFAULT_MAX_QUEUE = int(os.getenv("APP_MAX_QUEUE", "512"))
+# Capped at MAX_CLIENT_WORKER_SHARE of the workers so one client can never occupy them all
+MAX_CLIENT_WORKER_SHARE = 4
+DEFAULT_MAX_PER_CLIENT = int(os.getenv("APP_MAX_PER_CLIENT",
+                                       str(max(1, DEFAULT_WORKERS // MAX_CLIENT_WORKER_SHARE))))
+DEFAULT_QUEUE_TARGET_MS = float(os.getenv("APP_QUEUE_TARGET_MS", "250"))
+DEFAULT_RETRY_AFTER = 1  # seconds
+
+# Interactive requests may wait this many times longer than the target
+INTERACTIVE_TARGET_FACTOR = 4
+
+# Connections that send no request bytes within this time are closed without
+# reaching a worker (partial heads are admitted; the handler's socket timeout
+# bounds how long a worker then waits for the rest)
+HEAD_WAIT_TIMEOUT = 2.0
+PEEK_BYTES = 4096
+
+# The queue-delay EWMA halves every this many seconds without new samples,
+# so bulk admission recovers once a burst has drained
+QUEUE_DELAY_HALF_LIFE = 1.0
+
+# Workers re-read a PMTiles file's tile-data offset at most this often
+OFFSET_RECHECK_SECONDS = 5.0
+
+# pmtiles.js always fetches the first 16 KB (header + root directory)
+PMTILES_ROOT_FETCH_SIZE = 16384
+# Offset of tile_data_offset in the 127-byte PMTiles v3 header
+PMTILES_TILE_DATA_OFFSET_POS = 56
+
+# Peers whose X-Real-IP header is trusted (the nginx proxy runs locally)
+TRUSTED_PROXIES = ("127.0.0.1", "::1")
+
+
+class AdmissionHTTPServer(HTTPServer):
+    """HTTP server with a bounded priority work queue and load shedding."""
+
+    request_queue_size = 128
+    daemon_threads = True
+    # Called as shed_log(method, path, status, bytes, range, duration, client)
+    # for every 503 sent without reaching a handler (e.g. AccessLog.log)
+    shed_log = None
+
+    def __init__(self, server_address, handler_class, serve_dir: str = None,
+                 workers: int = DEFAULT_WORKERS,
+                 max_queue: int = DEFAULT_MAX_QUEUE,
+                 max_per_client: int = DEFAULT_MAX_PER_CLIENT,
+                 queue_target_ms: float = DEFAULT_QUEUE_TARGET_MS,
+                 retry_after: int = DEFAULT_RETRY_AFTER):
+        super().__init__(server_address, handler_class)
+        self.serve_dir = serve_dir
+        self.max_queue = max_queue
+        self.max_per_client = max(1, min(max_per_client, workers // MAX_CLIENT_WORKER_SHARE))
+        self.queue_target = queue_target_ms / 1000.0
+        self.retry_after = retry_after
+
+        self._queue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._client_counts = {}   # client ip -> queued + active requests
+        self._queue_delay = 0.0    # EWMA of queue wait in seconds
+        self._queue_delay_at = time.monotonic()  # when the EWMA was last updated
+        self._directory_offsets = {}  # url path -> (checked_at, mtime, tile_data_offset)
+        self._detached = set()     # connections handed over to another owner
+        self._stats = {
+            "admitted": 0,
+            "served": 0,
+            "shedQueueFull": 0,
+            "shedClientLimit": 0,
+            "shedLatency": 0,
+            "closedIdle": 0,
+        }
+
+        # Connections still waiting for their request head
+        self._pending = deque()
+        self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+        self._closing = False
+        self._head_thread = threading.Thread(target=self._head_loop, name="http-head-wait",
+                                             daemon=self.daemon_threads)
+        self._head_thread.start()
+
+        self._workers = []
+        for i in range(workers):
+            t = threading.Thread(target=self._worker_loop, name=f"http-worker-{i}",
+                                 daemon=self.daemon_threads)
+            t.start()
+            self._workers.append(t)
+
+    # ------------------------------------------------------------------
+    # Accept path
+    # ------------------------------------------------------------------
+
+    def process_request(self, request, client_address):
+        """Classify the connection and enqueue it, or shed it; never waits on the client."""
+        head = self._peek_head(request)
+        if head is None:
+            self._pending.append((request, client_address, time.monotonic() + HEAD_WAIT_TIMEOUT))
+            self._wake()
+            return
+        self._admit(request, client_address, head)
+
+    def _admit(self, request, client_address, head: tuple):
+        """Apply the admission checks to a classified connection."""
+        method, path, range_header, real_ip = head
+        priority = self._classify(path, _range_start(range_header))
+        client = self._client_key(client_address, real_ip)
+        now = time.monotonic()
+
+        with self._lock:
+            if self._client_counts.get(client, 0) >= self.max_per_client:
+                self._stats["shedClientLimit"] += 1
+                reason = "client concurrency limit reached"
+            elif self._queued >= self.max_queue:
+                self._stats["shedQueueFull"] += 1
+                reason = "request queue is full"
+            elif priority == PRIORITY_BULK and self._current_queue_delay(now) > self.queue_target:
+                self._stats["shedLatency"] += 1
+                reason = "queue latency above target"
+            else:
+                reason = None
+                self._queued += 1
+                self._client_counts[client] = self._client_counts.get(client, 0) + 1
+                self._stats["admitted"] += 1
+
+        if reason:
+            self._shed(request, reason, head, client, 0.0)
+            return
+
+        self._queue.put((priority, next(self._seq), now,
+                         request, client_address, client, head))
+
+    def _peek_head(self, request):
+        """Peek at the request head without consuming it or waiting for it.
+
+        Returns (method, path, range_header, x_real_ip), with None fields when
+        the head is malformed or the peer closed; returns None when no request
+        bytes have arrived yet.
+        """
+        try:
+            request.setblocking(False)
+            data = request.recv(PEEK_BYTES, socket.MSG_PEEK)
+        except (BlockingIOError, InterruptedError):
+            return None
+        except OSError:
+            data = b''
+        finally:
+            try:
+                request.setblocking(True)
+            except OSError:
+                pass
+        return _parse_head(data)
+
+    def _wake(self):
+        try:
+            self._wake_w.send(b'\0')
+        except OSError:
+            pass  # Wake-up already pending (buffer full) or shutting down
+
+    def _head_loop(self):
+        """Admit connections whose request head arrives after accept()."""
+        waiting = {}  # socket -> (client_address, deadline)
+        while not self._closing:
+            while self._pending:
+                request, client_address, deadline = self._pending.popleft()
+                try:
+                    self._selector.register(request, selectors.EVENT_READ)
+                except (ValueError, OSError):
+                    self.shutdown_request(request)
+                    continue
+                waiting[request] = (client_address, deadline)
+
+            now = time.monotonic()
+            timeout = min([d for _, d in waiting.values()], default=now + 1.0) - now
+            for key, _ in self._selector.select(max(timeout, 0.0)):
+                if key.fileobj is self._wake_r:
+                    try:
+                        while self._wake_r.recv(512):
+                            pass
+                    except OSError:
+                        pass
+                    continue
+                request = key.fileobj
+                client_address, deadline = waiting.pop(request)
+                self._selector.unregister(request)
+                head = self._peek_head(request)
+                if head is None:
+                    # Spurious wake-up: keep waiting until the deadline
+                    self._pending.append((request, client_address, deadline))
+                elif head is _EMPTY_HEAD:
+                    self._close_idle(request)  # Peer closed without a request
+                else:
+                    self._admit(request, client_address, head)
+
+            now = time.monotonic()
+            for request, (client_address, deadline) in list(waiting.items()):
+                if deadline <= now:
+                    del waiting[request]
+                    self._selector.unregister(request)
+                    self._close_idle(request)
+
+        for request in waiting:
+            self.shutdown_request(request)
+
+    def _close_idle(self, request):
+        """Close a connection that sent no request; it never takes a queue slot or worker."""
+        with self._lock:
+            self._stats["closedIdle"] += 1
+        self.shutdown_request(request)
+
+    def _classify(self, path: str, range_start: int) -> int:
+        """Map a request to its priority class."""
+        if not path:
+            return PRIORITY_STATIC
+
+        url_path = urlparse(path).path
+        if url_path.startswith('/api/raster/'):
+            # A viewport fetches a dozen tiles per frame; keep them behind API calls
+            return PRIORITY_STATIC
+        if url_path.startswith('/api/'):
+            return PRIORITY_INTERACTIVE
+
+        if url_path.endswith('.pmtiles'):
+            if range_start is None:
+                return PRIORITY_BULK
+            if range_start < self._tile_data_offset(url_path):
+                return PRIORITY_INTERACTIVE
+            return PRIORITY_BULK
+
+        return PRIORITY_STATIC
+
+    def _tile_data_offset(self, url_path: str) -> int:
+        """Return where tile data starts in a PMTiles file, as last read by a worker.
+
+        Everything before this offset is header, directories or metadata.
+        No file I/O happens here: this runs on the accept path.
+        """
+        cached = self._directory_offsets.get(url_path)
+        return cached[2] if cached else PMTILES_ROOT_FETCH_SIZE
+
+    def _refresh_tile_data_offset(self, url_path: str):
+        """Read a PMTiles header's tile-data offset (worker thread, rate-limited per file)."""
+        now = time.monotonic()
+        cached = self._directory_offsets.get(url_path)
+        if not self.serve_dir or (cached and now - cached[0] < OFFSET_RECHECK_SECONDS):
+            return
+
+        rel_path = posixpath.normpath(unquote(url_path)).lstrip('/')
+        file_path = os.path.join(self.serve_dir, rel_path)
+        if not os.path.abspath(file_path).startswith(os.path.abspath(self.serve_dir)):
+            return
+
+        try:
+            mtime = os.stat(file_path).st_mtime
+        except OSError:
+            self._directory_offsets.pop(url_path, None)
+            return
+        if cached and cached[1] == mtime:
+            self._directory_offsets[url_path] = (now, mtime, cached[2])
+            return
+
+        offset = PMTILES_ROOT_FETCH_SIZE
+        try:
+            with open(file_path, 'rb') as f:
+                header = f.read(PMTILES_TILE_DATA_OFFSET_POS + 8)
+            if header[:7] == b'PMTiles' and header[7] == 3:
+                offset = struct.unpack_from('<Q', header, PMTILES_TILE_DATA_OFFSET_POS)[0]
+        except (OSError, IndexError, struct.error):
+            pass
+        self._directory_offsets[url_path] = (now, mtime, offset)
+
+    def _client_key(self, client_address, real_ip: str) -> str:
+        """Identify the client, trusting X-Real-IP only from the local proxy."""
+        peer = client_address[0] if client_address else '-'
+        if real_ip and peer in TRUSTED_PROXIES:
+            return real_ip
+        return peer
+
+    def _current_queue_delay(self, now: float) -> float:
+        """Queue-delay EWMA decayed by the time since its last sample (caller holds the lock)."""
+        return self._queue_delay * 0.5 ** ((now - self._queue_delay_at) / QUEUE_DELAY_HALF_LIFE)
+
+    def _shed(self, request, reason: str, request_head: tuple = None, client: str = None,
+              waited: float = 0.0):
+        """Reply with 503 Retry-After, report it to the access log and close the connection."""
+        body = ('{"success": false, "error": "Server busy: %s"}' % reason).encode('utf-8')
+        head = (
+            "HTTP/1.0 503 Service Unavailable\r\n"
+            f"Retry-After: {self.retry_after}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Access-Control-Allow-Origin: *\r\n"
+            "Cache-Control: no-store\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode('latin-1')
+        try:
+            request.settimeout(1.0)
+            request.sendall(head + body)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+        if self.shed_log is not None:
+            method, path, range_header, _ = request_head or _EMPTY_HEAD
+            self.shed_log(method or '-', path or '', 503, len(body), range_header, waited, client or '-')
+
+    # ------------------------------------------------------------------
+    # Worker path
+    # ------------------------------------------------------------------
+
+    def _worker_loop(self):
+        """Serve queued connections until a shutdown sentinel arrives."""
+        while True:
+            item = self._queue.get()
+            priority, _, enqueued_at, request, client_address, client, head = item
+            if request is None:
+                return
+
+            now = time.monotonic()
+            waited = now - enqueued_at
+            target = self.queue_target
+            if priority == PRIORITY_INTERACTIVE:
+                target *= INTERACTIVE_TARGET_FACTOR
+
+            with self._lock:
+                self._queued -= 1
+                self._queue_delay = 0.8 * self._current_queue_delay(now) + 0.2 * waited
+                self._queue_delay_at = now
+
+            try:
+                if waited > target:
+                    with self._lock:
+                        self._stats["shedLatency"] += 1
+                    self._shed(request, "queue latency above target", head, client, waited)
+                    continue
+
+                try:
+                    self.finish_request(request, client_address)
+                except Exception:
+                    self.handle_error(request, client_address)
+                finally:
+                    with self._lock:
+                        self._stats["served"] += 1
+                        detached = request in self._detached
+                        self._detached.discard(request)
+                    if not detached:
+                        self.shutdown_request(request)
+            finally:
+                # Released before any bookkeeping so a client's next request is not refused
+                with self._lock:
+                    remaining = self._client_counts.get(client, 1) - 1
+                    if remaining > 0:
+                        self._client_counts[client] = remaining
+                    else:
+                        self._client_counts.pop(client, None)
+
+            url_path = urlparse(head[1]).path if head[1] else ''
+            if url_path.endswith('.pmtiles'):
+                self._refresh_tile_data_offset(url_path)
+
+    def detach_request(self, request):
+        """Hand a connection over to another owner (e.g. an SSE broadcaster).
+
+        The worker thread is freed when the handler returns, but the
+        connection is left open; the new owner is responsible for closing it.
+        """
+        with self._lock:
+            self._detached.add(request)
+
+    def get_stats(self) -> dict:
+        """Return a snapshot of admission counters for the health endpoint."""
+        with self._lock:
+            return {
+                **self._stats,
+                "queued": self._queued,
+                "maxQueue": self.max_queue,
+                "workers": len(self._workers),
+                "activeClients": len(self._client_counts),
+                "queueDelayMs": round(self._current_queue_delay(time.monotonic()) * 1000, 2),
+                "maxPerClient": self.max_per_client,
+                "queueTargetMs": round(self.queue_target * 1000, 2),
+            }
+
+    def server_close(self):
+        """Stop the head-wait thread and worker pool, then close the listening socket."""
+        super().server_close()
+        self._closing = True
+        self._wake()
+        self._head_thread.join(timeout=5)
+        for _ in self._workers:
+            # Sentinels sort after every real request
+            self._queue.put((PRIORITY_BULK + 1, next(self._seq), 0.0, None, None, None, None))
+        for t in self._workers:
+            t.join(timeout=5)
+        self._selector.close()
+        self._wake_r.close()
+        self._wake_w.close()
+
+
+_EMPTY_HEAD = (None, None, None, None)
+
+
+def _parse_head(data: bytes) -> tuple:
+    """Parse whatever part of a request head is available into (method, path, range, x_real_ip)."""
+    if not data:
+        return _EMPTY_HEAD
+
+    lines = data.split(b'\r\n')
+    parts = lines[0].split()
+    method = parts[0].decode('latin-1') if parts else None
+    path = parts[1].decode('latin-1') if len(parts) >= 2 else None
+
+    range_header = None
+    real_ip = None
+    for line in lines[1:]:
+        if not line:
+            break
+        name, _, value = line.partition(b':')
+        name = name.strip().lower()
+        if name == b'range':
+            range_header = value.strip().decode('latin-1') or None
+        elif name == b'x-real-ip':
+            real_ip = value.strip().decode('latin-1') or None
+    return method, path, range_header, real_ip
+
+
+def _range_start(range_header: str):
+    """First byte offset of a 'bytes=start-end' Range header, or None."""
+    if not range_header:
+        return None
+    start = range_header.replace('bytes=', '').split('-')[0].strip()
+    return int(start) if start.isdigit() else None
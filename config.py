@@ -1,4 +1,5 @@
 import os
+import threading
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -6,6 +7,10 @@ load_dotenv()
 
 # Application secrets from environment
 GOOGLE_MAPS_API_KEY = os.getenv('GOOGLE_MAPS_API_KEY', '')
+# Bearer token for POST /api/nowcast/slots (empty disables API ingest)
+INGEST_TOKEN = os.getenv('APP_INGEST_TOKEN', '')
+# Bearer token for /api/admin/* (timings, profiler); empty disables them
+ADMIN_TOKEN = os.getenv('APP_ADMIN_TOKEN', '')
 
 LOCATION="GURUGRAM, HARYANA"
 START_TIME=202507130155
@@ -23,6 +28,13 @@ DEPTH_PROPERTY_PREFIX = "D"
 # Legacy - kept for backward compatibility
 MASTER_PMTILES_FILE = "public/pmtiles/flood/flood_depth_master.pmtiles"
 
+# Live nowcast ingest - batch files written by the server, keyed by batch start time.
+# END_TIME is extended at runtime as new slots arrive (see extend_end_time).
+# Both are replaced, never mutated in place, under _INGEST_LOCK, so request
+# threads can iterate a snapshot while the ingest thread registers new files.
+INGEST_BATCH_FILES = {}
+_INGEST_LOCK = threading.Lock()
+
 
 def parse_time(time_int: int):
     """Parse time integer to datetime object."""
@@ -43,10 +55,20 @@ def get_batch_start_times() -> list:
     Returns:
         List of batch start times as integers (e.g., [202507130200, 202507130600, ...])
     """
+    return _batch_start_times(*_ingest_snapshot())
+
+
+def _ingest_snapshot() -> tuple:
+    """Return (END_TIME, INGEST_BATCH_FILES) as one consistent pair."""
+    with _INGEST_LOCK:
+        return END_TIME, INGEST_BATCH_FILES
+
+
+def _batch_start_times(end_time: int, ingest_files: dict) -> list:
     from datetime import timedelta
     
     start_dt = parse_time(START_TIME)
-    end_dt = parse_time(END_TIME)
+    end_dt = parse_time(end_time)
     batch_duration = timedelta(minutes=BATCH_SIZE * INTERVAL)
     
     batch_starts = []
@@ -56,13 +78,22 @@ def get_batch_start_times() -> list:
         batch_starts.append(int(format_time(current_dt)))
         current_dt += batch_duration
     
-    return batch_starts
+    # Ingested batches may start exactly at END_TIME
+    for batch_start in ingest_files:
+        if batch_start not in batch_starts:
+            batch_starts.append(batch_start)
+    
+    return sorted(batch_starts)
 
 
-def get_batch_files() -> list:
+def get_batch_files(run: str = None) -> list:
     """
     Get list of batch PMTiles files with their time ranges.
     
+    Args:
+        run: Scenario run name (batch files in PMTILES_FLOOD_DIR/<run>/);
+             None for the default run in PMTILES_FLOOD_DIR itself
+    
     Returns:
         List of dicts with batch file info:
         [
@@ -79,23 +110,29 @@ def get_batch_files() -> list:
     """
     from datetime import timedelta
     
-    batch_starts = get_batch_start_times()
+    end_time, ingest_files = _ingest_snapshot()
+    batch_starts = _batch_start_times(end_time, ingest_files)
     batch_files = []
     
-    for i, batch_start in enumerate(batch_starts):
+    for batch_start in batch_starts:
         start_dt = parse_time(batch_start)
         # End time is (BATCH_SIZE - 1) intervals after start
         end_dt = start_dt + timedelta(minutes=(BATCH_SIZE - 1) * INTERVAL)
+        start_index = get_time_slot_index(batch_start)
         
-        filename = f"D{batch_start}.pmtiles"
+        # Live ingest only feeds the default run
+        live = run is None and batch_start in ingest_files
+        filename = ingest_files[batch_start] if live else f"D{batch_start}.pmtiles"
+        flood_dir = f"{PMTILES_FLOOD_DIR}/{run}" if run else PMTILES_FLOOD_DIR
         
         batch_files.append({
             "filename": filename,
             "startTime": batch_start,
             "endTime": int(format_time(end_dt)),
-            "startIndex": i * BATCH_SIZE,
-            "endIndex": (i + 1) * BATCH_SIZE - 1,
-            "path": f"{PMTILES_FLOOD_DIR}/{filename}"
+            "startIndex": start_index,
+            "endIndex": start_index + BATCH_SIZE - 1,
+            "path": f"{flood_dir}/{filename}",
+            "live": live
         })
     
     return batch_files
@@ -205,3 +242,36 @@ def get_time_slots() -> list:
 def get_total_time_slots() -> int:
     """Get total number of time slots."""
     return len(get_time_slots())
+
+
+def get_time_slot_index(time_int: int) -> int:
+    """
+    Get the global time slot index for a time in format YYYYMMDDHHmm.
+    
+    Times between slots round down to the previous slot. The result is not
+    clamped; callers should check it against get_total_time_slots().
+    """
+    delta = parse_time(time_int) - parse_time(START_TIME)
+    return int(delta.total_seconds() // (INTERVAL * 60))
+
+
+def extend_end_time(end_time: int) -> bool:
+    """
+    Extend END_TIME to include a newly ingested time slot.
+    
+    Returns:
+        True if END_TIME moved forward, False if the slot was already covered
+    """
+    global END_TIME
+    with _INGEST_LOCK:
+        if end_time <= END_TIME:
+            return False
+        END_TIME = end_time
+        return True
+
+
+def register_batch_file(batch_start: int, filename: str):
+    """Point the batch starting at batch_start to a server-written (ingest) file."""
+    global INGEST_BATCH_FILES
+    with _INGEST_LOCK:
+        INGEST_BATCH_FILES = {**INGEST_BATCH_FILES, batch_start: filename}
@@ -0,0 +1,327 @@
+"""
+Bulk depth time-series export.
+
+Selects the batch files covering a time window through
+`config.get_batch_files()`, decodes and slices them in the shared process
+pool, and yields the encoded result chunk by chunk so the HTTP handler can
+stream it with chunked transfer encoding. At most a few chunks are in flight
+at once, so memory stays flat regardless of the export size.
+
+Formats:
+- csv: long format, one `geo_code,timestamp,depth` row per feature and slot
+- npy: float32 array of shape (slots, features), columns in ascending geo_code order
+- columnar: parquet-like self-describing binary; a JSON header (geo codes,
+  coordinates, timestamps) followed by one float32 column chunk per time slot
+  (also accepted as format=parquet-like or format=parquet)
+"""
+
+import json
+import struct
+from collections import deque
+from datetime import timedelta
+from io import BytesIO
+from pathlib import Path
+
+import numpy as np
+
+import config
+from flood_data import (load_batch, prepare_batch, bbox_mask, polygon_mask,
+                        get_process_pool, DEFAULT_PROCESS_WORKERS)
+from pmtiles_reader import PMTilesReader
+
+# Format -> (Content-Type, file extension)
+EXPORT_FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "npy": ("application/octet-stream", "npy"),
+    "columnar": ("application/octet-stream", "fldx"),
+}
+
+# Alternative names accepted for a format
+FORMAT_ALIASES = {
+    "parquet-like": "columnar",
+    "parquet": "columnar",
+}
+
+COLUMNAR_MAGIC = b"FLDX"
+COLUMNAR_VERSION = 1
+
+SLOTS_PER_TASK = 12           # Time slots encoded per pool task
+MAX_CONCURRENT_EXPORTS = 2    # Exports running at once before 503
+DEPTH_DECIMALS = 3            # CSV precision (metres)
+MAX_ZOOM = 22                 # Deepest zoom accepted before the archive is consulted
+
+
+def parse_export_params(query: dict, project_dir=None) -> dict:
+    """
+    Validate /api/export query parameters.
+
+    Args:
+        query: Parsed query string (as returned by urllib.parse.parse_qs)
+        project_dir: If given, zoom is also checked against the zoom range
+                     of the first batch file in the window
+
+    Returns:
+        Dict with format, bbox, polygon, zoom and the inclusive global slot range
+
+    Raises:
+        ValueError: If a parameter is missing or malformed
+    """
+    def get(name):
+        values = query.get(name)
+        return values[0].strip() if values and values[0].strip() else None
+
+    fmt = (get("format") or "csv").lower()
+    fmt = FORMAT_ALIASES.get(fmt, fmt)
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported format '{fmt}' (expected one of: "
+                         f"{', '.join(list(EXPORT_FORMATS) + list(FORMAT_ALIASES))})")
+
+    bbox = None
+    polygon = None
+    if get("bbox") and get("polygon"):
+        raise ValueError("Specify either bbox or polygon, not both")
+    if get("bbox"):
+        try:
+            bbox = [float(v) for v in get("bbox").split(",")]
+        except ValueError:
+            raise ValueError("bbox must be min_lon,min_lat,max_lon,max_lat")
+        if len(bbox) != 4 or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+            raise ValueError("bbox must be min_lon,min_lat,max_lon,max_lat")
+    if get("polygon"):
+        polygon = _parse_polygon(get("polygon"))
+
+    try:
+        start = int(get("start") or config.START_TIME)
+        end = int(get("end") or config.END_TIME)
+        config.parse_time(start)
+        config.parse_time(end)
+    except ValueError:
+        raise ValueError("start and end must be times in format YYYYMMDDHHmm")
+
+    total_slots = config.get_time_slot_index(config.END_TIME) + 1
+    first_slot = max(0, config.get_time_slot_index(start))
+    last_slot = min(total_slots - 1, config.get_time_slot_index(end))
+    if first_slot > last_slot:
+        raise ValueError(f"Time window is outside {config.START_TIME}-{config.END_TIME}")
+
+    zoom = None
+    if get("zoom"):
+        try:
+            zoom = int(get("zoom"))
+        except ValueError:
+            raise ValueError("zoom must be an integer")
+        if not 0 <= zoom <= MAX_ZOOM:
+            raise ValueError(f"zoom must be between 0 and {MAX_ZOOM}")
+        if project_dir is not None:
+            _check_zoom(Path(project_dir), zoom, first_slot, last_slot)
+
+    return {
+        "format": fmt,
+        "bbox": bbox,
+        "polygon": polygon,
+        "zoom": zoom,
+        "firstSlot": first_slot,
+        "lastSlot": last_slot,
+    }
+
+
+def _check_zoom(project_dir: Path, zoom: int, first_slot: int, last_slot: int):
+    """Reject a zoom level the batch files in the window do not store."""
+    for batch in config.get_batch_files():
+        path = project_dir / batch["path"]
+        if batch["endIndex"] < first_slot or batch["startIndex"] > last_slot or not path.exists():
+            continue
+        with PMTilesReader(path) as reader:
+            min_zoom, max_zoom = reader.header["minZoom"], reader.header["maxZoom"]
+        if not min_zoom <= zoom <= max_zoom:
+            raise ValueError(f"zoom must be between {min_zoom} and {max_zoom} for these batch files")
+        return
+
+
+def _parse_polygon(value: str) -> list:
+    """Parse a polygon given as JSON [[lon, lat], ...] or a GeoJSON Polygon."""
+    try:
+        data = json.loads(value)
+    except ValueError:
+        raise ValueError("polygon must be JSON [[lon, lat], ...] or a GeoJSON Polygon")
+
+    if isinstance(data, dict):
+        if data.get("type") == "Feature":
+            data = data.get("geometry") or {}
+        if data.get("type") != "Polygon" or not data.get("coordinates"):
+            raise ValueError("polygon GeoJSON must be a Polygon")
+        data = data["coordinates"][0]
+
+    try:
+        ring = [[float(p[0]), float(p[1])] for p in data]
+    except (TypeError, ValueError, IndexError):
+        raise ValueError("polygon must be JSON [[lon, lat], ...] or a GeoJSON Polygon")
+    if len(ring) < 3:
+        raise ValueError("polygon needs at least 3 vertices")
+    return ring
+
+
+def _slot_timestamp(index: int) -> int:
+    """Return the YYYYMMDDHHmm timestamp of a global slot index."""
+    slot_dt = config.parse_time(config.START_TIME) + timedelta(minutes=index * config.INTERVAL)
+    return int(config.format_time(slot_dt))
+
+
+def _plan_tasks(project_dir: Path, first_slot: int, last_slot: int) -> list:
+    """Split the slot window into per-batch, per-slot-range tasks."""
+    tasks = []
+    for batch in config.get_batch_files():
+        lo = max(first_slot, batch["startIndex"])
+        hi = min(last_slot, batch["endIndex"])
+        if lo > hi:
+            continue
+        path = project_dir / batch["path"]
+        if not path.exists():
+            raise FileNotFoundError(f"Batch file not found: {batch['filename']}")
+        for start in range(lo, hi + 1, SLOTS_PER_TASK):
+            stop = min(start + SLOTS_PER_TASK, hi + 1)
+            tasks.append({
+                "path": str(path),
+                "localStart": start - batch["startIndex"],
+                "localStop": stop - batch["startIndex"],
+                "timestamps": [_slot_timestamp(i) for i in range(start, stop)],
+            })
+    return tasks
+
+
+def select_features(path: str, cache_dir: str, zoom, bbox, polygon) -> tuple:
+    """Process-pool task: return (geo_codes, lon, lat) of one batch's features in the area."""
+    batch = load_batch(path, cache_dir, zoom)
+    lon, lat = batch.lon, batch.lat
+    mask = np.ones(len(batch), dtype=bool)
+    if bbox is not None:
+        mask &= bbox_mask(lon, lat, bbox)
+    if polygon is not None:
+        mask &= polygon_mask(lon, lat, polygon)
+    return batch.geo_codes[mask], lon[mask], lat[mask]
+
+
+def union_features(selections: list) -> tuple:
+    """
+    Merge per-batch (geo_codes, lon, lat) selections into one, ascending by geo_code.
+
+    Batches in a window need not hold the same features (nowcast open batches,
+    sparse scenario runs); a feature missing from a batch exports as NaN there.
+    """
+    codes = np.concatenate([s[0] for s in selections])
+    lon = np.concatenate([s[1] for s in selections])
+    lat = np.concatenate([s[2] for s in selections])
+    codes, first = np.unique(codes, return_index=True)
+    return codes, lon[first], lat[first]
+
+
+def encode_chunk(task: dict, geo_codes: np.ndarray, fmt: str, cache_dir: str, zoom) -> bytes:
+    """Process-pool task: slice one task's slots for the selected features and encode them."""
+    batch = load_batch(task["path"], cache_dir, zoom)
+    # (slots, features), the on-the-wire layout of every format
+    block = batch.align(geo_codes)[:, task["localStart"]:task["localStop"]].T
+
+    if fmt != "csv":
+        return np.ascontiguousarray(block, dtype='<f4').tobytes()
+
+    codes = geo_codes.tolist()
+    spec = f".{DEPTH_DECIMALS}f"
+    lines = []
+    for timestamp, column in zip(task["timestamps"], block):
+        ts = f",{timestamp},"
+        # d != d is the fast NaN check; missing depths become empty fields
+        lines.extend(
+            f"{code}{ts}{'' if d != d else format(d, spec)}\n"
+            for code, d in zip(codes, column.tolist())
+        )
+    return "".join(lines).encode("utf-8")
+
+
+def _encode_header(fmt: str, geo_codes, lon, lat, timestamps: list) -> bytes:
+    """Encode the format-specific preamble written before the first chunk."""
+    if fmt == "csv":
+        return b"geo_code,timestamp,depth\n"
+
+    shape = (len(timestamps), len(geo_codes))
+    if fmt == "npy":
+        buf = BytesIO()
+        np.lib.format.write_array_header_1_0(
+            buf, {"descr": "<f4", "fortran_order": False, "shape": shape})
+        return buf.getvalue()
+
+    header = json.dumps({
+        "format": "columnar",
+        "version": COLUMNAR_VERSION,
+        "dtype": "<f4",
+        "layout": "slot-major",
+        "shape": list(shape),
+        "timestamps": timestamps,
+        "geoCodes": geo_codes.tolist(),
+        "lon": np.round(lon, 6).tolist(),
+        "lat": np.round(lat, 6).tolist(),
+    }, separators=(",", ":")).encode("utf-8")
+    return COLUMNAR_MAGIC + struct.pack("<I", len(header)) + header
+
+
+def prepare_export(project_dir, cache_dir, params: dict) -> dict:
+    """
+    Resolve batches and features for an export and return a chunk generator.
+
+    All validation and feature selection happens here, before any bytes are
+    streamed, so failures can still be reported as JSON errors.
+
+    Raises:
+        FileNotFoundError: If a batch file in the window is missing
+        ValueError: If a batch file cannot be decoded
+    """
+    project_dir = Path(project_dir)
+    cache_dir = str(cache_dir) if cache_dir else None
+    fmt = params["format"]
+    zoom = params["zoom"]
+    tasks = _plan_tasks(project_dir, params["firstSlot"], params["lastSlot"])
+    if not tasks:
+        raise FileNotFoundError("No batch files cover the requested time window")
+
+    pool = get_process_pool()
+
+    # Decode every batch in the window in parallel (no-op when cached)
+    paths = list(dict.fromkeys(task["path"] for task in tasks))
+    list(pool.map(prepare_batch, paths, [cache_dir] * len(paths), [zoom] * len(paths)))
+
+    count = len(paths)
+    geo_codes, lon, lat = union_features(list(pool.map(
+        select_features, paths, [cache_dir] * count, [zoom] * count,
+        [params["bbox"]] * count, [params["polygon"]] * count)))
+
+    timestamps = [ts for task in tasks for ts in task["timestamps"]]
+    header = _encode_header(fmt, geo_codes, lon, lat, timestamps)
+
+    def chunks():
+        yield header
+        if len(geo_codes) == 0:
+            return
+        pending = deque()
+        remaining = iter(tasks)
+        try:
+            for task in remaining:
+                pending.append(pool.submit(encode_chunk, task, geo_codes, fmt, cache_dir, zoom))
+                if len(pending) >= DEFAULT_PROCESS_WORKERS:
+                    break
+            while pending:
+                data = pending.popleft().result()
+                task = next(remaining, None)
+                if task is not None:
+                    pending.append(pool.submit(encode_chunk, task, geo_codes, fmt, cache_dir, zoom))
+                yield data
+        finally:
+            for future in pending:
+                future.cancel()
+
+    content_type, extension = EXPORT_FORMATS[fmt]
+    return {
+        "contentType": content_type,
+        "filename": f"flood_depths_{timestamps[0]}_{timestamps[-1]}.{extension}",
+        "featureCount": int(len(geo_codes)),
+        "slotCount": len(timestamps),
+        "chunks": chunks(),
+    }
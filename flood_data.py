@@ -0,0 +1,264 @@
+"""
+Server-side access to flood batch data.
+
+Decodes batch PMTiles files into NumPy arrays (one row per feature, one column
+per time slot) and caches the result in memory and on disk, so the vector
+tiles of a batch are only parsed once per file version.
+
+Also owns the shared process pool used for CPU-heavy batch work, so that
+decoding never runs on the request-handling threads.
+"""
+
+import os
+import json
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from pmtiles_reader import PMTilesReader, decode_mvt, tile_to_lonlat
+
+import config
+
+# Cache configuration
+CACHE_DIR_NAME = "cache"
+BATCH_CACHE_SUBDIR = "batches"
+MEMORY_CACHE_SIZE = 8  # Decoded batches kept per process
+
+# Process pool configuration
+DEFAULT_PROCESS_WORKERS = int(os.getenv("APP_PROCESS_WORKERS", str(min(os.cpu_count() or 2, 4))))
+
+# Feature properties written by the batch pipeline
+GEO_CODE_PROPERTY = "geo_code"
+DEPTHS_PROPERTY = "flood_depths"
+
+
+class FloodBatch:
+    """Decoded batch file: features sorted by geo_code, depths per time slot."""
+
+    def __init__(self, geo_codes: np.ndarray, depths: np.ndarray, bounds: np.ndarray):
+        self.geo_codes = geo_codes  # (n,) unicode, ascending
+        self.depths = depths        # (n, BATCH_SIZE) float32, NaN where missing
+        self.bounds = bounds        # (n, 4) float64: min_lon, min_lat, max_lon, max_lat
+
+    def __len__(self) -> int:
+        return len(self.geo_codes)
+
+    @property
+    def lon(self) -> np.ndarray:
+        """Longitude of each feature's bounding-box centre."""
+        return (self.bounds[:, 0] + self.bounds[:, 2]) / 2
+
+    @property
+    def lat(self) -> np.ndarray:
+        """Latitude of each feature's bounding-box centre."""
+        return (self.bounds[:, 1] + self.bounds[:, 3]) / 2
+
+    def align(self, geo_codes: np.ndarray) -> np.ndarray:
+        """Return depths for the given geo_codes in that order (NaN rows if absent)."""
+        if len(self.geo_codes) == 0:
+            return np.full((len(geo_codes), self.depths.shape[1]), np.nan, dtype=np.float32)
+        idx = np.searchsorted(self.geo_codes, geo_codes)
+        idx = np.clip(idx, 0, len(self.geo_codes) - 1)
+        found = self.geo_codes[idx] == geo_codes
+        out = self.depths[idx]
+        out[~found] = np.nan
+        return out
+
+
+def _parse_depths(value, size: int) -> np.ndarray:
+    """Parse a flood_depths property (JSON string or number) into a fixed-size row."""
+    row = np.full(size, np.nan, dtype=np.float32)
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return row
+    if isinstance(value, (int, float)):
+        value = [value]
+    if isinstance(value, list) and value:
+        values = np.array(value[:size], dtype=np.float64)  # None -> NaN
+        row[:len(values)] = values
+    return row
+
+
+def decode_batch(path, zoom: int = None) -> FloodBatch:
+    """
+    Decode a batch PMTiles file into a FloodBatch.
+
+    Features are read from a single zoom level (default: the archive's max
+    zoom, where no features are dropped). Features split across tiles are
+    merged by geo_code.
+    """
+    index = {}
+    geo_codes = []
+    rows = []
+    bounds = []
+
+    with PMTilesReader(path) as reader:
+        z = reader.header["maxZoom"] if zoom is None else zoom
+        for x, y, data in reader.iter_tiles(z):
+            for layer in decode_mvt(data, properties=(GEO_CODE_PROPERTY, DEPTHS_PROPERTY)).values():
+                scale = 1.0 / layer["extent"]
+                for feature in layer["features"]:
+                    code = feature["properties"].get(GEO_CODE_PROPERTY)
+                    if code is None or not feature["geometry"]:
+                        continue
+                    xs = [p[0] for part in feature["geometry"] for p in part]
+                    ys = [p[1] for part in feature["geometry"] for p in part]
+                    min_lon, max_lat = tile_to_lonlat(z, x + min(xs) * scale, y + min(ys) * scale)
+                    max_lon, min_lat = tile_to_lonlat(z, x + max(xs) * scale, y + max(ys) * scale)
+
+                    row = index.get(str(code))
+                    if row is None:
+                        index[str(code)] = len(geo_codes)
+                        geo_codes.append(str(code))
+                        rows.append(_parse_depths(feature["properties"].get(DEPTHS_PROPERTY),
+                                                  config.BATCH_SIZE))
+                        bounds.append([min_lon, min_lat, max_lon, max_lat])
+                    else:
+                        b = bounds[row]
+                        b[0] = min(b[0], min_lon)
+                        b[1] = min(b[1], min_lat)
+                        b[2] = max(b[2], max_lon)
+                        b[3] = max(b[3], max_lat)
+
+    codes = np.array(geo_codes, dtype=str)
+    order = np.argsort(codes, kind='stable')
+    depths = np.array(rows, dtype=np.float32).reshape(-1, config.BATCH_SIZE)
+    return FloodBatch(codes[order], depths[order], np.array(bounds, dtype=np.float64).reshape(-1, 4)[order])
+
+
+# ----------------------------------------------------------------------
+# Caching
+# ----------------------------------------------------------------------
+
+_memory_cache = OrderedDict()  # (path, mtime_ns, size, zoom) -> FloodBatch
+_memory_lock = threading.Lock()
+
+
+def _cache_name(path: Path) -> str:
+    # Scenario runs reuse batch filenames, so the run directory is part of the name
+    return f"{path.parent.name}-{path.stem}"
+
+
+def _cache_file(cache_dir: Path, path: Path, stat, zoom) -> Path:
+    zoom_tag = "max" if zoom is None else str(zoom)
+    return cache_dir / BATCH_CACHE_SUBDIR / f"{_cache_name(path)}-{stat.st_mtime_ns}-{stat.st_size}-z{zoom_tag}.npz"
+
+
+def load_batch(path, cache_dir=None, zoom: int = None) -> FloodBatch:
+    """
+    Load a decoded batch, using the in-memory LRU and the on-disk cache.
+
+    Cache entries are keyed by file mtime and size, so rewritten batch
+    files are decoded again automatically.
+    """
+    path = Path(path)
+    stat = path.stat()
+    key = (str(path), stat.st_mtime_ns, stat.st_size, zoom)
+
+    with _memory_lock:
+        batch = _memory_cache.get(key)
+        if batch is not None:
+            _memory_cache.move_to_end(key)
+            return batch
+
+    cache_file = _cache_file(Path(cache_dir), path, stat, zoom) if cache_dir else None
+    batch = None
+    if cache_file is not None and cache_file.exists():
+        try:
+            with np.load(cache_file) as npz:
+                batch = FloodBatch(npz["geo_codes"], npz["depths"], npz["bounds"])
+        except (OSError, ValueError, KeyError):
+            batch = None
+
+    if batch is None:
+        batch = decode_batch(path, zoom)
+        if cache_file is not None:
+            _write_cache_file(cache_file, path, batch)
+
+    with _memory_lock:
+        _memory_cache[key] = batch
+        _memory_cache.move_to_end(key)
+        while len(_memory_cache) > MEMORY_CACHE_SIZE:
+            _memory_cache.popitem(last=False)
+    return batch
+
+
+def _write_cache_file(cache_file: Path, path: Path, batch: FloodBatch):
+    """Atomically write a decoded batch and drop stale versions of it."""
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = cache_file.with_name(f"{cache_file.stem}.{os.getpid()}.tmp.npz")
+        np.savez(tmp_file, geo_codes=batch.geo_codes, depths=batch.depths, bounds=batch.bounds)
+        os.replace(tmp_file, cache_file)
+        zoom_tag = cache_file.stem.rsplit("-", 1)[-1]
+        for old in cache_file.parent.glob(f"{_cache_name(path)}-*-{zoom_tag}.npz"):
+            if old != cache_file:
+                old.unlink(missing_ok=True)
+    except OSError:
+        pass
+
+
+def prepare_batch(path: str, cache_dir: str = None, zoom: int = None) -> int:
+    """Process-pool task: decode a batch into the disk cache, return its feature count."""
+    return len(load_batch(path, cache_dir, zoom))
+
+
+# ----------------------------------------------------------------------
+# Spatial selection
+# ----------------------------------------------------------------------
+
+def bbox_mask(lon: np.ndarray, lat: np.ndarray, bbox) -> np.ndarray:
+    """Boolean mask of points inside [min_lon, min_lat, max_lon, max_lat]."""
+    min_lon, min_lat, max_lon, max_lat = bbox
+    return (lon >= min_lon) & (lon <= max_lon) & (lat >= min_lat) & (lat <= max_lat)
+
+
+def polygon_mask(lon: np.ndarray, lat: np.ndarray, ring) -> np.ndarray:
+    """Boolean mask of points inside a polygon ring (even-odd rule, vectorized per edge)."""
+    ring = np.asarray(ring, dtype=np.float64)
+    inside = np.zeros(lon.shape, dtype=bool)
+    xj, yj = ring[-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for xi, yi in ring:
+            crosses = (yi > lat) != (yj > lat)
+            x_cross = (xj - xi) * (lat - yi) / (yj - yi) + xi
+            inside ^= crosses & (lon < x_cross)
+            xj, yj = xi, yi
+    return inside
+
+
+# ----------------------------------------------------------------------
+# Process pool
+# ----------------------------------------------------------------------
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Return the shared process pool, (re)creating it if needed."""
+    global _pool
+    with _pool_lock:
+        if _pool is None or getattr(_pool, "_broken", False):
+            # spawn: safe alongside the server's threads and works on Windows
+            _pool = ProcessPoolExecutor(max_workers=DEFAULT_PROCESS_WORKERS,
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def shutdown_process_pool():
+    """Shut down the shared process pool if it was started."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            try:
+                _pool.shutdown(wait=False, cancel_futures=True)
+            except TypeError:  # Python 3.8: no cancel_futures
+                _pool.shutdown(wait=False)
+            _pool = None
@@ -0,0 +1,463 @@
+"""
+Live nowcast ingest.
+
+New time slot outputs are accepted over the API or picked up from an inbox
+directory, appended to the open batch for their window, and announced to
+connected viewers over Server-Sent Events.
+
+The open batch is written from a geometry template (an existing batch file)
+with only the flood_depths arrays replaced. Every update gets a new
+versioned filename (D{batch_start}_v{n}.pmtiles), so the immutable caching of
+.pmtiles responses stays correct; static batch files are never rewritten.
+
+Slot files dropped into ingest/inbox/ are named D{YYYYMMDDHHmm}.csv
+(`geo_code,depth` rows) or D{YYYYMMDDHHmm}.json ({"depths": {geo_code: depth}}).
+"""
+
+import io
+import os
+import csv
+import json
+import queue
+import socket
+import threading
+import time
+from datetime import timedelta
+from pathlib import Path
+
+import numpy as np
+
+import config
+from flood_data import decode_batch, GEO_CODE_PROPERTY, DEPTHS_PROPERTY
+from pmtiles_writer import TileTemplate
+
+# Ingest directory layout (relative to the project directory)
+INGEST_DIR_NAME = "ingest"
+INBOX_SUBDIR = "inbox"
+PROCESSED_SUBDIR = "processed"
+FAILED_SUBDIR = "failed"
+MANIFEST_FILE = "nowcast_manifest.json"
+
+WATCH_INTERVAL = float(os.getenv("APP_INGEST_POLL_SECONDS", "2"))
+INBOX_SETTLE_SECONDS = 1.0   # Skip inbox files modified more recently (still being written)
+KEEP_VERSIONS = 2            # Open batch versions kept on disk for viewers mid-load
+DEPTH_DECIMALS = 3
+MAX_SLOT_GAP = 12             # Missing slots tolerated between END_TIME and a new slot
+
+# Server-Sent Events
+SSE_KEEPALIVE_SECONDS = 15
+SSE_SEND_TIMEOUT = 2.0
+SSE_RETRY_MS = 3000
+
+
+class EventBroadcaster:
+    """
+    Fan-out of Server-Sent Events to sockets detached from request handlers.
+
+    Events are queued and sent by a background thread: a viewer that stops
+    reading can hold a send for up to SSE_SEND_TIMEOUT, which must not stall
+    the ingest request that published the event.
+    """
+
+    def __init__(self):
+        self._clients = []
+        self._lock = threading.Lock()
+        self._events = queue.Queue()
+        self._sender = None
+
+    def add(self, sock, initial: bytes = b''):
+        """Adopt a socket whose response headers were already sent."""
+        sock.settimeout(SSE_SEND_TIMEOUT)
+        if not self._send(sock, f"retry: {SSE_RETRY_MS}\n\n".encode('utf-8') + initial):
+            return
+        with self._lock:
+            self._clients.append(sock)
+            if self._sender is None:
+                self._sender = threading.Thread(target=self._send_loop,
+                                                name="sse-sender", daemon=True)
+                self._sender.start()
+
+    def publish(self, event: str, data: dict):
+        """Queue an event for every connected client; returns immediately."""
+        with self._lock:
+            if not self._clients:
+                return
+        self._events.put(format_event(event, data))
+
+    def count(self) -> int:
+        """Number of connected clients."""
+        with self._lock:
+            return len(self._clients)
+
+    def close(self):
+        """Disconnect all clients."""
+        self._events.put(None)
+        with self._lock:
+            clients, self._clients = self._clients, []
+        for sock in clients:
+            self._close(sock)
+
+    def _broadcast(self, payload: bytes):
+        with self._lock:
+            clients = list(self._clients)
+        dead = [sock for sock in clients if not self._send(sock, payload)]
+        if dead:
+            with self._lock:
+                self._clients = [s for s in self._clients if s not in dead]
+            for sock in dead:
+                self._close(sock)
+
+    def _send_loop(self):
+        # Events in order; a keepalive comment after SSE_KEEPALIVE_SECONDS of quiet
+        while True:
+            try:
+                payload = self._events.get(timeout=SSE_KEEPALIVE_SECONDS)
+            except queue.Empty:
+                payload = b": keepalive\n\n"
+            if payload is None:
+                return
+            self._broadcast(payload)
+
+    @staticmethod
+    def _send(sock, payload: bytes) -> bool:
+        try:
+            sock.sendall(payload)
+            return True
+        except OSError:
+            return False
+
+    @staticmethod
+    def _close(sock):
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            sock.close()
+        except OSError:
+            pass
+
+
+def format_event(event: str, data: dict) -> bytes:
+    """Encode one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode('utf-8')
+
+
+def parse_slot_payload(body: bytes, content_type: str = '', timestamp: int = None) -> tuple:
+    """
+    Parse a slot output into (timestamp, {geo_code: depth}).
+
+    Accepts JSON ({"timestamp": ..., "depths": {geo_code: depth}} or
+    {"timestamp": ..., "geoCodes": [...], "depths": [...]}) or CSV
+    `geo_code,depth` rows with an optional header. For CSV the timestamp must
+    be given separately.
+
+    Raises:
+        ValueError: If the payload is malformed
+    """
+    text = body.decode('utf-8-sig')
+    if 'json' in content_type or text.lstrip().startswith('{'):
+        try:
+            data = json.loads(text)
+        except ValueError:
+            raise ValueError("Slot payload is not valid JSON")
+        if not isinstance(data, dict):
+            raise ValueError("Slot payload must be a JSON object")
+        timestamp = data.get("timestamp", timestamp)
+        depths = data.get("depths")
+        if isinstance(depths, list):
+            codes = data.get("geoCodes")
+            if not isinstance(codes, list) or len(codes) != len(depths):
+                raise ValueError("geoCodes and depths must be lists of the same length")
+            depths = dict(zip(codes, depths))
+        if not isinstance(depths, dict):
+            raise ValueError("Slot payload needs a depths object")
+    else:
+        depths = {}
+        for row in csv.reader(io.StringIO(text)):
+            if len(row) < 2 or not row[0].strip():
+                continue
+            try:
+                depths[row[0].strip()] = float(row[1]) if row[1].strip() else None
+            except ValueError:
+                if depths:
+                    raise ValueError(f"Invalid depth value for {row[0]}: {row[1]}")
+                # Header row
+
+    if timestamp is None:
+        raise ValueError("Slot timestamp is required (YYYYMMDDHHmm)")
+    try:
+        timestamp = int(timestamp)
+        config.parse_time(timestamp)
+    except (TypeError, ValueError):
+        raise ValueError("Slot timestamp must be in format YYYYMMDDHHmm")
+
+    clean = {}
+    for code, value in depths.items():
+        try:
+            clean[str(code)] = None if value is None else float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid depth value for {code}: {value}")
+    return timestamp, clean
+
+
+class NowcastIngestor:
+    """Appends live slots to open batch files and extends the time index."""
+
+    def __init__(self, project_dir, enabled: bool = False):
+        self.project_dir = Path(project_dir)
+        self.enabled = enabled
+        self.flood_dir = self.project_dir / config.PMTILES_FLOOD_DIR
+        self.ingest_dir = self.project_dir / INGEST_DIR_NAME
+        self.inbox_dir = self.ingest_dir / INBOX_SUBDIR
+        self.manifest_path = self.ingest_dir / MANIFEST_FILE
+        self.events = EventBroadcaster()
+
+        # Slots up to the configured END_TIME belong to the static batches
+        self._static_end = config.END_TIME
+        self._lock = threading.Lock()
+        self._manifest = {"endTime": None, "batches": {}}
+        self._template = None   # TileTemplate giving geometry for written batches
+        self._open = None       # Depth matrix of the batch being appended to
+        self._stop = threading.Event()
+        self._watcher = None
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+
+    def restore(self):
+        """Re-apply previously ingested slots to the time index (on startup)."""
+        if not self.manifest_path.exists():
+            return
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[Nowcast] Ignoring unreadable manifest: {e}")
+            return
+
+        for batch_start, entry in manifest.get("batches", {}).items():
+            if (self.flood_dir / entry["filename"]).exists():
+                config.register_batch_file(int(batch_start), entry["filename"])
+                self._manifest["batches"][batch_start] = entry
+        if manifest.get("endTime"):
+            config.extend_end_time(int(manifest["endTime"]))
+            self._manifest["endTime"] = manifest["endTime"]
+
+    def start(self):
+        """Start watching the inbox directory."""
+        self.inbox_dir.mkdir(parents=True, exist_ok=True)
+        self._watcher = threading.Thread(target=self._watch_loop, name="nowcast-watcher", daemon=True)
+        self._watcher.start()
+        print(f"[Nowcast] Watching {self.inbox_dir} every {WATCH_INTERVAL:g}s")
+
+    def stop(self):
+        """Stop the watcher and disconnect event subscribers."""
+        self._stop.set()
+        self.events.close()
+
+    # ------------------------------------------------------------------
+    # State
+    # ------------------------------------------------------------------
+
+    def get_state(self) -> dict:
+        """Current time index, as sent to viewers on connect."""
+        time_slots = config.get_time_slots()
+        return {
+            "success": True,
+            "ingestEnabled": self.enabled,
+            "timeSlots": time_slots,
+            "totalTimeSlots": len(time_slots),
+            "endTime": config.END_TIME,
+            "batchFiles": config.get_batch_files(),
+            "subscribers": self.events.count(),
+        }
+
+    def subscribe(self, sock):
+        """Attach a viewer's event-stream socket and send it the current state."""
+        self.events.add(sock, format_event("state", self.get_state()))
+
+    # ------------------------------------------------------------------
+    # Ingest
+    # ------------------------------------------------------------------
+
+    def ingest_slot(self, timestamp: int, depths: dict) -> dict:
+        """
+        Append one time slot and notify viewers.
+
+        Args:
+            timestamp: Slot time in format YYYYMMDDHHmm
+            depths: Mapping of geo_code -> depth in metres (None for no data)
+
+        Returns:
+            Dict describing the slot and the batch file it was written to
+
+        Raises:
+            ValueError: If the timestamp is off the slot grid or too far past END_TIME
+            FileExistsError: If the slot is already covered by the static batches
+            FileNotFoundError: If no batch file exists to take geometry from
+        """
+        start_dt = config.parse_time(config.START_TIME)
+        slot_dt = config.parse_time(timestamp)
+        offset_minutes = (slot_dt - start_dt).total_seconds() / 60
+        if offset_minutes < 0 or offset_minutes % config.INTERVAL:
+            raise ValueError(f"{timestamp} is not on the {config.INTERVAL}-minute slot grid "
+                             f"starting at {config.START_TIME}")
+
+        if timestamp <= self._static_end:
+            raise FileExistsError(f"Slot {timestamp} is already covered by the static batches "
+                                  f"(up to {self._static_end})")
+
+        index = config.get_time_slot_index(timestamp)
+        gap = index - config.get_time_slot_index(config.END_TIME) - 1
+        if gap > MAX_SLOT_GAP:
+            raise ValueError(f"Slot {timestamp} is {gap} slots past the current end time "
+                             f"{config.END_TIME} (at most {MAX_SLOT_GAP} may be missing)")
+        local_index = index % config.BATCH_SIZE
+        batch_start_dt = start_dt + timedelta(
+            minutes=(index - local_index) * config.INTERVAL)
+        batch_start = int(config.format_time(batch_start_dt))
+
+        with self._lock:
+            key = str(batch_start)
+            entry = self._manifest["batches"].get(key)
+            if entry is None:
+                # A partially filled static batch seeds the open batch (and is left as is)
+                entry = {"filename": f"{config.DEPTH_PROPERTY_PREFIX}{batch_start}.pmtiles",
+                         "version": 0, "slots": []}
+
+            template = self._get_template()
+            open_batch = self._get_open_batch(batch_start, entry, template)
+
+            rows = self._rows_for(open_batch["geoCodes"], depths)
+            open_batch["depths"][:, local_index] = np.nan
+            open_batch["depths"][rows[0], local_index] = rows[1]
+
+            slots = sorted(set(entry["slots"]) | {local_index})
+            texts = self._depth_texts(open_batch["depths"][:, :slots[-1] + 1])
+
+            version = entry["version"] + 1
+            filename = f"{config.DEPTH_PROPERTY_PREFIX}{batch_start}_v{version}.pmtiles"
+            template.write(self.flood_dir / filename, dict(zip(open_batch["geoCodes"].tolist(), texts)))
+
+            entry = {"filename": filename, "version": version, "slots": slots}
+            self._manifest["batches"][key] = entry
+            config.register_batch_file(batch_start, filename)
+            if config.extend_end_time(timestamp) or self._manifest["endTime"] is None:
+                self._manifest["endTime"] = config.END_TIME
+            self._save_manifest()
+            self._remove_old_versions(batch_start, version)
+
+        slot = config.get_time_slot_info(index)
+        slot["features"] = int(len(rows[0]))
+        print(f"[Nowcast] Slot {timestamp} -> {filename} ({slot['features']} features)")
+
+        self.events.publish("slot", {**self.get_state(), "slot": slot})
+        return {"success": True, "slot": slot, "batchFile": filename, "endTime": config.END_TIME}
+
+    def _get_template(self) -> TileTemplate:
+        """Return the geometry template, preferring the latest static batch file.
+
+        Loaded once; static batch files never change while the server runs.
+        """
+        if self._template is None:
+            existing = [b for b in config.get_batch_files() if (self.project_dir / b["path"]).exists()]
+            static = [b for b in existing if not b["live"]]
+            if not existing:
+                raise FileNotFoundError("No batch file available to use as a geometry template")
+            batch = (static or existing)[-1]
+            self._template = TileTemplate(self.project_dir / batch["path"], DEPTHS_PROPERTY, GEO_CODE_PROPERTY)
+            print(f"[Nowcast] Using {batch['filename']} as geometry template")
+        return self._template
+
+    def _get_open_batch(self, batch_start: int, entry: dict, template: TileTemplate) -> dict:
+        """Return the depth matrix for a batch, restoring it from disk if needed."""
+        if self._open is not None and self._open["batchStart"] == batch_start:
+            return self._open
+
+        geo_codes = np.array(sorted(template.join_values), dtype=str)
+        depths = np.full((len(geo_codes), config.BATCH_SIZE), np.nan, dtype=np.float32)
+        existing = self.flood_dir / entry["filename"]
+        if existing.exists():
+            depths = decode_batch(existing).align(geo_codes)
+
+        self._open = {"batchStart": batch_start, "geoCodes": geo_codes, "depths": depths}
+        return self._open
+
+    @staticmethod
+    def _rows_for(geo_codes: np.ndarray, depths: dict) -> tuple:
+        """Map slot depths onto batch rows, returning (row_indices, values)."""
+        if not depths or len(geo_codes) == 0:
+            return np.array([], dtype=int), np.array([], dtype=np.float32)
+        codes = np.array(list(depths.keys()), dtype=str)
+        values = np.array([np.nan if v is None else v for v in depths.values()], dtype=np.float32)
+        idx = np.clip(np.searchsorted(geo_codes, codes), 0, len(geo_codes) - 1)
+        found = geo_codes[idx] == codes
+        return idx[found], values[found]
+
+    @staticmethod
+    def _depth_texts(depths: np.ndarray) -> list:
+        """Encode each row as the JSON array string stored in flood_depths."""
+        rounded = np.round(depths.astype(np.float64), DEPTH_DECIMALS).tolist()
+        return [
+            "[" + ",".join("null" if v != v else f"{v:g}" for v in row) + "]"
+            for row in rounded
+        ]
+
+    def _save_manifest(self):
+        self.ingest_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.manifest_path.with_suffix(".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _remove_old_versions(self, batch_start: int, version: int):
+        prefix = f"{config.DEPTH_PROPERTY_PREFIX}{batch_start}_v"
+        for path in self.flood_dir.glob(f"{prefix}*.pmtiles"):
+            try:
+                old_version = int(path.stem[len(prefix):])
+            except ValueError:
+                continue
+            if old_version <= version - KEEP_VERSIONS:
+                path.unlink(missing_ok=True)
+
+    # ------------------------------------------------------------------
+    # Inbox watcher
+    # ------------------------------------------------------------------
+
+    def _watch_loop(self):
+        while not self._stop.wait(WATCH_INTERVAL):
+            try:
+                self.scan_inbox()
+            except Exception as e:
+                print(f"[Nowcast] Inbox scan failed: {e}")
+
+    def scan_inbox(self) -> int:
+        """Ingest settled slot files from the inbox in time order; returns the count."""
+        now = time.time()
+        files = sorted(
+            p for p in self.inbox_dir.glob(f"{config.DEPTH_PROPERTY_PREFIX}*")
+            if p.suffix in ('.csv', '.json') and now - p.stat().st_mtime >= INBOX_SETTLE_SECONDS
+        )
+        ingested = 0
+        for path in files:
+            try:
+                timestamp = int(path.stem[len(config.DEPTH_PROPERTY_PREFIX):])
+                timestamp, depths = parse_slot_payload(
+                    path.read_bytes(), 'application/json' if path.suffix == '.json' else 'text/csv', timestamp)
+                self.ingest_slot(timestamp, depths)
+                self._move(path, PROCESSED_SUBDIR)
+                ingested += 1
+            except (ValueError, OSError) as e:
+                print(f"[Nowcast] Rejected {path.name}: {e}")
+                self._move(path, FAILED_SUBDIR)
+        return ingested
+
+    def _move(self, path: Path, subdir: str):
+        target_dir = self.ingest_dir / subdir
+        target_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            os.replace(path, target_dir / path.name)
+        except OSError:
+            pass
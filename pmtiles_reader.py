@@ -0,0 +1,471 @@
+"""
+Minimal PMTiles v3 and Mapbox Vector Tile reader (stdlib only).
+
+Used server-side to decode flood batch files, so that depth series can be
+exported, compared and rendered without a browser.
+
+Supports:
+- PMTiles v3 header, root/leaf directories and JSON metadata
+- gzip or uncompressed directories and tiles
+- MVT layers, features, properties and geometry (tile coordinates)
+"""
+
+import gzip
+import json
+import math
+import struct
+from pathlib import Path
+
+HEADER_SIZE = 127
+
+COMPRESSION_UNKNOWN = 0
+COMPRESSION_NONE = 1
+COMPRESSION_GZIP = 2
+
+# MVT geometry commands
+CMD_MOVE_TO = 1
+CMD_LINE_TO = 2
+CMD_CLOSE_PATH = 7
+
+GEOM_POINT = 1
+GEOM_LINESTRING = 2
+GEOM_POLYGON = 3
+
+
+def read_varint(buf, pos: int) -> tuple:
+    """Decode a protobuf varint, returning (value, new_position)."""
+    result = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _zigzag(n: int) -> int:
+    """Decode a zigzag-encoded signed integer."""
+    return (n >> 1) ^ -(n & 1)
+
+
+def decompress(data: bytes, compression: int) -> bytes:
+    """Decompress directory or tile bytes."""
+    if compression in (COMPRESSION_NONE, COMPRESSION_UNKNOWN):
+        # Unknown: sniff for the gzip magic number
+        if compression == COMPRESSION_UNKNOWN and data[:2] == b'\x1f\x8b':
+            return gzip.decompress(data)
+        return data
+    if compression == COMPRESSION_GZIP:
+        return gzip.decompress(data)
+    raise ValueError(f"Unsupported PMTiles compression: {compression}")
+
+
+# ----------------------------------------------------------------------
+# Tile IDs (Hilbert curve ordering, per the PMTiles v3 spec)
+# ----------------------------------------------------------------------
+
+def _rotate(n: int, x: int, y: int, rx: int, ry: int) -> tuple:
+    if ry == 0:
+        if rx != 0:
+            x = n - 1 - x
+            y = n - 1 - y
+        x, y = y, x
+    return x, y
+
+
+def zxy_to_tileid(z: int, x: int, y: int) -> int:
+    """Convert z/x/y tile coordinates to a PMTiles tile ID."""
+    acc = ((1 << (z * 2)) - 1) // 3
+    a = z - 1
+    while a >= 0:
+        s = 1 << a
+        rx = s & x
+        ry = s & y
+        acc += ((3 * rx) ^ ry) << a
+        x, y = _rotate(s, x, y, rx, ry)
+        a -= 1
+    return acc
+
+
+def tileid_to_zxy(tile_id: int) -> tuple:
+    """Convert a PMTiles tile ID to (z, x, y)."""
+    acc = 0
+    for z in range(32):
+        num_tiles = 1 << (z * 2)
+        if acc + num_tiles > tile_id:
+            t = tile_id - acc
+            x = y = 0
+            s = 1
+            n = 1 << z
+            while s < n:
+                rx = 1 & (t // 2)
+                ry = 1 & (t ^ rx)
+                x, y = _rotate(s, x, y, rx, ry)
+                x += s * rx
+                y += s * ry
+                t //= 4
+                s *= 2
+            return z, x, y
+        acc += num_tiles
+    raise ValueError(f"Tile ID out of range: {tile_id}")
+
+
+def tile_to_lonlat(z: int, x: float, y: float) -> tuple:
+    """Convert fractional tile coordinates to (lon, lat) in degrees."""
+    n = 1 << z
+    lon = x / n * 360.0 - 180.0
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    return lon, lat
+
+
+def lonlat_to_tile(z: int, lon: float, lat: float) -> tuple:
+    """Convert (lon, lat) in degrees to fractional tile coordinates."""
+    n = 1 << z
+    lat = max(min(lat, 85.0511), -85.0511)
+    x = (lon + 180.0) / 360.0 * n
+    lat_rad = math.radians(lat)
+    y = (1 - math.log(math.tan(lat_rad) + 1 / math.cos(lat_rad)) / math.pi) / 2 * n
+    return x, y
+
+
+# ----------------------------------------------------------------------
+# PMTiles archive
+# ----------------------------------------------------------------------
+
+class PMTilesReader:
+    """Random-access reader for a local PMTiles v3 archive."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._f = open(self.path, 'rb')
+        self.header = self._read_header()
+        self._metadata = None
+
+    def close(self):
+        """Close the underlying file."""
+        try:
+            self._f.close()
+        except Exception:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _read(self, offset: int, length: int) -> bytes:
+        self._f.seek(offset)
+        return self._f.read(length)
+
+    def _read_header(self) -> dict:
+        data = self._read(0, HEADER_SIZE)
+        if len(data) < HEADER_SIZE or data[:7] != b'PMTiles':
+            raise ValueError(f"Invalid PMTiles file: {self.path.name}")
+        if data[7] != 3:
+            raise ValueError(f"Unsupported PMTiles version {data[7]}: {self.path.name}")
+
+        (root_offset, root_length, metadata_offset, metadata_length,
+         leaf_offset, leaf_length, tile_data_offset, tile_data_length,
+         addressed_tiles, tile_entries, tile_contents) = struct.unpack_from('<11Q', data, 8)
+        (clustered, internal_compression, tile_compression, tile_type,
+         min_zoom, max_zoom) = struct.unpack_from('<6B', data, 96)
+        min_lon, min_lat, max_lon, max_lat = struct.unpack_from('<4i', data, 102)
+        center_zoom = data[118]
+        center_lon, center_lat = struct.unpack_from('<2i', data, 119)
+
+        return {
+            "version": data[7],
+            "rootDirOffset": root_offset,
+            "rootDirLength": root_length,
+            "metadataOffset": metadata_offset,
+            "metadataLength": metadata_length,
+            "leafDirsOffset": leaf_offset,
+            "leafDirsLength": leaf_length,
+            "tileDataOffset": tile_data_offset,
+            "tileDataLength": tile_data_length,
+            "addressedTiles": addressed_tiles,
+            "tileEntries": tile_entries,
+            "tileContents": tile_contents,
+            "clustered": bool(clustered),
+            "internalCompression": internal_compression,
+            "tileCompression": tile_compression,
+            "tileType": tile_type,
+            "minZoom": min_zoom,
+            "maxZoom": max_zoom,
+            "bounds": [min_lon / 1e7, min_lat / 1e7, max_lon / 1e7, max_lat / 1e7],
+            "center": [center_lon / 1e7, center_lat / 1e7, center_zoom],
+        }
+
+    def get_metadata(self) -> dict:
+        """Return the archive's JSON metadata."""
+        if self._metadata is None:
+            h = self.header
+            raw = self._read(h["metadataOffset"], h["metadataLength"])
+            raw = decompress(raw, h["internalCompression"])
+            self._metadata = json.loads(raw) if raw else {}
+        return self._metadata
+
+    def _read_directory(self, offset: int, length: int) -> list:
+        """Deserialize a directory into [tile_id, offset, length, run_length] entries."""
+        buf = decompress(self._read(offset, length), self.header["internalCompression"])
+        pos = 0
+        count, pos = read_varint(buf, pos)
+        entries = [[0, 0, 0, 0] for _ in range(count)]
+
+        last_id = 0
+        for e in entries:
+            delta, pos = read_varint(buf, pos)
+            last_id += delta
+            e[0] = last_id
+        for e in entries:
+            e[3], pos = read_varint(buf, pos)
+        for e in entries:
+            e[2], pos = read_varint(buf, pos)
+        for i, e in enumerate(entries):
+            value, pos = read_varint(buf, pos)
+            if value == 0 and i > 0:
+                prev = entries[i - 1]
+                e[1] = prev[1] + prev[2]
+            else:
+                e[1] = value - 1
+        return entries
+
+    def iter_entries(self):
+        """Yield (tile_id, absolute_offset, length, run_length) for every tile entry."""
+        h = self.header
+        stack = [(h["rootDirOffset"], h["rootDirLength"])]
+        while stack:
+            offset, length = stack.pop()
+            for tile_id, rel_offset, rel_length, run_length in self._read_directory(offset, length):
+                if run_length == 0:
+                    stack.append((h["leafDirsOffset"] + rel_offset, rel_length))
+                else:
+                    yield tile_id, h["tileDataOffset"] + rel_offset, rel_length, run_length
+
+    def read_tile_data(self, offset: int, length: int) -> bytes:
+        """Read and decompress a tile entry returned by iter_entries()."""
+        return decompress(self._read(offset, length), self.header["tileCompression"])
+
+    def iter_tiles(self, zoom: int):
+        """Yield (x, y, tile_bytes) for every tile at the given zoom level."""
+        first_id = zxy_to_tileid(zoom, 0, 0)
+        end_id = first_id + (1 << (zoom * 2))
+        for tile_id, offset, length, run_length in self.iter_entries():
+            if tile_id + run_length <= first_id or tile_id >= end_id:
+                continue
+            data = None
+            for tid in range(max(tile_id, first_id), min(tile_id + run_length, end_id)):
+                if data is None:
+                    data = self.read_tile_data(offset, length)
+                _, x, y = tileid_to_zxy(tid)
+                yield x, y, data
+
+    def get_tile(self, z: int, x: int, y: int):
+        """Return decompressed tile bytes, or None if the tile is absent."""
+        tile_id = zxy_to_tileid(z, x, y)
+        h = self.header
+        offset, length = h["rootDirOffset"], h["rootDirLength"]
+        for _ in range(4):  # Spec allows at most 3 levels of leaf directories
+            entries = self._read_directory(offset, length)
+            lo, hi = 0, len(entries) - 1
+            found = None
+            while lo <= hi:
+                mid = (lo + hi) // 2
+                if entries[mid][0] <= tile_id:
+                    found = entries[mid]
+                    lo = mid + 1
+                else:
+                    hi = mid - 1
+            if found is None:
+                return None
+            entry_id, rel_offset, rel_length, run_length = found
+            if run_length == 0:
+                offset, length = h["leafDirsOffset"] + rel_offset, rel_length
+                continue
+            if tile_id >= entry_id + run_length:
+                return None
+            raw = self._read(h["tileDataOffset"] + rel_offset, rel_length)
+            return decompress(raw, h["tileCompression"])
+        return None
+
+
+# ----------------------------------------------------------------------
+# Mapbox Vector Tiles
+# ----------------------------------------------------------------------
+
+def decode_value(buf, pos: int, end: int):
+    """Decode an MVT Value message."""
+    value = None
+    while pos < end:
+        key, pos = read_varint(buf, pos)
+        field, wire = key >> 3, key & 7
+        if wire == 2:
+            n, pos = read_varint(buf, pos)
+            value = bytes(buf[pos:pos + n]).decode('utf-8')
+            pos += n
+        elif wire == 5:
+            value = struct.unpack_from('<f', buf, pos)[0]
+            pos += 4
+        elif wire == 1:
+            value = struct.unpack_from('<d', buf, pos)[0]
+            pos += 8
+        else:
+            raw, pos = read_varint(buf, pos)
+            if field == 6:
+                value = _zigzag(raw)
+            elif field == 7:
+                value = bool(raw)
+            elif field == 4 and raw >= 1 << 63:
+                value = raw - (1 << 64)
+            else:
+                value = raw
+    return value
+
+
+def _read_packed(buf, pos: int, end: int) -> list:
+    out = []
+    while pos < end:
+        v, pos = read_varint(buf, pos)
+        out.append(v)
+    return out
+
+
+def skip_field(buf, pos: int, wire: int) -> int:
+    if wire == 0:
+        _, pos = read_varint(buf, pos)
+        return pos
+    if wire == 1:
+        return pos + 8
+    if wire == 2:
+        n, pos = read_varint(buf, pos)
+        return pos + n
+    if wire == 5:
+        return pos + 4
+    raise ValueError(f"Unsupported protobuf wire type: {wire}")
+
+
+def decode_geometry(commands: list) -> list:
+    """Decode MVT geometry commands into rings/lines of (x, y) tile coordinates."""
+    parts = []
+    current = None
+    x = y = 0
+    i = 0
+    n = len(commands)
+    while i < n:
+        cmd = commands[i] & 7
+        count = commands[i] >> 3
+        i += 1
+        if cmd == CMD_MOVE_TO or cmd == CMD_LINE_TO:
+            for _ in range(count):
+                x += _zigzag(commands[i])
+                y += _zigzag(commands[i + 1])
+                i += 2
+                if cmd == CMD_MOVE_TO:
+                    current = [(x, y)]
+                    parts.append(current)
+                else:
+                    current.append((x, y))
+        elif cmd != CMD_CLOSE_PATH:
+            raise ValueError(f"Invalid MVT geometry command: {cmd}")
+    return parts
+
+
+def _decode_feature(buf, pos: int, end: int, keys: list, values: list,
+                    wanted: set, with_geometry: bool) -> dict:
+    feature = {"id": None, "type": 0, "properties": {}, "geometry": None}
+    tags = ()
+    geometry = ()
+    while pos < end:
+        key, pos = read_varint(buf, pos)
+        field, wire = key >> 3, key & 7
+        if field == 1 and wire == 0:
+            feature["id"], pos = read_varint(buf, pos)
+        elif field == 2 and wire == 2:
+            n, pos = read_varint(buf, pos)
+            tags = _read_packed(buf, pos, pos + n)
+            pos += n
+        elif field == 3 and wire == 0:
+            feature["type"], pos = read_varint(buf, pos)
+        elif field == 4 and wire == 2:
+            n, pos = read_varint(buf, pos)
+            if with_geometry:
+                geometry = _read_packed(buf, pos, pos + n)
+            pos += n
+        else:
+            pos = skip_field(buf, pos, wire)
+
+    props = feature["properties"]
+    for i in range(0, len(tags) - 1, 2):
+        name = keys[tags[i]]
+        if wanted is None or name in wanted:
+            props[name] = values[tags[i + 1]]
+    if with_geometry:
+        feature["geometry"] = decode_geometry(geometry)
+    return feature
+
+
+def _decode_layer(buf, pos: int, end: int, wanted: set, with_geometry: bool) -> dict:
+    layer = {"name": "", "extent": 4096, "version": 1, "features": []}
+    keys = []
+    values = []
+    feature_spans = []
+    while pos < end:
+        key, pos = read_varint(buf, pos)
+        field, wire = key >> 3, key & 7
+        if wire == 2:
+            n, pos = read_varint(buf, pos)
+            if field == 1:
+                layer["name"] = bytes(buf[pos:pos + n]).decode('utf-8')
+            elif field == 2:
+                feature_spans.append((pos, pos + n))
+            elif field == 3:
+                keys.append(bytes(buf[pos:pos + n]).decode('utf-8'))
+            elif field == 4:
+                values.append(decode_value(buf, pos, pos + n))
+            pos += n
+        elif wire == 0 and field in (5, 15):
+            v, pos = read_varint(buf, pos)
+            layer["extent" if field == 5 else "version"] = v
+        else:
+            pos = skip_field(buf, pos, wire)
+
+    # Features reference keys/values that may appear after them in the stream
+    layer["features"] = [
+        _decode_feature(buf, start, stop, keys, values, wanted, with_geometry)
+        for start, stop in feature_spans
+    ]
+    return layer
+
+
+def decode_mvt(data: bytes, properties=None, geometry: bool = True) -> dict:
+    """
+    Decode a vector tile.
+
+    Args:
+        data: Uncompressed MVT bytes
+        properties: Optional iterable of property names to keep (default: all)
+        geometry: Whether to decode feature geometry
+
+    Returns:
+        Dict of layer name -> {"name", "extent", "version", "features": [...]}
+        where each feature is {"id", "type", "properties", "geometry"}.
+    """
+    buf = memoryview(data)
+    wanted = set(properties) if properties is not None else None
+    layers = {}
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = read_varint(buf, pos)
+        field, wire = key >> 3, key & 7
+        if field == 3 and wire == 2:
+            n, pos = read_varint(buf, pos)
+            layer = _decode_layer(buf, pos, pos + n, wanted, geometry)
+            layers[layer["name"]] = layer
+            pos += n
+        else:
+            pos = skip_field(buf, pos, wire)
+    return layers
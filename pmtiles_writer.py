@@ -0,0 +1,298 @@
+"""
+PMTiles v3 writer and vector tile templating (stdlib only).
+
+Used by nowcast ingest to write the open batch file. Tiles are re-encoded
+from a template batch with only the flood_depths property replaced, so new
+time slots never require re-tiling or re-simplifying geometry.
+"""
+
+import os
+import gzip
+import json
+import struct
+from pathlib import Path
+
+from pmtiles_reader import (PMTilesReader, read_varint, skip_field, decode_value,
+                            HEADER_SIZE, COMPRESSION_GZIP, COMPRESSION_NONE)
+
+# Header + root directory must fit in the first 16 KB (pmtiles.js fetches that much)
+ROOT_DIRECTORY_MAX = 16384 - HEADER_SIZE
+LEAF_DIRECTORY_SIZE = 4096  # Entries per leaf directory (doubled until the root fits)
+
+
+def encode_varint(n: int) -> bytes:
+    """Encode a non-negative integer as a protobuf varint."""
+    out = bytearray()
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def _length_delimited(field: int, payload: bytes) -> bytes:
+    return encode_varint((field << 3) | 2) + encode_varint(len(payload)) + payload
+
+
+def _compress(data: bytes, compression: int) -> bytes:
+    if compression == COMPRESSION_GZIP:
+        return gzip.compress(data, compresslevel=6)
+    if compression == COMPRESSION_NONE:
+        return data
+    raise ValueError(f"Unsupported PMTiles compression: {compression}")
+
+
+# ----------------------------------------------------------------------
+# Archive writing
+# ----------------------------------------------------------------------
+
+def serialize_directory(entries: list) -> bytes:
+    """Serialize [tile_id, offset, length, run_length] entries (uncompressed)."""
+    out = [encode_varint(len(entries))]
+    last_id = 0
+    for e in entries:
+        out.append(encode_varint(e[0] - last_id))
+        last_id = e[0]
+    out.extend(encode_varint(e[3]) for e in entries)
+    out.extend(encode_varint(e[2]) for e in entries)
+    for i, e in enumerate(entries):
+        if i > 0 and e[1] == entries[i - 1][1] + entries[i - 1][2]:
+            out.append(encode_varint(0))
+        else:
+            out.append(encode_varint(e[1] + 1))
+    return b''.join(out)
+
+
+def _build_directories(entries: list, compression: int) -> tuple:
+    """Return (root_bytes, leaves_bytes), splitting into leaves if the root is too big."""
+    root = _compress(serialize_directory(entries), compression)
+    if len(root) <= ROOT_DIRECTORY_MAX:
+        return root, b''
+
+    leaf_size = LEAF_DIRECTORY_SIZE
+    while True:
+        root_entries = []
+        leaves = []
+        offset = 0
+        for i in range(0, len(entries), leaf_size):
+            chunk = entries[i:i + leaf_size]
+            leaf = _compress(serialize_directory(chunk), compression)
+            root_entries.append([chunk[0][0], offset, len(leaf), 0])
+            leaves.append(leaf)
+            offset += len(leaf)
+        root = _compress(serialize_directory(root_entries), compression)
+        if len(root) <= ROOT_DIRECTORY_MAX:
+            return root, b''.join(leaves)
+        leaf_size *= 2
+
+
+def write_pmtiles(path, tiles: list, header: dict, metadata: dict):
+    """
+    Write a PMTiles v3 archive atomically.
+
+    Args:
+        path: Destination file
+        tiles: List of (tile_id, uncompressed_tile_bytes), any order
+        header: Reader-style header dict supplying compression, tile type,
+                zoom range, bounds and center
+        metadata: JSON metadata
+    """
+    internal = header.get("internalCompression") or COMPRESSION_GZIP
+    tile_compression = header.get("tileCompression") or COMPRESSION_GZIP
+
+    entries = []
+    data = []
+    offset = 0
+    for tile_id, tile in sorted(tiles, key=lambda t: t[0]):
+        blob = _compress(tile, tile_compression)
+        entries.append([tile_id, offset, len(blob), 1])
+        data.append(blob)
+        offset += len(blob)
+
+    root, leaves = _build_directories(entries, internal)
+    meta = _compress(json.dumps(metadata).encode('utf-8'), internal)
+
+    root_offset = HEADER_SIZE
+    meta_offset = root_offset + len(root)
+    leaf_offset = meta_offset + len(meta)
+    data_offset = leaf_offset + len(leaves)
+
+    min_lon, min_lat, max_lon, max_lat = header["bounds"]
+    center_lon, center_lat, center_zoom = header["center"]
+    head = b'PMTiles' + bytes([3])
+    head += struct.pack('<11Q', root_offset, len(root), meta_offset, len(meta),
+                        leaf_offset, len(leaves), data_offset, offset,
+                        len(entries), len(entries), len(entries))
+    head += struct.pack('<6B', 1, internal, tile_compression, header["tileType"],
+                        header["minZoom"], header["maxZoom"])
+    head += struct.pack('<4i', round(min_lon * 1e7), round(min_lat * 1e7),
+                        round(max_lon * 1e7), round(max_lat * 1e7))
+    head += struct.pack('<B2i', center_zoom, round(center_lon * 1e7), round(center_lat * 1e7))
+
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, 'wb') as f:
+        f.write(head)
+        f.write(root)
+        f.write(meta)
+        f.write(leaves)
+        for blob in data:
+            f.write(blob)
+    os.replace(tmp_path, path)
+
+
+# ----------------------------------------------------------------------
+# Tile templates
+# ----------------------------------------------------------------------
+
+class _LayerTemplate:
+    """One MVT layer with a single string property left open per feature."""
+
+    __slots__ = ("head", "keys", "values", "features", "open_key")
+
+    def __init__(self, head: bytes, keys: list, values: list, features: list, open_key: int):
+        self.head = head          # Raw name/extent/version fields
+        self.keys = keys          # Key strings; the open property is last
+        self.values = values      # Raw Value messages still referenced
+        self.features = features  # [(raw_fields_without_tags, static_tags_bytes, join_value)]
+        self.open_key = open_key  # Index of the open property in keys
+
+    def encode(self, values_by_join: dict) -> bytes:
+        values = list(self.values)
+        value_index = {}
+        open_key = encode_varint(self.open_key)
+        features = []
+        for raw, static_tags, join in self.features:
+            tags = static_tags
+            text = values_by_join.get(join)
+            if text is not None:
+                idx = value_index.get(join)
+                if idx is None:
+                    idx = value_index[join] = len(values)
+                    values.append(_length_delimited(1, text.encode('utf-8')))
+                tags = static_tags + open_key + encode_varint(idx)
+            body = raw + (_length_delimited(2, tags) if tags else b'')
+            features.append(_length_delimited(2, body))
+
+        parts = [self.head]
+        parts.extend(features)
+        parts.extend(_length_delimited(3, k.encode('utf-8')) for k in self.keys)
+        parts.extend(_length_delimited(4, v) for v in values)
+        return _length_delimited(3, b''.join(parts))
+
+
+def _parse_layer(buf, pos: int, end: int, open_property: str, join_property: str) -> _LayerTemplate:
+    head = []
+    keys = []
+    values = []
+    spans = []
+    while pos < end:
+        field_start = pos
+        key, pos = read_varint(buf, pos)
+        field, wire = key >> 3, key & 7
+        if wire == 2 and field in (2, 3, 4):
+            n, pos = read_varint(buf, pos)
+            if field == 2:
+                spans.append((pos, pos + n))
+            elif field == 3:
+                keys.append(bytes(buf[pos:pos + n]).decode('utf-8'))
+            else:
+                values.append((pos, pos + n))
+            pos += n
+        else:
+            pos = skip_field(buf, pos, wire)
+            head.append(bytes(buf[field_start:pos]))
+
+    open_idx = keys.index(open_property) if open_property in keys else -1
+    join_idx = keys.index(join_property) if join_property in keys else -1
+
+    # Keep every key except the open one, which moves to the end
+    key_map = {}
+    new_keys = []
+    for i, k in enumerate(keys):
+        if i != open_idx:
+            key_map[i] = len(new_keys)
+            new_keys.append(k)
+    new_keys.append(open_property)
+
+    value_map = {}
+    new_values = []
+    features = []
+    for start, stop in spans:
+        raw = []
+        tags = []
+        p = start
+        while p < stop:
+            field_start = p
+            key, p = read_varint(buf, p)
+            field, wire = key >> 3, key & 7
+            if field == 2 and wire == 2:
+                n, p = read_varint(buf, p)
+                q = p
+                while q < p + n:
+                    v, q = read_varint(buf, q)
+                    tags.append(v)
+                p += n
+            else:
+                p = skip_field(buf, p, wire)
+                raw.append(bytes(buf[field_start:p]))
+
+        join = None
+        static_tags = []
+        for i in range(0, len(tags) - 1, 2):
+            k, v = tags[i], tags[i + 1]
+            if k == open_idx:
+                continue
+            if k == join_idx:
+                join = decode_value(buf, *values[v])
+            if v not in value_map:
+                value_map[v] = len(new_values)
+                new_values.append(bytes(buf[values[v][0]:values[v][1]]))
+            static_tags.append(key_map[k])
+            static_tags.append(value_map[v])
+        features.append((b''.join(raw), b''.join(encode_varint(t) for t in static_tags),
+                         None if join is None else str(join)))
+
+    return _LayerTemplate(b''.join(head), new_keys, new_values, features, len(new_keys) - 1)
+
+
+class TileTemplate:
+    """
+    All tiles of a batch file, ready to be re-encoded with new values for one
+    string property (e.g. flood_depths) keyed by another (e.g. geo_code).
+    """
+
+    def __init__(self, path, open_property: str, join_property: str):
+        self.path = Path(path)
+        self.open_property = open_property
+        self.join_property = join_property
+        self.tiles = []  # [(tile_ids, [_LayerTemplate, ...])]
+        self.join_values = set()
+
+        with PMTilesReader(self.path) as reader:
+            self.header = dict(reader.header)
+            self.metadata = reader.get_metadata()
+            for tile_id, offset, length, run_length in reader.iter_entries():
+                data = memoryview(reader.read_tile_data(offset, length))
+                layers = []
+                pos = 0
+                while pos < len(data):
+                    key, pos = read_varint(data, pos)
+                    field, wire = key >> 3, key & 7
+                    if field == 3 and wire == 2:
+                        n, pos = read_varint(data, pos)
+                        layer = _parse_layer(data, pos, pos + n, open_property, join_property)
+                        layers.append(layer)
+                        self.join_values.update(f[2] for f in layer.features if f[2] is not None)
+                        pos += n
+                    else:
+                        pos = skip_field(data, pos, wire)
+                self.tiles.append((range(tile_id, tile_id + run_length), layers))
+
+    def write(self, path, values_by_join: dict, metadata: dict = None):
+        """Write a PMTiles file with the open property set from values_by_join."""
+        tiles = []
+        for tile_ids, layers in self.tiles:
+            tile = b''.join(layer.encode(values_by_join) for layer in layers)
+            tiles.extend((tile_id, tile) for tile_id in tile_ids)
+        write_pmtiles(path, tiles, self.header, metadata if metadata is not None else self.metadata)
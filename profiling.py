@@ -0,0 +1,367 @@
+"""
+Request instrumentation for the HTTP server.
+
+- Per-request phase timings: parse (request headers), handler, serialize
+  (JSON encoding) and io (socket writes, file copies, request bodies).
+  The handler phase is whatever remains of the total, so only the three
+  explicit phases cost a perf_counter() pair each.
+- Per-route aggregates and a slow-request log for requests over a threshold.
+- A statistical sampling profiler that walks every thread's stack via
+  sys._current_frames() for a bounded number of seconds and returns
+  collapsed stacks (flamegraph.pl / speedscope input) or a top-functions table.
+"""
+
+import os
+import re
+import sys
+import math
+import time
+import threading
+from collections import Counter, deque
+
+# Slow-request log
+REQUEST_TIMINGS = os.getenv("APP_REQUEST_TIMINGS", "1") == "1"  # Switchable at runtime via /api/admin/timings
+SLOW_REQUEST_MS = float(os.getenv("APP_SLOW_REQUEST_MS", "500"))
+MAX_SLOW_REQUEST_MS = 600_000
+SLOW_LOG_SIZE = 200  # Most recent slow requests kept for /api/admin/timings
+
+# Sampling profiler
+PROFILE_INTERVAL_MS = 5
+MIN_PROFILE_INTERVAL_MS = 1
+MAX_PROFILE_INTERVAL_MS = 1000
+DEFAULT_PROFILE_SECONDS = 10
+MAX_PROFILE_SECONDS = 60
+MAX_STACK_DEPTH = 64
+TOP_FUNCTIONS = 50
+
+# Phases measured explicitly; "handler" is derived from the total
+TIMED_PHASES = ("parse", "serialize", "io")
+PHASES = ("parse", "handler", "serialize", "io")
+
+# Routes with path parameters are aggregated under one key
+PARAMETERISED_ROUTES = ("/api/raster/", "/api/pmtiles/")
+# Requests that are slow by design (they sleep for the profiling window)
+UNTIMED_ROUTES = ("/api/admin/profile",)
+
+# Stacks whose innermost frame is in one of these files are threads waiting for work
+IDLE_LEAF_FILES = ("threading.py", "queue.py", "selectors.py", "thread.py")
+
+
+def parse_profile_params(query: dict) -> dict:
+    """
+    Validate /api/admin/profile query parameters.
+
+    Args:
+        query: Parsed query string (as returned by urllib.parse.parse_qs)
+
+    Returns:
+        Dict with seconds, intervalMs, format and includeIdle
+
+    Raises:
+        ValueError: If a parameter is malformed or out of range
+    """
+    def number(name, default):
+        values = query.get(name)
+        try:
+            value = float(values[0]) if values and values[0].strip() else float(default)
+        except ValueError:
+            raise ValueError(f"{name} must be a number")
+        if not math.isfinite(value):
+            raise ValueError(f"{name} must be a finite number")
+        return value
+
+    seconds = number("seconds", DEFAULT_PROFILE_SECONDS)
+    if not 0 < seconds <= MAX_PROFILE_SECONDS:
+        raise ValueError(f"seconds must be in (0, {MAX_PROFILE_SECONDS}]")
+    interval = number("interval", PROFILE_INTERVAL_MS)
+    if not MIN_PROFILE_INTERVAL_MS <= interval <= MAX_PROFILE_INTERVAL_MS:
+        raise ValueError(f"interval must be in [{MIN_PROFILE_INTERVAL_MS}, {MAX_PROFILE_INTERVAL_MS}] ms")
+    output = query.get("format", ["collapsed"])[0]
+    if output not in ("collapsed", "json"):
+        raise ValueError("format must be 'collapsed' or 'json'")
+
+    return {
+        "seconds": seconds,
+        "intervalMs": interval,
+        "format": output,
+        "includeIdle": query.get("idle", ["0"])[0] == "1",
+    }
+
+
+def parse_timings_params(query: dict) -> dict:
+    """
+    Validate POST /api/admin/timings query parameters.
+
+    Args:
+        query: Parsed query string (as returned by urllib.parse.parse_qs)
+
+    Returns:
+        Dict with enabled (bool) and slowMs (float); either is None when not given
+
+    Raises:
+        ValueError: If a parameter is malformed or out of range
+    """
+    enabled = None
+    values = query.get("enabled")
+    if values:
+        if values[0] not in ("0", "1"):
+            raise ValueError("enabled must be 0 or 1")
+        enabled = values[0] == "1"
+
+    slow_ms = None
+    values = query.get("slowMs")
+    if values:
+        try:
+            slow_ms = float(values[0])
+        except ValueError:
+            raise ValueError("slowMs must be a number")
+        if not (math.isfinite(slow_ms) and 0 <= slow_ms <= MAX_SLOW_REQUEST_MS):
+            raise ValueError(f"slowMs must be in [0, {MAX_SLOW_REQUEST_MS}]")
+
+    return {"enabled": enabled, "slowMs": slow_ms}
+
+
+def route_key(path: str) -> str:
+    """Collapse a request path into the route it is aggregated under."""
+    url_path = (path or "").split("?", 1)[0]
+    if url_path.startswith("/api/"):
+        for prefix in PARAMETERISED_ROUTES:
+            if url_path.startswith(prefix):
+                return prefix + "*"
+        return url_path
+    if url_path.endswith(".pmtiles"):
+        return "pmtiles"
+    return "static"
+
+
+class RequestTimer:
+    """
+    Phase timer for one request.
+
+    Used as `with timer.phase("io"): ...`. A phase entered while another is
+    active is counted towards the outer one, so nested helpers never double
+    count.
+    """
+
+    __slots__ = ("start", "phases", "status", "bytes", "_pending", "_active", "_depth", "_t0")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = dict.fromkeys(TIMED_PHASES, 0.0)
+        self.status = None
+        self.bytes = None
+        self._pending = None
+        self._active = None
+        self._depth = 0
+        self._t0 = 0.0
+
+    def phase(self, name: str) -> "RequestTimer":
+        self._pending = name
+        return self
+
+    def __enter__(self):
+        if self._active is None:
+            self._active = self._pending
+            self._t0 = time.perf_counter()
+        else:
+            self._depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._depth:
+            self._depth -= 1
+        else:
+            self.phases[self._active] += time.perf_counter() - self._t0
+            self._active = None
+        return False
+
+    def breakdown(self) -> dict:
+        """Return the total and every phase in seconds."""
+        total = time.perf_counter() - self.start
+        result = dict(self.phases)
+        result["handler"] = max(total - sum(self.phases.values()), 0.0)
+        result["total"] = total
+        return result
+
+
+class _NullTimer:
+    """Timer stand-in before a request line has been parsed."""
+
+    __slots__ = ()
+
+    def phase(self, name: str) -> "_NullTimer":
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_TIMER = _NullTimer()
+
+
+class RequestTimings:
+    """
+    Per-route phase statistics and the slow-request log.
+
+    Slow requests are handed to slow_sink, a non-blocking callable taking the
+    entry dict (the server passes AccessLog.log_slow); without one they are
+    only kept for get_stats(). While disabled, record() ignores requests.
+    """
+
+    def __init__(self, slow_ms: float = SLOW_REQUEST_MS, slow_log_size: int = SLOW_LOG_SIZE,
+                 slow_sink=None, enabled: bool = REQUEST_TIMINGS):
+        self.enabled = enabled
+        self.slow_threshold = slow_ms / 1000.0
+        self.slow_sink = slow_sink
+        self._routes = {}  # route -> {"count", "total", phase sums..., "max"}
+        self._slow = deque(maxlen=slow_log_size)
+        self._lock = threading.Lock()
+
+    def record(self, method: str, path: str, timer: RequestTimer):
+        """Add a finished request to the aggregates; log it if it was slow."""
+        if not self.enabled:
+            return
+        route = route_key(path)
+        if route in UNTIMED_ROUTES:
+            return
+        timings = timer.breakdown()
+        total = timings["total"]
+
+        with self._lock:
+            stats = self._routes.get(route)
+            if stats is None:
+                stats = self._routes[route] = dict.fromkeys(("count", "total", "max") + PHASES, 0.0)
+            stats["count"] += 1
+            stats["total"] += total
+            stats["max"] = max(stats["max"], total)
+            for name in PHASES:
+                stats[name] += timings[name]
+
+        if total < self.slow_threshold:
+            return
+
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "method": method,
+            "path": path,
+            "route": route,
+            "status": timer.status,
+            "bytes": timer.bytes,
+            "totalMs": round(total * 1000, 2),
+            "phasesMs": {name: round(timings[name] * 1000, 2) for name in PHASES},
+        }
+        with self._lock:
+            self._slow.append(entry)
+        # Printing here would put a possibly blocking stdout write on the request thread
+        if self.slow_sink is not None:
+            self.slow_sink(entry)
+
+    def configure(self, enabled: bool = None, slow_ms: float = None):
+        """Switch recording on/off and/or change the slow threshold; None leaves a setting as is."""
+        if enabled is not None:
+            self.enabled = enabled
+        if slow_ms is not None:
+            self.slow_threshold = slow_ms / 1000.0
+        print(f"[Timings] {'enabled' if self.enabled else 'disabled'}, "
+              f"slow threshold {self.slow_threshold * 1000:g} ms")
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            routes = {}
+            for route, stats in sorted(self._routes.items()):
+                count = stats["count"]
+                routes[route] = {
+                    "count": int(count),
+                    "meanMs": round(stats["total"] / count * 1000, 3),
+                    "maxMs": round(stats["max"] * 1000, 3),
+                    "meanPhasesMs": {name: round(stats[name] / count * 1000, 3) for name in PHASES},
+                }
+            return {
+                "enabled": self.enabled,
+                "slowThresholdMs": round(self.slow_threshold * 1000, 2),
+                "routes": routes,
+                "slowRequests": list(self._slow),
+            }
+
+
+class SamplingProfiler:
+    """Statistical profiler over all threads; one profile may run at a time."""
+
+    def __init__(self):
+        self._running = threading.Lock()
+
+    def run(self, seconds: float, interval_ms: float = PROFILE_INTERVAL_MS,
+            include_idle: bool = False) -> dict:
+        """
+        Sample every thread's stack for `seconds` from the calling thread.
+
+        Raises:
+            RuntimeError: If another profile is already running
+        """
+        if not self._running.acquire(blocking=False):
+            raise RuntimeError("A profile is already running")
+        try:
+            caller = threading.get_ident()
+            names = {}
+            stacks = Counter()
+            samples = 0
+            interval = max(interval_ms, 1) / 1000.0
+            deadline = time.perf_counter() + seconds
+
+            while time.perf_counter() < deadline:
+                for ident, frame in sys._current_frames().items():
+                    if ident == caller:
+                        continue
+                    if not include_idle and os.path.basename(frame.f_code.co_filename) in IDLE_LEAF_FILES:
+                        continue
+                    name = names.get(ident)
+                    if name is None:
+                        names.update((t.ident, _thread_group(t.name)) for t in threading.enumerate())
+                        name = names.get(ident, "thread")
+                    stacks[_collapse(frame, name)] += 1
+                samples += 1
+                time.sleep(interval)
+
+            return {"seconds": seconds, "intervalMs": interval * 1000, "samples": samples, "stacks": stacks}
+        finally:
+            self._running.release()
+
+
+def _thread_group(name: str) -> str:
+    # http-worker-3 and http-worker-7 belong in the same flame graph tower
+    return re.sub(r"[-_]\d+$", "", name or "thread")
+
+
+def _collapse(frame, thread_name: str) -> str:
+    """Render a stack as 'thread;outer;...;inner' (root first)."""
+    parts = []
+    while frame is not None and len(parts) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        # co_qualname (Class.method) is Python 3.11+
+        parts.append(f"{os.path.basename(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}")
+        frame = frame.f_back
+    parts.append(thread_name)
+    return ";".join(reversed(parts))
+
+
+def format_collapsed(profile: dict) -> str:
+    """Collapsed-stack text: one 'frames count' line per distinct stack."""
+    return "".join(f"{stack} {count}\n" for stack, count in profile["stacks"].most_common())
+
+
+def top_functions(profile: dict, limit: int = TOP_FUNCTIONS) -> list:
+    """Functions ranked by self samples, with inclusive (total) samples."""
+    own = Counter()
+    total = Counter()
+    for stack, count in profile["stacks"].items():
+        frames = stack.split(";")[1:]
+        if not frames:
+            continue
+        own[frames[-1]] += count
+        for name in set(frames):
+            total[name] += count
+    return [{"function": name, "self": count, "total": total[name]}
+            for name, count in own.most_common(limit)]
@@ -85,6 +85,50 @@ class APIBridge {
         return this._request('/api/health');
     }
 
+    /**
+     * Get available flood runs (default batch directory plus scenario runs)
+     */
+    async getScenarios() {
+        return this._cachedRequest('/api/scenarios', 'scenarios');
+    }
+
+    /**
+     * Compare two runs (computed and cached on the server)
+     * @param {string} scenario - Scenario run name
+     * @param {string} base - Base run name (default: 'default')
+     * @param {string} view - 'diff' (summary), 'layer' (GeoJSON points) or 'wards' (per-ward table)
+     */
+    async getScenarioDiff(scenario, base = 'default', view = 'diff') {
+        const params = new URLSearchParams({ base, scenario });
+        const path = view === 'diff' ? '/api/scenarios/diff' : `/api/scenarios/diff/${view}`;
+        return this._request(`${path}?${params}`);
+    }
+
+    /**
+     * Subscribe to live nowcast updates (Server-Sent Events)
+     * The server sends a 'state' event on connect and a 'slot' event for
+     * every ingested time slot; EventSource reconnects on its own.
+     * @param {Function} onUpdate - Called with { type, timeSlots, batchFiles, endTime, slot? }
+     * @returns {Function} Unsubscribe function
+     */
+    subscribeNowcast(onUpdate) {
+        if (typeof EventSource === 'undefined') return () => {};
+        
+        const source = new EventSource(`${this.baseUrl}/api/nowcast/events`);
+        const handle = (type) => (event) => {
+            try {
+                const data = JSON.parse(event.data);
+                if (type === 'slot') this.clearCache('config');
+                onUpdate({ type, ...data });
+            } catch (e) {
+                console.error('APIBridge nowcast event error:', e);
+            }
+        };
+        source.addEventListener('state', handle('state'));
+        source.addEventListener('slot', handle('slot'));
+        return () => source.close();
+    }
+
     /**
      * Build PMTiles URL for a given time slot (legacy - now returns master file URL)
      * @deprecated Use getBatchPMTilesUrl() instead
@@ -102,6 +146,15 @@ class APIBridge {
         return `${this.baseUrl}/pmtiles/flood/flood_depth_master.pmtiles`;
     }
 
+    /**
+     * Get the server-rendered raster tile URL template for a time slot
+     * @param {number} timeIndex - Global time slot index (0-based)
+     * @param {string} style - Colour ramp: 'multiclass' or 'binary'
+     */
+    getRasterTileUrl(timeIndex, style = 'multiclass') {
+        return `${this.baseUrl}/api/raster/${timeIndex}/{z}/{x}/{y}.png?style=${encodeURIComponent(style)}`;
+    }
+
     /**
      * Get batch PMTiles URL for a specific batch file
      * @param {string} batchFilename - The batch file name (e.g., "D202507130200.pmtiles")
@@ -121,6 +121,7 @@ const AppEvents = {
     TIME_PLAY: 'time:play',
     TIME_PAUSE: 'time:pause',
     TIME_SLOTS_UPDATED: 'time:slots-updated',
+    NOWCAST_UPDATE: 'time:nowcast-update',
     
     // Map events
     MAP_READY: 'map:ready',
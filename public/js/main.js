@@ -39,6 +39,7 @@ class PMTilesViewerApp {
         this.modules = {};
         this.isInitialized = false;
         this._statsInterval = null;
+        this._unsubscribeNowcast = null;
     }
 
     /**
@@ -72,6 +73,9 @@ class PMTilesViewerApp {
             // Start stats update interval
             this._startStatsUpdater();
             
+            // Receive newly ingested time slots without polling
+            this._subscribeNowcast();
+            
             this.isInitialized = true;
             this.modules.logger.success('Application initialized successfully');
             
@@ -229,6 +233,11 @@ class PMTilesViewerApp {
         
         // Time change events - switch to new time slot (batch-aware)
         eventBus.on(AppEvents.TIME_CHANGE, async ({ timeSlot, index }) => {
+            if (mapManager.rasterMode) {
+                mapManager.showRasterTimeSlot(index);
+                mapManager.setLayerOpacity(uiController.getOpacity());
+                return;
+            }
             // Pass both index and timeSlot to mapManager
             if (mapManager._masterPMTilesLoaded) {
                 // Switch time slot (will load new batch if needed - smooth transition)
@@ -353,6 +362,28 @@ class PMTilesViewerApp {
         logger.info('Event bus configured');
     }
 
+    /**
+     * Subscribe to live nowcast updates and extend the time range as slots arrive
+     */
+    _subscribeNowcast() {
+        const { mapManager, timeController, precipitationGraph } = this.modules;
+        
+        this._unsubscribeNowcast = apiBridge.subscribeNowcast((update) => {
+            if (!update.timeSlots?.length) return;
+            
+            this.config.timeSlots = update.timeSlots;
+            this.config.batchFiles = update.batchFiles;
+            this.config.endTime = update.endTime;
+            
+            // Batch files first, so a live-edge jump loads the right file
+            mapManager.refreshBatchFiles(update.batchFiles);
+            if (timeController.appendTimeSlots(update.timeSlots)) {
+                precipitationGraph?.setTimeSlots(update.timeSlots);
+            }
+            eventBus.emit(AppEvents.NOWCAST_UPDATE, update);
+        });
+    }
+
     /**
      * Initialize map and load initial data
      */
@@ -379,7 +410,12 @@ class PMTilesViewerApp {
                 const initialTimeSlot = timeController.getCurrentTimeSlot();
                 const initialIndex = timeController.getCurrentIndex();
                 
-                if (initialTimeSlot) {
+                if (initialTimeSlot && mapManager.rasterMode) {
+                    // Server-rendered tiles: nothing to preload
+                    mapManager.showRasterTimeSlot(initialIndex);
+                    mapManager.setLayerOpacity(uiController.getOpacity());
+                    logger.success('Raster mode: flood tiles rendered by the server');
+                } else if (initialTimeSlot) {
                     uiController.showLoading('Loading initial data...');
                     // Pass index and timeSlot to batch-aware loadPMTiles
                     const success = await mapManager.loadPMTiles(initialIndex, initialTimeSlot);
@@ -477,6 +513,30 @@ class PMTilesViewerApp {
         return this.config;
     }
 
+    /**
+     * Compare a scenario run against a base run: show the diff layer and return
+     * the summary and per-ward table (computed once on the server)
+     */
+    async compareScenarios(scenario, base = 'default') {
+        const { mapManager, logger } = this.modules;
+        const [summary, layer, wards] = await Promise.all([
+            apiBridge.getScenarioDiff(scenario, base),
+            apiBridge.getScenarioDiff(scenario, base, 'layer'),
+            apiBridge.getScenarioDiff(scenario, base, 'wards')
+        ]);
+        mapManager.showScenarioDiffLayer(layer);
+        logger.info(`${scenario} vs ${base}: ${summary.counts.newlyFlooded} newly flooded, ` +
+                    `mean peak delta ${summary.peakDelta.mean ?? '--'} m`);
+        return { summary, wards: wards.wards };
+    }
+
+    /**
+     * Remove the scenario comparison layer
+     */
+    clearScenarioComparison() {
+        this.modules.mapManager.hideScenarioDiffLayer();
+    }
+
     /**
      * Export logs
      */
@@ -519,6 +579,7 @@ class PMTilesViewerApp {
      */
     destroy() {
         this._stopStatsUpdater();
+        this._unsubscribeNowcast?.();
         this.modules.polygonAnalytics?.destroy();
         this.modules.mapManager?.destroy();
         this.modules.timeController?.destroy();
@@ -52,6 +52,9 @@ class MapManager {
         this.currentTimeIndex = 0; // Global time slot index
         this.currentLocalIndex = 0; // Index within current batch (0-47)
         
+        // Raster mode (?raster=1): server-rendered PNG tiles for low-power clients
+        this.rasterMode = new URLSearchParams(window.location.search).get('raster') === '1';
+        
         // Feature state tracking for depth values
         // We use feature-state because MapLibre can't parse JSON arrays in expressions
         this._featureDepthCache = new Map(); // geo_code -> parsed flood_depths array
@@ -657,6 +660,26 @@ class MapManager {
         this.logger.info(`Batch config updated: ${this.batchConfig.batchFiles.length} batch files, ${this.batchConfig.batchSize} slots per batch`);
     }
 
+    /**
+     * Apply batch files from a nowcast update
+     * Reloads the current batch (double-buffered) if the server rewrote it.
+     * @param {Array} batchFiles - Batch file list from the nowcast event
+     */
+    refreshBatchFiles(batchFiles) {
+        if (!batchFiles?.length) return;
+        this.batchConfig.batchFiles = batchFiles;
+        
+        const currentIndex = this.batchConfig.currentBatchIndex;
+        const current = batchFiles[currentIndex];
+        if (!this._masterPMTilesLoaded || currentIndex < 0 || !current) return;
+        
+        if (current.filename !== this.batchConfig.currentBatchFile) {
+            this.logger.info(`Nowcast: reloading ${current.filename}`);
+            this.batchConfig.currentBatchIndex = -1;
+            this.loadPMTiles(this.currentTimeIndex || 0, this.currentDepthProperty);
+        }
+    }
+
     /**
      * Get the current active layer IDs based on suffix
      * @returns {Object} Object with fillId, outlineId, sourceId
@@ -1188,6 +1211,11 @@ class MapManager {
     }
 
     changeLayerType(layerType) {
+        if (this.rasterMode && this.map?.getSource('flood-raster')) {
+            this.currentLayerType = layerType;
+            this.showRasterTimeSlot(this.currentTimeIndex || 0);
+            return;
+        }
         if (!this.map || !this.currentLayerConfig) return;
         
         this.currentLayerType = layerType;
@@ -1388,6 +1416,9 @@ class MapManager {
         if (this.map?.getLayer(activeFillId)) {
             this.map.setPaintProperty(activeFillId, 'fill-opacity', opacity);
         }
+        if (this.map?.getLayer('flood-raster-layer')) {
+            this.map.setPaintProperty('flood-raster-layer', 'raster-opacity', opacity);
+        }
     }
 
     changeBaseStyle(style) {
@@ -1422,6 +1453,11 @@ class MapManager {
                 }
             }
             
+            // Re-add server-rendered raster layer
+            if (this.rasterMode) {
+                this.showRasterTimeSlot(this.currentTimeIndex || 0);
+            }
+            
             // Re-add PMTiles layers with current local index
             if (this.currentLayerConfig) {
                 try {
@@ -1896,6 +1932,85 @@ class MapManager {
         ];
     }
 
+    /**
+     * Show a scenario comparison as a point layer coloured by peak-depth delta
+     * @param {Object} geojson - FeatureCollection from /api/scenarios/diff/layer
+     */
+    showScenarioDiffLayer(geojson) {
+        if (!this.map) return false;
+        
+        const source = this.map.getSource('scenario-diff');
+        if (source) {
+            source.setData(geojson);
+        } else {
+            this.map.addSource('scenario-diff', { type: 'geojson', data: geojson });
+            this.map.addLayer({
+                id: 'scenario-diff-layer',
+                type: 'circle',
+                source: 'scenario-diff',
+                paint: {
+                    'circle-radius': ['interpolate', ['linear'], ['zoom'], 10, 2, 14, 6],
+                    // Diverging ramp: shallower in the scenario (blue) -> deeper (red)
+                    'circle-color': [
+                        'case',
+                        ['==', ['get', 'status'], 'newlyFlooded'], '#7c3aed',
+                        [
+                            'interpolate', ['linear'], ['coalesce', ['get', 'peakDelta'], 0],
+                            -0.5, '#2563eb',
+                            0, '#f8fafc',
+                            0.5, '#dc2626'
+                        ]
+                    ],
+                    'circle-stroke-color': '#334155',
+                    'circle-stroke-width': 0.5,
+                    'circle-opacity': 0.9
+                }
+            });
+        }
+        this.logger.success(`Scenario diff layer: ${geojson.features.length} features`);
+        return true;
+    }
+
+    /**
+     * Show a time slot using server-rendered raster tiles (no vector decoding on the client)
+     * @param {number} timeIndex - Global time slot index (0-based)
+     */
+    showRasterTimeSlot(timeIndex) {
+        if (!this.map) return false;
+        
+        const tiles = [apiBridge.getRasterTileUrl(timeIndex, this.currentLayerType || 'multiclass')];
+        const source = this.map.getSource('flood-raster');
+        this.currentTimeIndex = timeIndex;
+        
+        if (source?.setTiles) {
+            source.setTiles(tiles);
+        } else {
+            this._cleanupLayerById('flood-raster-layer');
+            if (source) this.map.removeSource('flood-raster');
+            this.map.addSource('flood-raster', { type: 'raster', tiles, tileSize: 256 });
+            this.map.addLayer({
+                id: 'flood-raster-layer',
+                type: 'raster',
+                source: 'flood-raster',
+                // Nearest sampling keeps cell edges crisp when overzoomed
+                paint: { 'raster-resampling': 'nearest', 'raster-fade-duration': 0 }
+            });
+        }
+        eventBus.emit(AppEvents.MAP_LAYER_LOADED, { timeIndex, switchOnly: true, raster: true });
+        return true;
+    }
+
+    /**
+     * Remove the scenario comparison layer
+     */
+    hideScenarioDiffLayer() {
+        if (!this.map) return;
+        this._cleanupLayerById('scenario-diff-layer');
+        if (this.map.getSource('scenario-diff')) {
+            this.map.removeSource('scenario-diff');
+        }
+    }
+
     /**
      * Legacy method - kept for compatibility but now unused
      * @deprecated Use _getFeatureStateColorExpression instead
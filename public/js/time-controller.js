@@ -330,6 +330,32 @@ class TimeController {
         eventBus.emit(AppEvents.TIME_SLOTS_UPDATED, newSlots);
     }
 
+    /**
+     * Extend the time range with newly ingested slots without resetting playback.
+     * If the slider sits on the last slot (and is not playing) it follows the live edge.
+     * @param {Array} timeSlots - Full, updated list of time slots
+     * @returns {boolean} True if the range grew
+     */
+    appendTimeSlots(timeSlots) {
+        if (!timeSlots || timeSlots.length <= this.timeSlots.length) return false;
+        
+        const followLiveEdge = !this.isPlaying && this.currentIndex === this.timeSlots.length - 1;
+        const added = timeSlots.length - this.timeSlots.length;
+        this.timeSlots = timeSlots;
+        
+        const { slider, timeEnd } = this.elements;
+        if (slider) slider.max = Math.max(0, this.timeSlots.length - 1);
+        if (timeEnd) timeEnd.textContent = this._formatTimeSlot(this.timeSlots[this.timeSlots.length - 1]);
+        
+        this.logger.info(`Nowcast: ${added} new time slot(s), now ${this.timeSlots.length}`);
+        eventBus.emit(AppEvents.TIME_SLOTS_UPDATED, this.timeSlots);
+        
+        if (followLiveEdge) {
+            this.setTimeIndex(this.timeSlots.length - 1);
+        }
+        return true;
+    }
+
     /**
      * Cleanup resources
      */
@@ -0,0 +1,465 @@
+"""
+Server-side raster tiles of flood depth.
+
+Renders /api/raster/{slot}/{z}/{x}/{y}.png on the CPU for clients that cannot
+afford the vector path (field tablets) and for static report images.
+
+Rendering is split in two so playback stays cheap:
+- Geometry: the batch's vector tile is rasterized once per (batch, z, x, y)
+  into a feature-index image with a vectorized scanline (even-odd) fill.
+  Geometry is the same for all 48 slots of a batch, so this is cached
+  together with the depths of the features in the tile. Decoding and
+  rasterizing run in the shared process pool, off the HTTP threads.
+- Colour: per slot, each feature's depth goes through the viewer's colour
+  ramp and the index image is used as a lookup table, then PNG-encoded.
+
+Encoded tiles go into an in-memory LRU and an on-disk cache, and while a
+client plays through time the next slots of each requested tile are
+rendered in the background.
+"""
+
+import os
+import re
+import bisect
+import shutil
+import zlib
+import struct
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+import config
+from flood_data import load_batch, get_process_pool, GEO_CODE_PROPERTY
+from pmtiles_reader import PMTilesReader, decode_mvt
+
+TILE_SIZE = 256
+RASTER_CACHE_SUBDIR = "raster"
+# Separates run, batch and version in disk cache directory names (cannot occur in any)
+CACHE_NAME_SEPARATOR = "+"
+MEMORY_CACHE_BYTES = int(os.getenv("APP_RASTER_CACHE_MB", "64")) * 1024 * 1024
+INDEX_CACHE_SIZE = 128        # Rasterized geometry images kept in memory
+PNG_COMPRESSION = 6
+
+# Background pre-rendering during playback (5 slots = 1 s at 5 fps)
+PRERENDER_AHEAD = 5
+PRERENDER_WORKERS = 2
+PRERENDER_MAX_PENDING = 256
+
+MAX_ZOOM = 22
+
+# Viewer colour ramps (map-manager.js _getFeatureStateColorExpression)
+MULTICLASS_STOPS = [
+    (0.001, "#f5fbff"),
+    (0.2, "#d6ecff"),
+    (0.5, "#9dd1ff"),
+    (1.0, "#5aa8ff"),
+    (2.0, "#1e6ddf"),
+    (3.0, "#0b3a8c"),
+]
+BINARY_FLOODED = "#ef4444"   # depth > 1 m
+BINARY_SHALLOW = "#10b981"   # 0 < depth <= 1 m
+BINARY_THRESHOLD = 1.0
+
+STYLES = ("multiclass", "binary")
+
+TILE_PATH_PATTERN = re.compile(r"^/api/raster/([^/]+)/(\d+)/(\d+)/(\d+)\.png$")
+
+
+def _hex_to_rgb(value: str) -> tuple:
+    value = value.lstrip("#")
+    return tuple(int(value[i:i + 2], 16) for i in (0, 2, 4))
+
+
+_STOP_DEPTHS = np.array([d for d, _ in MULTICLASS_STOPS])
+_STOP_RGB = np.array([_hex_to_rgb(c) for _, c in MULTICLASS_STOPS], dtype=np.float64)
+
+
+def depth_colours(depths: np.ndarray, style: str = "multiclass") -> np.ndarray:
+    """Map depths to RGBA (k, 4) uint8; depth <= 0 or missing is transparent."""
+    depths = np.asarray(depths, dtype=np.float64)
+    rgba = np.zeros((len(depths), 4), dtype=np.uint8)
+    wet = depths > 0  # NaN compares False
+    if style == "binary":
+        rgba[wet & (depths > BINARY_THRESHOLD), :3] = _hex_to_rgb(BINARY_FLOODED)
+        rgba[wet & (depths <= BINARY_THRESHOLD), :3] = _hex_to_rgb(BINARY_SHALLOW)
+    else:
+        # np.interp clamps outside the stops, like MapLibre's interpolate
+        for channel in range(3):
+            rgba[wet, channel] = np.rint(np.interp(depths[wet], _STOP_DEPTHS, _STOP_RGB[:, channel]))
+    rgba[wet, 3] = 255
+    return rgba
+
+
+def encode_png(rgba: np.ndarray) -> bytes:
+    """Encode an (h, w, 4) uint8 image as PNG (stdlib zlib, filter type 0)."""
+    height, width, _ = rgba.shape
+    raw = np.zeros((height, width * 4 + 1), dtype=np.uint8)
+    raw[:, 1:] = rgba.reshape(height, width * 4)
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw.tobytes(), PNG_COMPRESSION))
+            + chunk(b"IEND", b""))
+
+
+EMPTY_TILE = encode_png(np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8))
+
+
+def rasterize_polygons(rings: list, ring_ids: list, size: int = TILE_SIZE) -> np.ndarray:
+    """
+    Rasterize polygons into an (size, size) int32 image of polygon ids (0 = none).
+
+    All rings of one polygon share an id, so holes and multipolygons follow
+    the even-odd rule. Pixel centres are sampled; every edge/row crossing is
+    computed at once, crossings are sorted by (row, id, x) and filled as spans.
+
+    Args:
+        rings: List of (m, 2) point arrays in pixel coordinates
+        ring_ids: Polygon id (> 0) of each ring
+    """
+    out = np.zeros(size * size, dtype=np.int32)
+    if not rings:
+        return out.reshape(size, size)
+
+    starts = []
+    ends = []
+    ids = []
+    for ring, ring_id in zip(rings, ring_ids):
+        pts = np.asarray(ring, dtype=np.float64)
+        if len(pts) < 3:
+            continue
+        starts.append(pts)
+        ends.append(np.roll(pts, -1, axis=0))  # Closing edge included
+        ids.append(np.full(len(pts), ring_id, dtype=np.int32))
+    if not starts:
+        return out.reshape(size, size)
+
+    p0 = np.concatenate(starts)
+    p1 = np.concatenate(ends)
+    edge_id = np.concatenate(ids)
+    x0, y0 = p0[:, 0], p0[:, 1]
+    x1, y1 = p1[:, 0], p1[:, 1]
+
+    # Rows whose pixel centre (r + 0.5) lies in [ymin, ymax): half-open, so
+    # every closed ring crosses each row an even number of times
+    row_start = np.clip(np.ceil(np.minimum(y0, y1) - 0.5), 0, size).astype(np.int64)
+    row_end = np.clip(np.ceil(np.maximum(y0, y1) - 0.5), 0, size).astype(np.int64)
+    counts = row_end - row_start
+    if counts.sum() == 0:
+        return out.reshape(size, size)
+
+    edge = np.repeat(np.arange(len(counts)), counts)
+    rows = np.repeat(row_start, counts) + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+    yc = rows + 0.5
+    t = (yc - y0[edge]) / (y1[edge] - y0[edge])
+    xc = x0[edge] + t * (x1[edge] - x0[edge])
+    poly = edge_id[edge]
+
+    order = np.lexsort((xc, poly, rows))
+    enter, leave = order[0::2], order[1::2]
+    col_start = np.clip(np.ceil(xc[enter] - 0.5), 0, size).astype(np.int64)
+    col_end = np.clip(np.ceil(xc[leave] - 0.5), 0, size).astype(np.int64)
+    lengths = np.maximum(col_end - col_start, 0)
+    if lengths.sum() == 0:
+        return out.reshape(size, size)
+
+    first = rows[enter] * size + col_start
+    pixels = np.repeat(first, lengths) + (np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths))
+    out[pixels] = np.repeat(poly[enter], lengths)
+    return out.reshape(size, size)
+
+
+def tile_geometry(path: str, cache_dir: str, z: int, x: int, y: int) -> tuple:
+    """
+    Process-pool task: rasterize a batch's features in one tile.
+
+    Returns:
+        (index image, depths) - an (TILE_SIZE, TILE_SIZE) image of 1-based
+        rows into depths (0 = no feature) and the (k, BATCH_SIZE) depths of
+        the k features that cover at least one pixel
+    """
+    flood_batch = load_batch(path, cache_dir)
+    rings = []
+    ring_ids = []
+    rows = []
+    with PMTilesReader(path) as reader:
+        min_zoom, max_zoom = reader.header["minZoom"], reader.header["maxZoom"]
+        data = None
+        if z >= min_zoom:
+            # Overzoom from the deepest level stored in the archive
+            source_z = min(z, max_zoom)
+            dz = z - source_z
+            sx, sy = x >> dz, y >> dz
+            data = reader.get_tile(source_z, sx, sy)
+
+    if data:
+        for layer in decode_mvt(data, properties=(GEO_CODE_PROPERTY,)).values():
+            scale = TILE_SIZE * (1 << dz) / layer["extent"]
+            offset = np.array([(x - (sx << dz)) * TILE_SIZE, (y - (sy << dz)) * TILE_SIZE])
+            codes = [str(f["properties"].get(GEO_CODE_PROPERTY)) for f in layer["features"]]
+            if not codes or len(flood_batch) == 0:
+                continue
+            codes = np.array(codes, dtype=str)
+            idx = np.clip(np.searchsorted(flood_batch.geo_codes, codes), 0, len(flood_batch) - 1)
+            found = flood_batch.geo_codes[idx] == codes
+            for feature, row, ok in zip(layer["features"], idx.tolist(), found.tolist()):
+                if not ok or feature["type"] != 3 or not feature["geometry"]:
+                    continue
+                rows.append(row)
+                for ring in feature["geometry"]:
+                    rings.append(np.asarray(ring, dtype=np.float64) * scale - offset)
+                    ring_ids.append(len(rows))
+    index_image = rasterize_polygons(rings, ring_ids)
+
+    # Drop features that did not cover any pixel and compact the ids
+    rows = np.array(rows, dtype=np.int64)
+    used, index_image = np.unique(index_image, return_inverse=True)
+    index_image = index_image.reshape(TILE_SIZE, TILE_SIZE)
+    if used[0] != 0:
+        index_image += 1
+    else:
+        used = used[1:]
+    rows = rows[used - 1]
+    index_image = index_image.astype(np.uint16 if len(rows) < 65535 else np.int32)
+    return index_image, flood_batch.depths[rows]
+
+
+def resolve_slot(value: str) -> int:
+    """
+    Parse a slot given as a global index, YYYYMMDDHHmm or D{YYYYMMDDHHmm}.
+
+    Raises:
+        ValueError: If the slot is malformed or outside the time range
+    """
+    value = value.strip()
+    if value.startswith(config.DEPTH_PROPERTY_PREFIX):
+        value = value[len(config.DEPTH_PROPERTY_PREFIX):]
+    if not value.isdigit():
+        raise ValueError(f"Invalid slot: {value}")
+    if len(value) == 12:
+        index = config.get_time_slot_index(int(value))
+    else:
+        index = int(value)
+
+    total = config.get_time_slot_index(config.END_TIME) + 1
+    if index < 0 or index >= total:
+        raise ValueError(f"Slot out of range (0-{total - 1})")
+    return index
+
+
+class TileRenderer:
+    """Renders and caches raster flood tiles for time slots."""
+
+    def __init__(self, project_dir, cache_dir=None):
+        self.project_dir = Path(project_dir)
+        self.cache_dir = Path(cache_dir) / RASTER_CACHE_SUBDIR if cache_dir else None
+        self._batch_cache_dir = str(cache_dir) if cache_dir else None
+
+        self._tiles = OrderedDict()   # tile key -> PNG bytes
+        self._tile_bytes = 0
+        self._indexes = OrderedDict()  # (path, mtime, z, x, y) -> (index image, depths)
+        self._disk_versions = {}        # disk cache directory prefix -> current directory name
+        self._lock = threading.Lock()
+
+        self._prerender = ThreadPoolExecutor(max_workers=PRERENDER_WORKERS,
+                                             thread_name_prefix="raster-prerender")
+        self._pending = set()
+        self._stats = {"memoryHits": 0, "diskHits": 0, "rendered": 0, "prerendered": 0}
+
+    def render(self, slot: int, z: int, x: int, y: int, style: str = "multiclass",
+               prerender: bool = True) -> tuple:
+        """
+        Return (png_bytes, live) for a tile; live marks a batch still being ingested.
+
+        Raises:
+            ValueError: If the tile coordinates or style are invalid
+            FileNotFoundError: If the slot's batch file is missing
+        """
+        if style not in STYLES:
+            raise ValueError(f"Unknown style '{style}' (expected one of: {', '.join(STYLES)})")
+        if z > MAX_ZOOM or x >= (1 << z) or y >= (1 << z):
+            raise ValueError(f"Invalid tile {z}/{x}/{y}")
+
+        batch = self._batch_for(slot)
+        data = self._render_cached(batch, slot - batch["startIndex"], z, x, y, style)
+        if prerender:
+            self._schedule_prerender(slot, z, x, y, style)
+        return data, batch["live"]
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._stats,
+                "cachedTiles": len(self._tiles),
+                "cachedBytes": self._tile_bytes,
+                "cachedGeometry": len(self._indexes),
+                "pendingPrerender": len(self._pending),
+            }
+
+    def close(self):
+        try:
+            self._prerender.shutdown(wait=False, cancel_futures=True)
+        except TypeError:  # Python 3.8: no cancel_futures
+            self._prerender.shutdown(wait=False)
+
+    # ------------------------------------------------------------------
+    # Caching
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _find_batch(batch_files: list, slot: int):
+        """The batch covering a slot; where batches overlap, the latest-starting one."""
+        i = bisect.bisect_right([b["startIndex"] for b in batch_files], slot) - 1
+        if i < 0 or slot > batch_files[i]["endIndex"]:
+            return None
+        return batch_files[i]
+
+    def _batch_for(self, slot: int) -> dict:
+        batch = self._find_batch(config.get_batch_files(), slot)
+        if batch is None:
+            raise FileNotFoundError(f"No batch file for slot {slot}")
+        batch = dict(batch)
+        path = self.project_dir / batch["path"]
+        if not path.exists():
+            raise FileNotFoundError(f"Batch file not found: {batch['filename']}")
+        batch["fullPath"] = path
+        batch["mtime"] = path.stat().st_mtime_ns
+        return batch
+
+    def _render_cached(self, batch: dict, local: int, z: int, x: int, y: int, style: str) -> bytes:
+        key = (str(batch["fullPath"]), batch["mtime"], local, z, x, y, style)
+        with self._lock:
+            data = self._tiles.get(key)
+            if data is not None:
+                self._tiles.move_to_end(key)
+                self._stats["memoryHits"] += 1
+                return data
+
+        # Live batches are rewritten under new names; keep them out of the disk cache
+        disk_path = None
+        if self.cache_dir is not None and not batch["live"]:
+            disk_path = (self.cache_dir / self._disk_version(batch) / style
+                         / str(local) / str(z) / str(x) / f"{y}.png")
+
+        data = None
+        if disk_path is not None and disk_path.exists():
+            try:
+                data = disk_path.read_bytes()
+                with self._lock:
+                    self._stats["diskHits"] += 1
+            except OSError:
+                data = None
+
+        if data is None:
+            data = self._render_tile(batch, local, z, x, y, style)
+            with self._lock:
+                self._stats["rendered"] += 1
+            if disk_path is not None:
+                self._write_disk(disk_path, data)
+
+        with self._lock:
+            if key not in self._tiles:
+                self._tiles[key] = data
+                self._tile_bytes += len(data)
+            while self._tile_bytes > MEMORY_CACHE_BYTES and self._tiles:
+                _, old = self._tiles.popitem(last=False)
+                self._tile_bytes -= len(old)
+        return data
+
+    def _disk_version(self, batch: dict) -> str:
+        """
+        Disk cache directory name of a batch version ("run+batch+mtime").
+
+        The first time a version is seen, directories of superseded versions
+        of the same batch are removed in the background.
+        """
+        prefix = CACHE_NAME_SEPARATOR.join((batch["fullPath"].parent.name, batch["fullPath"].stem, ""))
+        name = f"{prefix}{batch['mtime']}"
+        with self._lock:
+            if self._disk_versions.get(prefix) == name:
+                return name
+            self._disk_versions[prefix] = name
+        try:
+            self._prerender.submit(self._evict_disk_versions, prefix, name)
+        except RuntimeError:  # Executor shut down
+            pass
+        return name
+
+    def _evict_disk_versions(self, prefix: str, current: str):
+        for old in self.cache_dir.glob(f"{prefix}*"):
+            if old.name != current:
+                shutil.rmtree(old, ignore_errors=True)
+
+    @staticmethod
+    def _write_disk(path: Path, data: bytes):
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+
+    def _schedule_prerender(self, slot: int, z: int, x: int, y: int, style: str):
+        total = config.get_time_slot_index(config.END_TIME) + 1
+        for next_slot in range(slot + 1, min(slot + 1 + PRERENDER_AHEAD, total)):
+            job = (next_slot, z, x, y, style)
+            with self._lock:
+                if job in self._pending or len(self._pending) >= PRERENDER_MAX_PENDING:
+                    continue
+                self._pending.add(job)
+            try:
+                self._prerender.submit(self._prerender_job, job)
+            except RuntimeError:  # Executor shut down
+                with self._lock:
+                    self._pending.discard(job)
+                return
+
+    def _prerender_job(self, job: tuple):
+        try:
+            slot, z, x, y, style = job
+            self.render(slot, z, x, y, style, prerender=False)
+            with self._lock:
+                self._stats["prerendered"] += 1
+        except (ValueError, OSError):
+            pass
+        finally:
+            with self._lock:
+                self._pending.discard(job)
+
+    # ------------------------------------------------------------------
+    # Rendering
+    # ------------------------------------------------------------------
+
+    def _render_tile(self, batch: dict, local: int, z: int, x: int, y: int, style: str) -> bytes:
+        index_image, depths = self._geometry(batch, z, x, y)
+        if len(depths) == 0:
+            return EMPTY_TILE
+
+        # Colour table entry 0 is the transparent background
+        table = np.zeros((len(depths) + 1, 4), dtype=np.uint8)
+        table[1:] = depth_colours(depths[:, local], style)
+        return encode_png(table[index_image])
+
+    def _geometry(self, batch: dict, z: int, x: int, y: int) -> tuple:
+        """Return tile_geometry() for a tile, cached per batch version."""
+        key = (str(batch["fullPath"]), batch["mtime"], z, x, y)
+        with self._lock:
+            cached = self._indexes.get(key)
+            if cached is not None:
+                self._indexes.move_to_end(key)
+                return cached
+
+        cached = get_process_pool().submit(
+            tile_geometry, str(batch["fullPath"]), self._batch_cache_dir, z, x, y).result()
+        with self._lock:
+            self._indexes[key] = cached
+            while len(self._indexes) > INDEX_CACHE_SIZE:
+                self._indexes.popitem(last=False)
+        return cached
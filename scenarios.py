@@ -0,0 +1,653 @@
+"""
+Scenario comparison between flood runs.
+
+A run is one set of batch files for the event window. The default run is the
+batch directory itself (pmtiles/flood/); further rainfall scenarios live in
+pmtiles/flood/<run>/ under the same D{batch_start}.pmtiles names.
+
+Two runs are compared batch by batch in the shared process pool: every task
+returns per-feature peaks, wet-slot counts and depth-delta sums for one batch
+pair, plus per-slot aggregates, and the results are reduced into a
+ScenarioDiff. Diffs are cached in memory and on disk, keyed by the runs'
+file versions, so each pair is computed once.
+
+Per feature (base geometry, scenario depths aligned by geo_code):
+- peak depth in each run and its delta
+- time to peak in each run and the shift (minutes, only where both flood)
+- status: newly flooded, no longer flooded, flooded in both, dry in both
+"""
+
+import os
+import re
+import json
+import math
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+from pathlib import Path
+
+import numpy as np
+
+import config
+from depth_export import union_features
+from flood_data import load_batch, polygon_mask, get_process_pool
+
+DEFAULT_RUN = "default"
+RUN_NAME_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]{0,63}$")
+
+SCENARIO_CACHE_SUBDIR = "scenarios"
+SCENARIO_CACHE_VERSION = 1
+MEMORY_CACHE_SIZE = 4
+
+# Depth above which a cell counts as flooded (same as the viewer's analytics)
+FLOOD_THRESHOLD = float(os.getenv("APP_FLOOD_THRESHOLD", "0.1"))
+MAX_FLOOD_THRESHOLD = 10.0   # Metres; requested thresholds must lie in [0, this]
+THRESHOLD_DECIMALS = 2       # Requested thresholds are rounded to centimetres
+
+# Separates run names and threshold in cache filenames (cannot occur in either)
+CACHE_NAME_SEPARATOR = "+"
+
+WARD_ID_PROPERTY = "Ward_No"
+
+# Per-feature status codes
+STATUS_DRY = 0
+STATUS_BOTH = 1
+STATUS_NEW = 2
+STATUS_RECEDED = 3
+
+STATUS_NAMES = {
+    STATUS_DRY: "dry",
+    STATUS_BOTH: "both",
+    STATUS_NEW: "newlyFlooded",
+    STATUS_RECEDED: "noLongerFlooded",
+}
+
+
+# ----------------------------------------------------------------------
+# Runs
+# ----------------------------------------------------------------------
+
+def _has_batches(directory: Path) -> bool:
+    return any(directory.glob(f"{config.DEPTH_PROPERTY_PREFIX}*.pmtiles"))
+
+
+def resolve_run(project_dir, run: str):
+    """
+    Map a run name to the config.get_batch_files() argument.
+
+    Returns:
+        None for the default run, otherwise the run directory name
+
+    Raises:
+        ValueError: If the name is malformed
+        FileNotFoundError: If the run has no batch directory
+    """
+    if not run or run == DEFAULT_RUN:
+        return None
+    if not RUN_NAME_PATTERN.match(run):
+        raise ValueError(f"Invalid run name: {run}")
+    run_dir = Path(project_dir) / config.PMTILES_FLOOD_DIR / run
+    if not run_dir.is_dir() or not _has_batches(run_dir):
+        raise FileNotFoundError(f"Run not found: {run}")
+    return run
+
+
+def parse_threshold(value) -> float:
+    """
+    Validate a requested flood threshold (metres).
+
+    Thresholds are bounded and rounded so that requests cannot create an
+    unbounded number of distinct comparisons to compute and cache.
+
+    Raises:
+        ValueError: If the value is not a number in [0, MAX_FLOOD_THRESHOLD]
+    """
+    if value is None or value == "":
+        return FLOOD_THRESHOLD
+    try:
+        threshold = float(value)
+    except (TypeError, ValueError):
+        raise ValueError("threshold must be a number (metres)")
+    if not math.isfinite(threshold) or not 0.0 <= threshold <= MAX_FLOOD_THRESHOLD:
+        raise ValueError(f"threshold must be between 0 and {MAX_FLOOD_THRESHOLD:g} metres")
+    return round(threshold, THRESHOLD_DECIMALS)
+
+
+def list_runs(project_dir) -> list:
+    """Discover the default run and every pmtiles/flood/<run>/ directory with batch files."""
+    project_dir = Path(project_dir)
+    flood_dir = project_dir / config.PMTILES_FLOOD_DIR
+    names = [DEFAULT_RUN] if flood_dir.is_dir() and _has_batches(flood_dir) else []
+    if flood_dir.is_dir():
+        names.extend(sorted(
+            p.name for p in flood_dir.iterdir()
+            if p.is_dir() and p.name != DEFAULT_RUN and RUN_NAME_PATTERN.match(p.name) and _has_batches(p)
+        ))
+
+    runs = []
+    for name in names:
+        batch_files = config.get_batch_files(None if name == DEFAULT_RUN else name)
+        available = sum(1 for b in batch_files if (project_dir / b["path"]).exists())
+        runs.append({
+            "id": name,
+            "path": f"{config.PMTILES_FLOOD_DIR}/{name}" if name != DEFAULT_RUN else config.PMTILES_FLOOD_DIR,
+            "batchFiles": available,
+            "totalBatches": len(batch_files),
+            "complete": available == len(batch_files),
+        })
+    return runs
+
+
+# ----------------------------------------------------------------------
+# Process-pool tasks
+# ----------------------------------------------------------------------
+
+def batch_features(path: str, cache_dir: str) -> tuple:
+    """Process-pool task: return (geo_codes, lon, lat) of a batch, lon/lat at bbox centres."""
+    batch = load_batch(path, cache_dir)
+    bounds = batch.bounds
+    return batch.geo_codes, (bounds[:, 0] + bounds[:, 2]) / 2, (bounds[:, 1] + bounds[:, 3]) / 2
+
+
+def diff_batch(path_a: str, path_b: str, geo_codes: np.ndarray, slots: int,
+               cache_dir: str, threshold: float) -> dict:
+    """Process-pool task: per-feature and per-slot statistics for one batch pair."""
+    da = load_batch(path_a, cache_dir).align(geo_codes)[:, :slots]
+    db = load_batch(path_b, cache_dir).align(geo_codes)[:, :slots]
+
+    wet_a = da > threshold  # NaN compares False
+    wet_b = db > threshold
+    peak_a = np.where(np.isnan(da), -np.inf, da)
+    peak_b = np.where(np.isnan(db), -np.inf, db)
+    delta = db - da
+    valid = ~np.isnan(delta)
+    delta = np.where(valid, delta, 0.0)
+
+    return {
+        "peakA": peak_a.max(axis=1),
+        "peakIndexA": peak_a.argmax(axis=1),
+        "peakB": peak_b.max(axis=1),
+        "peakIndexB": peak_b.argmax(axis=1),
+        "wetSlotsA": wet_a.sum(axis=1),
+        "wetSlotsB": wet_b.sum(axis=1),
+        "deltaSum": delta.sum(axis=1, dtype=np.float64),
+        "deltaCount": valid.sum(axis=1),
+        "slotDeltaSum": delta.sum(axis=0, dtype=np.float64),
+        "slotDeltaCount": valid.sum(axis=0),
+        "slotWetA": wet_a.sum(axis=0),
+        "slotWetB": wet_b.sum(axis=0),
+        "slotNewlyFlooded": (wet_b & ~wet_a).sum(axis=0),
+        "slotNoLongerFlooded": (wet_a & ~wet_b).sum(axis=0),
+    }
+
+
+def assign_wards(lon: np.ndarray, lat: np.ndarray, wards: list) -> np.ndarray:
+    """Process-pool task: index of the ward containing each point (-1 outside all wards)."""
+    ward_index = np.full(len(lon), -1, dtype=np.int32)
+    for i, polygons in enumerate(wards):
+        for rings in polygons:
+            outer = np.asarray(rings[0], dtype=np.float64)
+            # Bounding-box prefilter keeps the per-edge test to nearby points
+            candidates = np.nonzero(
+                (ward_index < 0)
+                & (lon >= outer[:, 0].min()) & (lon <= outer[:, 0].max())
+                & (lat >= outer[:, 1].min()) & (lat <= outer[:, 1].max())
+            )[0]
+            if len(candidates) == 0:
+                continue
+            inside = polygon_mask(lon[candidates], lat[candidates], outer)
+            for hole in rings[1:]:
+                inside &= ~polygon_mask(lon[candidates], lat[candidates], hole)
+            ward_index[candidates[inside]] = i
+    return ward_index
+
+
+# ----------------------------------------------------------------------
+# Diff result
+# ----------------------------------------------------------------------
+
+class ScenarioDiff:
+    """Comparison of a scenario run against a base run."""
+
+    FEATURE_ARRAYS = ("geo_codes", "lon", "lat", "peak_base", "peak_scenario",
+                      "peak_index_base", "peak_index_scenario", "wet_slots_base",
+                      "wet_slots_scenario", "mean_delta", "ward_index")
+    SLOT_ARRAYS = ("slot_timestamps", "slot_mean_delta", "slot_flooded_base",
+                   "slot_flooded_scenario", "slot_newly_flooded", "slot_no_longer_flooded")
+
+    def __init__(self, meta: dict, arrays: dict):
+        self.meta = meta  # base, scenario, threshold, batches, wards, computeSeconds
+        for name in self.FEATURE_ARRAYS + self.SLOT_ARRAYS:
+            setattr(self, name, arrays[name])
+
+    def __len__(self) -> int:
+        return len(self.geo_codes)
+
+    @property
+    def flooded_base(self) -> np.ndarray:
+        return self.wet_slots_base > 0
+
+    @property
+    def flooded_scenario(self) -> np.ndarray:
+        return self.wet_slots_scenario > 0
+
+    @property
+    def status(self) -> np.ndarray:
+        """Per-feature status code (see STATUS_NAMES)."""
+        base, scenario = self.flooded_base, self.flooded_scenario
+        status = np.full(len(self), STATUS_DRY, dtype=np.int8)
+        status[base & scenario] = STATUS_BOTH
+        status[~base & scenario] = STATUS_NEW
+        status[base & ~scenario] = STATUS_RECEDED
+        return status
+
+    @property
+    def peak_delta(self) -> np.ndarray:
+        """Scenario minus base peak depth (NaN where either run has no data)."""
+        return self.peak_scenario - self.peak_base
+
+    @property
+    def time_to_peak_base(self) -> np.ndarray:
+        """Minutes from the first compared slot to the base peak (NaN if never flooded)."""
+        return np.where(self.flooded_base, self.peak_index_base * config.INTERVAL, np.nan)
+
+    @property
+    def time_to_peak_scenario(self) -> np.ndarray:
+        """Minutes from the first compared slot to the scenario peak (NaN if never flooded)."""
+        return np.where(self.flooded_scenario, self.peak_index_scenario * config.INTERVAL, np.nan)
+
+    @property
+    def peak_shift(self) -> np.ndarray:
+        """Time-to-peak shift in minutes (positive = later in the scenario; both must flood)."""
+        return self.time_to_peak_scenario - self.time_to_peak_base
+
+    def save(self, path: Path):
+        tmp_path = path.with_name(f"{path.stem}.{os.getpid()}.tmp.npz")
+        arrays = {name: getattr(self, name) for name in self.FEATURE_ARRAYS + self.SLOT_ARRAYS}
+        np.savez(tmp_path, meta=np.array(json.dumps(self.meta)), **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Path) -> "ScenarioDiff":
+        with np.load(path) as npz:
+            arrays = {name: npz[name] for name in cls.FEATURE_ARRAYS + cls.SLOT_ARRAYS}
+            return cls(json.loads(str(npz["meta"])), arrays)
+
+
+def _load_wards(wards_path) -> tuple:
+    """Return (ward ids, [[rings, ...] per polygon] per ward) from a GeoJSON file."""
+    if not wards_path or not Path(wards_path).exists():
+        return [], []
+    with open(wards_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    ids = []
+    wards = []
+    for i, feature in enumerate(data.get("features", [])):
+        geometry = feature.get("geometry") or {}
+        if geometry.get("type") == "Polygon":
+            polygons = [geometry["coordinates"]]
+        elif geometry.get("type") == "MultiPolygon":
+            polygons = geometry["coordinates"]
+        else:
+            continue
+        properties = feature.get("properties") or {}
+        ids.append(str(properties.get(WARD_ID_PROPERTY, i + 1)))
+        wards.append([[[p[:2] for p in ring] for ring in polygon] for polygon in polygons])
+    return ids, wards
+
+
+# ----------------------------------------------------------------------
+# Computation and caching
+# ----------------------------------------------------------------------
+
+_memory_cache = OrderedDict()  # cache key -> ScenarioDiff
+_memory_lock = threading.Lock()
+_inflight = {}                 # cache key -> Lock held while computing
+
+
+def _plan_pairs(project_dir: Path, base, scenario) -> list:
+    """Batch pairs present in both runs, limited to configured slots."""
+    total_slots = config.get_time_slot_index(config.END_TIME) + 1
+    pairs = []
+    for a, b in zip(config.get_batch_files(base), config.get_batch_files(scenario)):
+        path_a = project_dir / a["path"]
+        path_b = project_dir / b["path"]
+        slots = min(config.BATCH_SIZE, total_slots - a["startIndex"])
+        if slots > 0 and path_a.exists() and path_b.exists():
+            pairs.append({"a": path_a, "b": path_b, "startIndex": a["startIndex"],
+                          "startTime": a["startTime"], "slots": slots})
+    return pairs
+
+
+def _cache_key(pairs: list, threshold: float, wards_path) -> str:
+    parts = [SCENARIO_CACHE_VERSION, threshold, config.INTERVAL]
+    for pair in pairs:
+        for path in (pair["a"], pair["b"]):
+            stat = path.stat()
+            parts.append([str(path), stat.st_mtime_ns, stat.st_size, pair["slots"]])
+    if wards_path and Path(wards_path).exists():
+        parts.append([str(wards_path), Path(wards_path).stat().st_mtime_ns])
+    return hashlib.sha1(json.dumps(parts).encode('utf-8')).hexdigest()[:16]
+
+
+def compare_runs(project_dir, cache_dir, base: str, scenario: str,
+                 threshold: float = FLOOD_THRESHOLD, wards_path=None) -> ScenarioDiff:
+    """
+    Return the (cached) comparison of scenario against base.
+
+    Raises:
+        ValueError: If a run name is invalid or both runs are the same
+        FileNotFoundError: If a run is missing or the runs share no batches
+    """
+    project_dir = Path(project_dir)
+    base_name = base or DEFAULT_RUN
+    scenario_name = scenario or DEFAULT_RUN
+    if base_name == scenario_name:
+        raise ValueError("base and scenario must be different runs")
+    base_run = resolve_run(project_dir, base_name)
+    scenario_run = resolve_run(project_dir, scenario_name)
+
+    pairs = _plan_pairs(project_dir, base_run, scenario_run)
+    if not pairs:
+        raise FileNotFoundError(f"Runs {base_name} and {scenario_name} have no batch files in common")
+
+    key = _cache_key(pairs, threshold, wards_path)
+    with _memory_lock:
+        diff = _memory_cache.get(key)
+        if diff is not None:
+            _memory_cache.move_to_end(key)
+            return diff
+        lock = _inflight.setdefault(key, threading.Lock())
+
+    # Concurrent requests for the same pair wait for one computation
+    try:
+        with lock:
+            with _memory_lock:
+                diff = _memory_cache.get(key)
+            if diff is None:
+                diff = _load_or_compute(pairs, cache_dir, base_name, scenario_name,
+                                        threshold, wards_path, key)
+            with _memory_lock:
+                _memory_cache[key] = diff
+                _memory_cache.move_to_end(key)
+                while len(_memory_cache) > MEMORY_CACHE_SIZE:
+                    _memory_cache.popitem(last=False)
+    finally:
+        with _memory_lock:
+            _inflight.pop(key, None)
+    return diff
+
+
+def _cache_prefix(base_name: str, scenario_name: str, threshold: float) -> str:
+    return CACHE_NAME_SEPARATOR.join((base_name, scenario_name, f"{threshold:g}")) + CACHE_NAME_SEPARATOR
+
+
+def _load_or_compute(pairs: list, cache_dir, base_name: str, scenario_name: str,
+                     threshold: float, wards_path, key: str) -> ScenarioDiff:
+    """Read a diff from the disk cache, or compute and cache it."""
+    prefix = _cache_prefix(base_name, scenario_name, threshold)
+    cache_file = Path(cache_dir) / SCENARIO_CACHE_SUBDIR / f"{prefix}{key}.npz" if cache_dir else None
+    if cache_file is not None and cache_file.exists():
+        try:
+            return ScenarioDiff.load(cache_file)
+        except (OSError, ValueError, KeyError):
+            pass
+
+    start = time.perf_counter()
+    diff = _compute(pairs, str(cache_dir) if cache_dir else None, threshold, wards_path)
+    diff.meta.update({
+        "base": base_name,
+        "scenario": scenario_name,
+        "computeSeconds": round(time.perf_counter() - start, 3),
+    })
+    print(f"[Scenarios] {base_name} vs {scenario_name}: {len(diff)} features, "
+          f"{len(pairs)} batches in {diff.meta['computeSeconds']}s")
+    if cache_file is not None:
+        _write_cache_file(cache_file, diff, prefix)
+    return diff
+
+
+def _write_cache_file(cache_file: Path, diff: ScenarioDiff, prefix: str):
+    """
+    Write a diff and drop older versions of it.
+
+    prefix is "base+scenario+threshold+"; run names cannot contain the
+    separator, so the glob only matches this exact pair and threshold.
+    """
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        diff.save(cache_file)
+        for old in cache_file.parent.glob(f"{prefix}*.npz"):
+            # Skip other writers' temporary files
+            if old != cache_file and not old.name.endswith(".tmp.npz"):
+                old.unlink(missing_ok=True)
+    except OSError:
+        pass
+
+
+def _compute(pairs: list, cache_dir: str, threshold: float, wards_path) -> ScenarioDiff:
+    """Run the per-batch diff tasks in the process pool and reduce them."""
+    pool = get_process_pool()
+    # Features of every batch of both runs; diff_batch aligns each to this set (NaN where absent)
+    paths = [str(p[run]) for p in pairs for run in ("a", "b")]
+    geo_codes, lon, lat = union_features(list(pool.map(batch_features, paths, [cache_dir] * len(paths))))
+
+    ward_ids, wards = _load_wards(wards_path)
+    ward_future = pool.submit(assign_wards, lon, lat, wards) if wards else None
+
+    futures = [
+        pool.submit(diff_batch, str(p["a"]), str(p["b"]), geo_codes, p["slots"], cache_dir, threshold)
+        for p in pairs
+    ]
+
+    n = len(geo_codes)
+    peak = {"A": np.full(n, -np.inf), "B": np.full(n, -np.inf)}
+    peak_index = {"A": np.zeros(n, dtype=np.int32), "B": np.zeros(n, dtype=np.int32)}
+    wet_slots = {"A": np.zeros(n, dtype=np.int32), "B": np.zeros(n, dtype=np.int32)}
+    delta_sum = np.zeros(n)
+    delta_count = np.zeros(n, dtype=np.int64)
+    slots = {name: [] for name in ("timestamps", "deltaSum", "deltaCount", "wetA", "wetB", "new", "receded")}
+
+    first_index = pairs[0]["startIndex"]
+    for pair, future in zip(pairs, futures):
+        r = future.result()
+        offset = pair["startIndex"] - first_index
+        for run in ("A", "B"):
+            # Strictly greater keeps the earliest slot of a tied peak
+            better = r[f"peak{run}"] > peak[run]
+            peak[run] = np.where(better, r[f"peak{run}"], peak[run])
+            peak_index[run] = np.where(better, offset + r[f"peakIndex{run}"], peak_index[run])
+            wet_slots[run] += r[f"wetSlots{run}"]
+        delta_sum += r["deltaSum"]
+        delta_count += r["deltaCount"]
+
+        batch_dt = config.parse_time(pair["startTime"])
+        slots["timestamps"].extend(
+            int(config.format_time(batch_dt + timedelta(minutes=i * config.INTERVAL)))
+            for i in range(pair["slots"]))
+        slots["deltaSum"].append(r["slotDeltaSum"])
+        slots["deltaCount"].append(r["slotDeltaCount"])
+        slots["wetA"].append(r["slotWetA"])
+        slots["wetB"].append(r["slotWetB"])
+        slots["new"].append(r["slotNewlyFlooded"])
+        slots["receded"].append(r["slotNoLongerFlooded"])
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slot_delta_sum = np.concatenate(slots["deltaSum"])
+        slot_delta_count = np.concatenate(slots["deltaCount"])
+        arrays = {
+            "geo_codes": geo_codes,
+            "lon": lon,
+            "lat": lat,
+            "peak_base": np.where(np.isinf(peak["A"]), np.nan, peak["A"]).astype(np.float32),
+            "peak_scenario": np.where(np.isinf(peak["B"]), np.nan, peak["B"]).astype(np.float32),
+            "peak_index_base": peak_index["A"],
+            "peak_index_scenario": peak_index["B"],
+            "wet_slots_base": wet_slots["A"],
+            "wet_slots_scenario": wet_slots["B"],
+            "mean_delta": np.where(delta_count > 0, delta_sum / delta_count, np.nan).astype(np.float32),
+            "ward_index": ward_future.result() if ward_future else np.full(n, -1, dtype=np.int32),
+            "slot_timestamps": np.array(slots["timestamps"], dtype=np.int64),
+            "slot_mean_delta": np.where(slot_delta_count > 0, slot_delta_sum / slot_delta_count, np.nan),
+            "slot_flooded_base": np.concatenate(slots["wetA"]),
+            "slot_flooded_scenario": np.concatenate(slots["wetB"]),
+            "slot_newly_flooded": np.concatenate(slots["new"]),
+            "slot_no_longer_flooded": np.concatenate(slots["receded"]),
+        }
+
+    meta = {
+        "threshold": threshold,
+        "batches": len(pairs),
+        "startTime": pairs[0]["startTime"],
+        "wards": ward_ids,
+    }
+    return ScenarioDiff(meta, arrays)
+
+
+# ----------------------------------------------------------------------
+# Views
+# ----------------------------------------------------------------------
+
+def _round(value, digits: int = 3):
+    """JSON-safe rounding (NaN -> None)."""
+    value = float(value)
+    return None if value != value else round(value, digits)
+
+
+def _stats(values: np.ndarray) -> dict:
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return {"count": 0, "mean": None, "min": None, "max": None, "p95": None}
+    return {
+        "count": int(len(values)),
+        "mean": _round(values.mean()),
+        "min": _round(values.min()),
+        "max": _round(values.max()),
+        "p95": _round(np.percentile(values, 95)),
+    }
+
+
+def summarize(diff: ScenarioDiff) -> dict:
+    """Summary statistics and per-slot series of a comparison."""
+    status = diff.status
+    flooded_either = status != STATUS_DRY
+    shift = diff.peak_shift
+    return {
+        "success": True,
+        **diff.meta,
+        "featureCount": len(diff),
+        "counts": {name: int((status == code).sum()) for code, name in STATUS_NAMES.items()},
+        "peakDelta": _stats(diff.peak_delta[flooded_either]),
+        "meanDelta": _stats(diff.mean_delta[flooded_either].astype(np.float64)),
+        "peakShiftMinutes": {
+            **_stats(shift),
+            "earlier": int((shift < 0).sum()),
+            "later": int((shift > 0).sum()),
+        },
+        "floodDurationDeltaMinutes": _stats(
+            ((diff.wet_slots_scenario - diff.wet_slots_base) * config.INTERVAL)[flooded_either].astype(np.float64)),
+        "slots": {
+            "timestamps": diff.slot_timestamps.tolist(),
+            "meanDelta": [_round(v, 4) for v in diff.slot_mean_delta],
+            "floodedBase": diff.slot_flooded_base.tolist(),
+            "floodedScenario": diff.slot_flooded_scenario.tolist(),
+            "newlyFlooded": diff.slot_newly_flooded.tolist(),
+            "noLongerFlooded": diff.slot_no_longer_flooded.tolist(),
+        },
+    }
+
+
+def diff_geojson(diff: ScenarioDiff, include_dry: bool = False) -> dict:
+    """Point layer (feature centres) with per-feature diff properties."""
+    status = diff.status
+    keep = np.ones(len(diff), dtype=bool) if include_dry else status != STATUS_DRY
+    idx = np.nonzero(keep)[0]
+
+    columns = {
+        "geo_code": diff.geo_codes[idx].tolist(),
+        "status": [STATUS_NAMES[s] for s in status[idx].tolist()],
+        "peakBase": np.round(diff.peak_base[idx].astype(np.float64), 3).tolist(),
+        "peakScenario": np.round(diff.peak_scenario[idx].astype(np.float64), 3).tolist(),
+        "peakDelta": np.round(diff.peak_delta[idx].astype(np.float64), 3).tolist(),
+        "peakShiftMinutes": diff.peak_shift[idx].tolist(),
+        "meanDelta": np.round(diff.mean_delta[idx].astype(np.float64), 3).tolist(),
+    }
+    lon = np.round(diff.lon[idx], 6).tolist()
+    lat = np.round(diff.lat[idx], 6).tolist()
+
+    features = []
+    for i in range(len(idx)):
+        properties = {}
+        for name, values in columns.items():
+            v = values[i]
+            properties[name] = None if isinstance(v, float) and v != v else v
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [lon[i], lat[i]]},
+            "properties": properties,
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+def ward_table(diff: ScenarioDiff) -> list:
+    """Per-ward rows (features outside every ward are grouped under ward None)."""
+    wards = diff.meta.get("wards", [])
+    status = diff.status
+    peak_delta = diff.peak_delta
+    shift = diff.peak_shift
+
+    # One vectorized pass per column: group sums by ward with bincount
+    groups = np.where(diff.ward_index >= 0, diff.ward_index, len(wards))
+    size = len(wards) + 1
+
+    def count(mask):
+        return np.bincount(groups[mask], minlength=size)
+
+    def mean(values, mask):
+        mask = mask & ~np.isnan(values)
+        totals = np.bincount(groups[mask], weights=values[mask], minlength=size)
+        counts = np.bincount(groups[mask], minlength=size)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return totals / counts
+
+    def maximum(values, mask):
+        out = np.full(size, -np.inf)
+        mask = mask & ~np.isnan(values)
+        np.maximum.at(out, groups[mask], values[mask])
+        return np.where(np.isinf(out), np.nan, out)
+
+    flooded_either = status != STATUS_DRY
+    features = count(np.ones(len(diff), dtype=bool))
+    columns = {
+        "floodedBase": count(diff.flooded_base),
+        "floodedScenario": count(diff.flooded_scenario),
+        "newlyFlooded": count(status == STATUS_NEW),
+        "noLongerFlooded": count(status == STATUS_RECEDED),
+        "meanPeakDelta": mean(peak_delta.astype(np.float64), flooded_either),
+        "maxPeakDelta": maximum(peak_delta.astype(np.float64), flooded_either),
+        "meanPeakShiftMinutes": mean(shift, flooded_either),
+    }
+
+    rows = []
+    for i in range(size):
+        if features[i] == 0:
+            continue
+        row = {"ward": wards[i] if i < len(wards) else None, "features": int(features[i])}
+        for name, values in columns.items():
+            row[name] = int(values[i]) if values.dtype.kind in "iu" else _round(values[i])
+        rows.append(row)
+    return rows
+
+
+def ward_table_csv(rows: list) -> bytes:
+    """Encode ward rows as CSV."""
+    if not rows:
+        return b""
+    header = list(rows[0].keys())
+    lines = [",".join(header)]
+    for row in rows:
+        lines.append(",".join("" if row[k] is None else str(row[k]) for k in header))
+    return ("\n".join(lines) + "\n").encode("utf-8")
@@ -8,21 +8,40 @@ Features:
 - Time series flood data from single master PMTiles file
 - CORS support for development
 - Clean error handling
+- Admission control: bounded worker queue with 503 load shedding
+- Bulk depth time-series export streamed with chunked transfer encoding
+- Live nowcast ingest with Server-Sent Events push of new time slots
+- Scenario comparison between flood runs (summary, diff layer, per-ward tables)
+- Server-rendered PNG raster tiles per time slot with memory/disk cache and pre-render
+- Per-request phase timings, slow-request log and an admin sampling profiler
+- Asynchronous, buffered JSON-lines access log with 206 sampling and rotation
 """
 
 import os
 import sys
+import hmac
 import json
 import struct
 import argparse
+import threading
+import time
 from functools import partial
 from pathlib import Path
 from datetime import datetime
-from http.server import HTTPServer, SimpleHTTPRequestHandler
-from urllib.parse import urlparse
+from http.server import SimpleHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
 
 # Import configuration
 import config
+from admission import AdmissionHTTPServer, DEFAULT_WORKERS, DEFAULT_MAX_QUEUE
+import depth_export
+import scenarios
+from flood_data import CACHE_DIR_NAME, shutdown_process_pool
+from nowcast import NowcastIngestor, parse_slot_payload
+from raster import TileRenderer, TILE_PATH_PATTERN, resolve_slot
+from access_log import AccessLog, DEFAULT_ACCESS_LOG, client_of
+from profiling import (RequestTimer, RequestTimings, SamplingProfiler, NULL_TIMER,
+                       parse_profile_params, parse_timings_params, format_collapsed, top_functions)
 
 # Configuration
 DEFAULT_PORT = 8000
@@ -32,17 +51,25 @@ PMTILES_FLOOD_DIR = "pmtiles/flood"
 PMTILES_STATIC_DIR = "pmtiles/static"
 CITY_DIR = "city"
 CITY_NAME = "gurugram"
+WARD_BOUNDARIES_FILE = "city_wards_boundary.geojson"
 MASTER_PMTILES_FILE = config.MASTER_PMTILES_FILE
 PUBLIC_DIR_NAME = "public"
+MAX_INGEST_BODY = 32 * 1024 * 1024  # Largest accepted nowcast slot upload (bytes)
+RASTER_MAX_AGE = 86400  # Browser cache lifetime of raster tiles from finished batches (seconds)
+# Socket timeout for reading requests and writing responses; frees a worker held by a stalled client
+REQUEST_TIMEOUT = float(os.getenv("APP_REQUEST_TIMEOUT", "20"))
 
 
 class PMTilesAPI:
     """API handler for PMTiles-related operations."""
     
     def __init__(self, base_dir: str):
-        self.base_dir = Path(base_dir) / PUBLIC_DIR_NAME
+        self.project_dir = Path(base_dir)
+        self.base_dir = self.project_dir / PUBLIC_DIR_NAME
+        self.cache_dir = self.project_dir / CACHE_DIR_NAME
         self.pmtiles_dir = self.base_dir / PMTILES_DIR / CITY_NAME
         self.master_file_path = self.base_dir / MASTER_PMTILES_FILE
+        self.ward_file_path = self.base_dir / CITY_DIR / CITY_NAME / WARD_BOUNDARIES_FILE
         self.time_slots = config.get_time_slots()
     
     def get_master_file_info(self) -> dict:
@@ -114,8 +141,7 @@ class PMTilesAPI:
     
     def get_ward_boundaries(self) -> dict:
         """Get city ward boundary GeoJSON."""
-        city_dir = self.base_dir / CITY_DIR / CITY_NAME
-        ward_file = city_dir / "city_wards_boundary.geojson"
+        ward_file = self.ward_file_path
         
         if not ward_file.exists():
             return {"success": False, "error": "Ward boundaries file not found"}
@@ -135,6 +161,15 @@ class PMTilesAPI:
         except Exception as e:
             return {"success": False, "error": str(e)}
     
+    def get_runs(self) -> dict:
+        """Discover flood runs (default batch directory plus scenario subdirectories)."""
+        return {
+            "success": True,
+            "defaultRun": scenarios.DEFAULT_RUN,
+            "runs": scenarios.list_runs(self.project_dir),
+            "timestamp": datetime.now().isoformat()
+        }
+    
     def get_roadways(self) -> dict:
         """Get roadways GeoJSON."""
         city_dir = self.base_dir / CITY_DIR / CITY_NAME
@@ -276,6 +311,14 @@ class APIRequestHandler(SimpleHTTPRequestHandler):
     """HTTP request handler with Range support and REST API endpoints."""
     
     api = None  # Class-level API instance
+    export_slots = threading.BoundedSemaphore(depth_export.MAX_CONCURRENT_EXPORTS)
+    nowcast = None  # Class-level NowcastIngestor instance
+    raster = None  # Class-level TileRenderer instance
+    timings = RequestTimings()
+    profiler = SamplingProfiler()
+    _timer = NULL_TIMER  # Phase timer of the request being handled
+    access_log = None  # Class-level AccessLog instance
+    timeout = REQUEST_TIMEOUT  # Applied to the connection by StreamRequestHandler.setup
     
     def log_error(self, format, *args):
         """Suppress common connection errors."""
@@ -286,35 +329,56 @@ class APIRequestHandler(SimpleHTTPRequestHandler):
         super().log_error(format, *args)
     
     def log_request(self, code='-', size='-'):
-        """Override to log with response size in KB."""
+        """Remember status and size; the access log record is queued when the request ends."""
         # NOTE: `http.server` can call `log_request` while handling malformed
-        # requests (e.g., TLS handshakes sent to an HTTP port). In those cases
-        # `self.path` (and sometimes `self.command`) may not be set yet.
-        safe_path = getattr(self, 'path', '') or ''
-        safe_command = getattr(self, 'command', '-') or '-'
-        
-        # Format size in KB
-        size_kb = '-'
-        if isinstance(size, int) and size >= 0:
-            size_kb = f"{size / 1024:.2f} KB"
-        elif isinstance(size, str) and size != '-':
-            try:
-                size_kb = f"{int(size) / 1024:.2f} KB"
-            except (ValueError, TypeError):
-                size_kb = size
-        
-        # Skip logging for static assets
-        if safe_path and any(ext in safe_path for ext in ['.js', '.css', '.png', '.ico']):
+        # requests (e.g., TLS handshakes sent to an HTTP port) before a request
+        # line was parsed; those are logged right away without a duration.
+        if self._timer is NULL_TIMER:
+            self._log_access(code, size, None)
             return
-        
-        # Log format: [TIME] METHOD PATH STATUS SIZE
-        print(f"[{datetime.now().strftime('%H:%M:%S')}] {safe_command} {safe_path} - {code} - {size_kb}")
+        self._timer.status = code
+        if isinstance(size, int):
+            self._timer.bytes = size
+    
+    def _log_access(self, status, size, duration):
+        """Queue one access log record (never blocks)."""
+        if self.access_log is None:
+            return
+        headers = getattr(self, 'headers', None)
+        self.access_log.log(getattr(self, 'command', None) or '-', getattr(self, 'path', '') or '',
+                            status, size, headers.get('Range') if headers is not None else None,
+                            duration, client_of(self.client_address, headers))
     
     def log_message(self, format, *args):
         """Custom log format - handled by log_request."""
         # Skip default logging, use log_request instead
         pass
     
+    def handle_one_request(self):
+        """Handle one request and record its phase timings."""
+        self._timer = NULL_TIMER
+        try:
+            super().handle_one_request()
+        finally:
+            timer = self._timer
+            if timer is not NULL_TIMER:
+                self.timings.record(self.command, self.path, timer)
+                self._log_access(timer.status, timer.bytes, time.perf_counter() - timer.start)
+    
+    def parse_request(self):
+        """Parse the request headers; timing starts here so keep-alive idle time is excluded."""
+        self._timer = RequestTimer()
+        with self._timer.phase('parse'):
+            return super().parse_request()
+    
+    def flush_headers(self):
+        with self._timer.phase('io'):
+            super().flush_headers()
+    
+    def copyfile(self, source, outputfile):
+        with self._timer.phase('io'):
+            super().copyfile(source, outputfile)
+    
     def handle(self):
         """Handle request with connection error suppression."""
         try:
@@ -346,10 +410,37 @@ class APIRequestHandler(SimpleHTTPRequestHandler):
         elif path == '/api/health':
             self._handle_api_health()
         elif path == '/api/config':
-            self._handle_api_config()
+            self._handle_api_config(parse_qs(parsed.query))
+        elif path == '/api/export':
+            self._handle_api_export(parse_qs(parsed.query))
+        elif path == '/api/scenarios':
+            self._send_json_response(self.api.get_runs())
+        elif path in ('/api/scenarios/diff', '/api/scenarios/diff/layer', '/api/scenarios/diff/wards'):
+            self._handle_api_scenario_diff(path.rsplit('/', 1)[-1], parse_qs(parsed.query))
+        elif path == '/api/nowcast':
+            self._send_json_response(self.nowcast.get_state())
+        elif path == '/api/nowcast/events':
+            self._handle_api_nowcast_events()
+        elif path.startswith('/api/raster/'):
+            self._handle_api_raster_tile(path, parse_qs(parsed.query))
+        elif path == '/api/admin/timings':
+            if self._check_bearer_token(config.ADMIN_TOKEN, "Admin endpoints are disabled"):
+                self._send_json_response({"success": True, **self.timings.get_stats()})
+        elif path == '/api/admin/profile':
+            self._handle_api_admin_profile(parse_qs(parsed.query))
         else:
             super().do_GET()
     
+    def do_POST(self):
+        """Handle POST requests (nowcast slot ingest, admin settings)."""
+        path = urlparse(self.path).path
+        if path == '/api/nowcast/slots':
+            self._handle_api_nowcast_ingest(parse_qs(urlparse(self.path).query))
+        elif path == '/api/admin/timings':
+            self._handle_api_admin_timings_update(parse_qs(urlparse(self.path).query))
+        else:
+            self._send_json_response({"success": False, "error": "Not found"}, 404)
+    
     def _handle_api_pmtiles_list(self):
         """Return list of available PMTiles files."""
         self._send_json_response(self.api.get_available_files())
@@ -361,11 +452,20 @@ class APIRequestHandler(SimpleHTTPRequestHandler):
     
     def _handle_api_health(self):
         """Health check endpoint."""
-        self._send_json_response({
+        response = {
             "status": "healthy",
             "timestamp": datetime.now().isoformat(),
             "version": "2.0.0"
-        })
+        }
+        if hasattr(self.server, 'get_stats'):
+            response["admission"] = self.server.get_stats()
+        if self.raster is not None:
+            response["raster"] = self.raster.get_stats()
+        if self.access_log is not None:
+            response["accessLog"] = self.access_log.get_stats()
+            if response["accessLog"]["failing"]:
+                response["status"] = "degraded"
+        self._send_json_response(response)
     
     def _handle_api_static_layers(self):
         """Return list of static layers."""
@@ -391,11 +491,19 @@ class APIRequestHandler(SimpleHTTPRequestHandler):
         response = self.api.get_precipitation()
         self._send_json_response(response, 200 if response.get("success") else 404)
     
-    def _handle_api_config(self):
+    def _handle_api_config(self, query: dict = None):
         """Return server configuration with time slots and batch info from config."""
+        # Optional scenario run (?run=<name>) selects which batch files are listed
+        run_name = (query or {}).get('run', [None])[0]
+        try:
+            run = scenarios.resolve_run(self.api.project_dir, run_name)
+        except (ValueError, FileNotFoundError) as e:
+            self._send_json_response({"success": False, "error": str(e)}, 404)
+            return
+        
         # Get time slots from config module
         time_slots = config.get_time_slots()
-        batch_files = config.get_batch_files()
+        batch_files = config.get_batch_files(run)
         master_info = self.api.get_master_file_info()
         
         self._send_json_response({
@@ -414,7 +522,8 @@ class APIRequestHandler(SimpleHTTPRequestHandler):
                 "batchSize": config.BATCH_SIZE,
                 "batchDurationHours": config.BATCH_DURATION_HOURS,
                 "batchFiles": batch_files,
-                "pmtilesFloodDir": PMTILES_FLOOD_DIR,
+                "pmtilesFloodDir": f"{PMTILES_FLOOD_DIR}/{run}" if run else PMTILES_FLOOD_DIR,
+                "run": run or scenarios.DEFAULT_RUN,
                 "pmtilesStaticDir": PMTILES_STATIC_DIR,
                 "initialCenter": [77.0293, 28.4622],
                 "initialZoom": 11,
@@ -426,9 +535,280 @@ class APIRequestHandler(SimpleHTTPRequestHandler):
             }
         })
     
-    def _send_json_response(self, data: dict, status: int = 200):
+    def _handle_api_scenario_diff(self, view: str, query: dict):
+        """Compare two runs: summary (diff), point layer (layer) or per-ward table (wards)."""
+        def get(name):
+            values = query.get(name)
+            return values[0].strip() if values and values[0].strip() else None
+        
+        if not get('scenario'):
+            self._send_json_response({"success": False, "error": "scenario parameter is required"}, 400)
+            return
+        try:
+            threshold = scenarios.parse_threshold(get('threshold'))
+        except ValueError as e:
+            self._send_json_response({"success": False, "error": str(e)}, 400)
+            return
+        
+        try:
+            diff = scenarios.compare_runs(self.api.project_dir, self.api.cache_dir,
+                                          get('base') or scenarios.DEFAULT_RUN, get('scenario'),
+                                          threshold, self.api.ward_file_path)
+        except ValueError as e:
+            self._send_json_response({"success": False, "error": str(e)}, 400)
+            return
+        except FileNotFoundError as e:
+            self._send_json_response({"success": False, "error": str(e)}, 404)
+            return
+        except Exception as e:
+            self._send_json_response({"success": False, "error": f"Comparison failed: {e}"}, 500)
+            return
+        
+        if view == 'layer':
+            self._send_json_response(scenarios.diff_geojson(diff, include_dry=get('all') == '1'))
+        elif view == 'wards':
+            rows = scenarios.ward_table(diff)
+            if get('format') == 'csv':
+                filename = f"wards_{diff.meta['base']}_vs_{diff.meta['scenario']}.csv"
+                self._send_chunked_response([scenarios.ward_table_csv(rows)], 'text/csv; charset=utf-8', {
+                    "Content-Disposition": f'attachment; filename="{filename}"',
+                })
+            else:
+                self._send_json_response({
+                    "success": True,
+                    "base": diff.meta["base"],
+                    "scenario": diff.meta["scenario"],
+                    "threshold": diff.meta["threshold"],
+                    "wards": rows
+                })
+        else:
+            self._send_json_response(scenarios.summarize(diff))
+    
+    def _handle_api_export(self, query: dict):
+        """Stream depth time series for an area and time window."""
+        try:
+            params = depth_export.parse_export_params(query, self.api.project_dir)
+        except ValueError as e:
+            self._send_json_response({"success": False, "error": str(e)}, 400)
+            return
+        
+        # Exports hold a worker thread for their whole duration; cap them so
+        # interactive requests always have threads left.
+        if not self.export_slots.acquire(blocking=False):
+            self._send_json_response({"success": False, "error": "Too many exports in progress"}, 503,
+                                     extra_headers={"Retry-After": "5"})
+            return
+        
+        try:
+            try:
+                export = depth_export.prepare_export(self.api.project_dir, self.api.cache_dir, params)
+            except FileNotFoundError as e:
+                self._send_json_response({"success": False, "error": str(e)}, 404)
+                return
+            except Exception as e:
+                self._send_json_response({"success": False, "error": f"Export failed: {e}"}, 500)
+                return
+            
+            self._send_chunked_response(export["chunks"], export["contentType"], {
+                "Content-Disposition": f'attachment; filename="{export["filename"]}"',
+                "X-Export-Features": str(export["featureCount"]),
+                "X-Export-Slots": str(export["slotCount"]),
+            })
+        finally:
+            self.export_slots.release()
+    
+    def _handle_api_raster_tile(self, path: str, query: dict):
+        """Serve a PNG raster tile of flood depth for one time slot."""
+        match = TILE_PATH_PATTERN.match(path)
+        if not match:
+            self._send_json_response({"success": False, "error": "Expected /api/raster/{slot}/{z}/{x}/{y}.png"}, 404)
+            return
+        
+        style = query.get('style', ['multiclass'])[0]
+        try:
+            slot = resolve_slot(match.group(1))
+            z, x, y = (int(v) for v in match.groups()[1:])
+            data, live = self.raster.render(slot, z, x, y, style)
+        except ValueError as e:
+            self._send_json_response({"success": False, "error": str(e)}, 400)
+            return
+        except FileNotFoundError as e:
+            self._send_json_response({"success": False, "error": str(e)}, 404)
+            return
+        
+        # Batches still receiving nowcast slots are rewritten; don't let browsers keep them
+        cache_control = 'no-cache' if live else f'public, max-age={RASTER_MAX_AGE}'
+        self._send_bytes_response(data, 'image/png', {'Cache-Control': cache_control})
+    
+    def _handle_api_nowcast_events(self):
+        """Open a Server-Sent Events stream announcing newly ingested time slots."""
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('X-Accel-Buffering', 'no')
+        self.end_headers()
+        self.wfile.flush()
+        
+        # The broadcaster owns the connection from here; free the worker thread.
+        self.server.detach_request(self.request)
+        self.nowcast.subscribe(self.request)
+    
+    def _handle_api_nowcast_ingest(self, query: dict):
+        """Accept one time slot of model output and append it to the open batch."""
+        if not self.nowcast.enabled:
+            self._send_json_response({"success": False, "error": "Nowcast ingest is disabled"}, 403)
+            return
+        if not self._check_bearer_token(config.INGEST_TOKEN, "Nowcast ingest is disabled"):
+            return
+        
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            length = -1
+        if length <= 0 or length > MAX_INGEST_BODY:
+            self._send_json_response({"success": False, "error": "Missing or oversized request body"},
+                                     413 if length > MAX_INGEST_BODY else 400)
+            return
+        
+        with self._timer.phase('io'):
+            body = self.rfile.read(length)
+        
+        timestamp = query.get('timestamp', [None])[0]
+        try:
+            timestamp, depths = parse_slot_payload(body, self.headers.get('Content-Type', ''), timestamp)
+            response = self.nowcast.ingest_slot(timestamp, depths)
+        except ValueError as e:
+            self._send_json_response({"success": False, "error": str(e)}, 400)
+            return
+        except FileExistsError as e:
+            self._send_json_response({"success": False, "error": str(e)}, 409)
+            return
+        except FileNotFoundError as e:
+            self._send_json_response({"success": False, "error": str(e)}, 404)
+            return
+        self._send_json_response(response, 201)
+    
+    def _handle_api_admin_timings_update(self, query: dict):
+        """Switch request timings on/off and/or change the slow-request threshold."""
+        if not self._check_bearer_token(config.ADMIN_TOKEN, "Admin endpoints are disabled"):
+            return
+        
+        try:
+            params = parse_timings_params(query)
+        except ValueError as e:
+            self._send_json_response({"success": False, "error": str(e)}, 400)
+            return
+        
+        self.timings.configure(params["enabled"], params["slowMs"])
+        self._send_json_response({
+            "success": True,
+            "enabled": self.timings.enabled,
+            "slowThresholdMs": round(self.timings.slow_threshold * 1000, 2),
+        })
+    
+    def _handle_api_admin_profile(self, query: dict):
+        """Sample all threads for N seconds and return collapsed stacks or a top-functions table."""
+        if not self._check_bearer_token(config.ADMIN_TOKEN, "Admin endpoints are disabled"):
+            return
+        
+        try:
+            params = parse_profile_params(query)
+        except ValueError as e:
+            self._send_json_response({"success": False, "error": str(e)}, 400)
+            return
+        
+        # Holds this worker for the profiling window; the other workers keep serving
+        try:
+            profile = self.profiler.run(params["seconds"], params["intervalMs"], params["includeIdle"])
+        except RuntimeError as e:
+            self._send_json_response({"success": False, "error": str(e)}, 409)
+            return
+        
+        if params["format"] == 'json':
+            self._send_json_response({
+                "success": True,
+                "seconds": profile["seconds"],
+                "intervalMs": profile["intervalMs"],
+                "samples": profile["samples"],
+                "functions": top_functions(profile),
+            })
+        else:
+            self._send_bytes_response(format_collapsed(profile).encode('utf-8'), 'text/plain; charset=utf-8',
+                                      {'X-Profile-Samples': str(profile["samples"])})
+    
+    def _check_bearer_token(self, expected: str, disabled_error: str) -> bool:
+        """Check the Authorization bearer token; answer 403/401 and return False if refused."""
+        if not expected:
+            self._send_json_response({"success": False, "error": disabled_error}, 403)
+            return False
+        
+        auth = self.headers.get('Authorization', '')
+        token = auth[7:] if auth.startswith('Bearer ') else ''
+        if not hmac.compare_digest(token.encode('utf-8'), expected.encode('utf-8')):
+            self._send_json_response({"success": False, "error": "Invalid token"}, 401)
+            return False
+        return True
+    
+    def _send_chunked_response(self, chunks, content_type: str, extra_headers: dict = None):
+        """Stream an iterable of byte chunks using chunked transfer encoding."""
+        # Chunked encoding needs an HTTP/1.1 status line; close afterwards.
+        self.protocol_version = 'HTTP/1.1'
+        self.close_connection = True
+        
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Connection', 'close')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Expose-Headers', ', '.join(extra_headers or {}))
+        self.send_header('Cache-Control', 'no-cache')
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        
+        total = 0
+        try:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                with self._timer.phase('io'):
+                    self.wfile.write(b'%X\r\n' % len(chunk) + chunk + b'\r\n')
+                total += len(chunk)
+            with self._timer.phase('io'):
+                self.wfile.write(b'0\r\n\r\n')
+            self.log_request(200, total)
+        except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError):
+            pass
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+    
+    def _send_bytes_response(self, data: bytes, content_type: str, extra_headers: dict = None):
+        """Send a binary response; extra_headers may override Cache-Control."""
+        headers = {'Cache-Control': 'no-cache', **(extra_headers or {})}
+        
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', len(data))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        
+        try:
+            with self._timer.phase('io'):
+                self.wfile.write(data)
+            self.log_request(200, len(data))
+        except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError):
+            pass
+    
+    def _send_json_response(self, data: dict, status: int = 200, extra_headers: dict = None):
         """Send JSON response with proper headers."""
-        response = json.dumps(data, indent=2).encode('utf-8')
+        with self._timer.phase('serialize'):
+            response = json.dumps(data, indent=2).encode('utf-8')
         response_size = len(response)
         
         self.send_response(status)
@@ -436,10 +816,13 @@ class APIRequestHandler(SimpleHTTPRequestHandler):
         self.send_header('Content-Length', response_size)
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Cache-Control', 'no-cache')
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
         self.end_headers()
         
         try:
-            self.wfile.write(response)
+            with self._timer.phase('io'):
+                self.wfile.write(response)
             self.log_request(status, response_size)
         except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError):
             pass
@@ -534,8 +917,8 @@ class APIRequestHandler(SimpleHTTPRequestHandler):
         """Handle CORS preflight requests."""
         self.send_response(204)
         self.send_header("Access-Control-Allow-Origin", "*")
-        self.send_header("Access-Control-Allow-Methods", "GET, HEAD, OPTIONS")
-        self.send_header("Access-Control-Allow-Headers", "Range, Content-Type")
+        self.send_header("Access-Control-Allow-Methods", "GET, HEAD, POST, OPTIONS")
+        self.send_header("Access-Control-Allow-Headers", "Range, Content-Type, Authorization")
         self.send_header("Access-Control-Max-Age", "86400")
         self.end_headers()
 
@@ -569,7 +952,9 @@ class _RangeFile:
             pass
 
 
-def run_server(port: int = DEFAULT_PORT, directory: str = None):
+def run_server(port: int = DEFAULT_PORT, directory: str = None,
+               workers: int = DEFAULT_WORKERS, max_queue: int = DEFAULT_MAX_QUEUE,
+               ingest: bool = False, access_log: str = DEFAULT_ACCESS_LOG):
     """Start the HTTP server."""
     base_dir = Path(directory).resolve() if directory else Path(__file__).resolve().parent
     serve_dir_candidate = base_dir / PUBLIC_DIR_NAME
@@ -584,12 +969,30 @@ def run_server(port: int = DEFAULT_PORT, directory: str = None):
     APIRequestHandler.api = PMTilesAPI(str(base_dir))
     files_info = APIRequestHandler.api.get_available_files()
 
+    # Previously ingested slots are always restored; new ones only accepted with ingest on
+    nowcast = NowcastIngestor(str(base_dir), enabled=ingest)
+    nowcast.restore()
+    if ingest:
+        nowcast.start()
+    APIRequestHandler.nowcast = nowcast
+    APIRequestHandler.raster = TileRenderer(str(base_dir), str(APIRequestHandler.api.cache_dir))
+    
+    if access_log not in ("", "-") and not Path(access_log).is_absolute():
+        access_log = str(base_dir / access_log)
+    APIRequestHandler.access_log = AccessLog(access_log)
+
     server_address = (DEFAULT_HOST, port)
     handler = partial(APIRequestHandler, directory=str(serve_dir))
-    httpd = HTTPServer(server_address, handler)
+    httpd = AdmissionHTTPServer(server_address, handler, serve_dir=str(serve_dir),
+                                workers=workers, max_queue=max_queue)
+    # 503s sent by admission control never reach a handler; log them too
+    httpd.shed_log = APIRequestHandler.access_log.log
+    APIRequestHandler.timings.slow_sink = APIRequestHandler.access_log.log_slow
 
     print(
         f"http://{DEFAULT_HOST}:{port} | {files_info['count']} PMTiles files | Base: {base_dir} | Serve: {serve_dir}\n"
+        f"Workers: {workers} | Max queue: {max_queue}\n"
+        f"Access log: {APIRequestHandler.access_log.get_stats()['path']}\n"
         "Press Ctrl+C to stop."
     )
     
@@ -597,7 +1000,11 @@ def run_server(port: int = DEFAULT_PORT, directory: str = None):
         httpd.serve_forever()
     except KeyboardInterrupt:
         print("\n[Server] Shutting down...")
+        nowcast.stop()
+        APIRequestHandler.raster.close()
+        APIRequestHandler.access_log.close()
         httpd.server_close()
+        shutdown_process_pool()
         print("[Server] Stopped.")
 
 
@@ -606,6 +1013,12 @@ if __name__ == '__main__':
     parser.add_argument('port', nargs='?', type=int, default=DEFAULT_PORT, help='Port to listen on (default: 8000)')
     parser.add_argument('--host', default=DEFAULT_HOST, help='Bind host (default: 127.0.0.1). Set 0.0.0.0 to listen publicly.')
     parser.add_argument('--base-dir', dest='base_dir', default=os.getenv('APP_BASE_DIR'), help='Project base directory (optional)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help=f'Worker threads (default: {DEFAULT_WORKERS})')
+    parser.add_argument('--max-queue', dest='max_queue', type=int, default=DEFAULT_MAX_QUEUE, help=f'Max queued requests before shedding (default: {DEFAULT_MAX_QUEUE})')
+    parser.add_argument('--ingest', action='store_true', default=os.getenv('APP_INGEST', '') == '1',
+                        help='Enable live nowcast ingest (inbox watcher and POST /api/nowcast/slots)')
+    parser.add_argument('--access-log', dest='access_log', default=DEFAULT_ACCESS_LOG,
+                        help=f'Access log file, relative to the base dir, or - for stdout (default: {DEFAULT_ACCESS_LOG})')
     args = parser.parse_args()
 
     # Override default host if provided.
@@ -613,4 +1026,4 @@ if __name__ == '__main__':
         os.environ["APP_BIND_HOST"] = args.host
         DEFAULT_HOST = args.host
 
-    run_server(args.port, args.base_dir)
+    run_server(args.port, args.base_dir, args.workers, args.max_queue, args.ingest, args.access_log)
@@ -0,0 +1,115 @@
+"""Shared pytest setup: the server modules live flat at the repository root."""
+
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import config  # noqa: E402
+from pmtiles_reader import lonlat_to_tile, zxy_to_tileid  # noqa: E402
+from pmtiles_writer import encode_varint, write_pmtiles  # noqa: E402
+
+BATCH_ZOOM = 12
+CELL_DEGREES = 0.0025
+ORIGIN = (76.98, 28.40)
+EXTENT = 4096
+
+
+def _field(number: int, payload) -> bytes:
+    if isinstance(payload, int):
+        return encode_varint(number << 3) + encode_varint(payload)
+    return encode_varint((number << 3) | 2) + encode_varint(len(payload)) + payload
+
+
+def _packed(number: int, values: list) -> bytes:
+    return _field(number, b''.join(encode_varint(v) for v in values))
+
+
+def _zigzag(n: int) -> int:
+    return (n << 1) ^ (n >> 63)
+
+
+def cell_ring(i: int, j: int) -> list:
+    """Closed lon/lat ring of grid cell (i, j)."""
+    lon = ORIGIN[0] + i * CELL_DEGREES
+    lat = ORIGIN[1] + j * CELL_DEGREES
+    step = CELL_DEGREES
+    return [(lon, lat), (lon + step, lat), (lon + step, lat + step), (lon, lat + step), (lon, lat)]
+
+
+def _encode_tile(tx: int, ty: int, features: list) -> bytes:
+    values = []
+    value_index = {}
+
+    def value(text):
+        if text not in value_index:
+            value_index[text] = len(values)
+            values.append(_field(1, text.encode('utf-8')))
+        return value_index[text]
+
+    encoded = []
+    for code, ring, depths in features:
+        tags = [0, value(code), 1, value(json.dumps(depths))]
+        points = []
+        for lon, lat in ring[:-1]:
+            x, y = lonlat_to_tile(BATCH_ZOOM, lon, lat)
+            points.append((round((x - tx) * EXTENT), round((y - ty) * EXTENT)))
+        commands = [1 | (1 << 3), _zigzag(points[0][0]), _zigzag(points[0][1]),
+                    2 | ((len(points) - 1) << 3)]
+        for (x0, y0), (x1, y1) in zip(points, points[1:]):
+            commands += [_zigzag(x1 - x0), _zigzag(y1 - y0)]
+        commands.append(7 | (1 << 3))
+        encoded.append(_field(2, _packed(2, tags) + _field(3, 3) + _packed(4, commands)))
+
+    layer = [_field(15, 2), _field(1, b'flood'), *encoded,
+             _field(3, b'geo_code'), _field(3, b'flood_depths'),
+             *(_field(4, v) for v in values), _field(5, EXTENT)]
+    return _field(3, b''.join(layer))
+
+
+@pytest.fixture
+def write_batch():
+    """
+    Return write(path, cells) that writes a one-zoom batch PMTiles file.
+
+    cells maps geo_code -> ((i, j) grid cell, list of BATCH_SIZE depths).
+    """
+    def write(path, cells: dict):
+        tiles = {}
+        lons = []
+        lats = []
+        for code, ((i, j), depths) in cells.items():
+            ring = cell_ring(i, j)
+            lons += [p[0] for p in ring]
+            lats += [p[1] for p in ring]
+            x, y = lonlat_to_tile(BATCH_ZOOM, ring[0][0] + CELL_DEGREES / 2, ring[0][1] + CELL_DEGREES / 2)
+            tiles.setdefault((int(x), int(y)), []).append((code, ring, list(depths)))
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        header = {
+            "tileType": 1,
+            "minZoom": BATCH_ZOOM,
+            "maxZoom": BATCH_ZOOM,
+            "bounds": (min(lons), min(lats), max(lons), max(lats)),
+            "center": ((min(lons) + max(lons)) / 2, (min(lats) + max(lats)) / 2, BATCH_ZOOM),
+        }
+        write_pmtiles(path, [(zxy_to_tileid(BATCH_ZOOM, x, y), _encode_tile(x, y, features))
+                             for (x, y), features in tiles.items()],
+                      header, {"vector_layers": [{"id": "flood"}]})
+        return path
+
+    return write
+
+
+@pytest.fixture
+def two_batch_window(monkeypatch):
+    """Shrink the configured time range to two batches and no live ingest."""
+    monkeypatch.setattr(config, "START_TIME", 202507130155)
+    monkeypatch.setattr(config, "END_TIME", 202507130950)
+    monkeypatch.setattr(config, "INGEST_BATCH_FILES", {})
+    return config.get_batch_files()
@@ -0,0 +1,90 @@
+"""Access log: JSON lines, 206 sampling, drops, rotation and write failures."""
+
+import json
+import os
+
+import access_log
+from access_log import AccessLog, client_of
+
+
+def read_records(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_writes_json_lines(tmp_path):
+    path = tmp_path / "logs" / "access.log"
+    log = AccessLog(str(path))
+    log.log("GET", "/api/raster/1/2/3/4.png", 200, 512, None, 0.0123, "10.0.0.1")
+    log.log_slow({"method": "GET", "path": "/api/export", "totalMs": 812.5})
+    log.close()
+
+    request, slow = read_records(path)
+    assert request["route"] == "/api/raster/*"
+    assert (request["status"], request["bytes"], request["durationMs"]) == (200, 512, 12.3)
+    assert slow == {"type": "slow", "method": "GET", "path": "/api/export", "totalMs": 812.5}
+    assert log.get_stats()["written"] == 2
+
+
+def test_defaults_to_stdout(capsys):
+    assert access_log.DEFAULT_ACCESS_LOG == os.getenv("APP_ACCESS_LOG", "-")
+    log = AccessLog("-")
+    log.log("GET", "/api/health", 200, 10, None, 0.001, "127.0.0.1")
+    log.close()
+    assert json.loads(capsys.readouterr().out)["path"] == "/api/health"
+    assert log.get_stats()["path"] == "stdout"
+
+
+def test_samples_range_responses(tmp_path):
+    log = AccessLog(str(tmp_path / "access.log"), sample_206=0.0)
+    for _ in range(10):
+        log.log("GET", "/pmtiles/flood/D1.pmtiles", 206, 4096, "bytes=0-4095", 0.001, "c")
+    log.log("GET", "/api/config", 200, 10, None, 0.001, "c")
+    log.close()
+    stats = log.get_stats()
+    assert (stats["sampledOut"], stats["written"]) == (10, 1)
+
+
+def test_drops_when_buffer_full(tmp_path, monkeypatch):
+    # Keep the writer asleep so the buffer fills
+    monkeypatch.setattr(access_log, "FLUSH_INTERVAL", 60)
+    log = AccessLog(str(tmp_path / "access.log"), max_buffered=5)
+    for i in range(8):
+        log.log("GET", f"/api/x{i}", 200, 1, None, 0.001, "c")
+    assert log.get_stats()["dropped"] == 3
+    log.close()
+    assert len(read_records(tmp_path / "access.log")) == 5
+
+
+def test_rotates_and_keeps_backups(tmp_path, monkeypatch):
+    monkeypatch.setattr(access_log, "MAX_BATCH_RECORDS", 1)
+    path = tmp_path / "access.log"
+    log = AccessLog(str(path), rotate_bytes=300, backups=2)
+    for i in range(20):
+        log.log("GET", f"/api/{i:02d}", 200, 1, None, 0.001, "c")
+    log.close()
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["access.log", "access.log.1", "access.log.2"]
+    assert all(p.stat().st_size <= 300 for p in tmp_path.iterdir())
+    assert read_records(path)[-1]["path"] == "/api/19"
+    stats = log.get_stats()
+    assert stats["rotations"] > 2 and stats["written"] == 20
+
+
+def test_write_failures_are_reported(tmp_path, capsys):
+    blocker = tmp_path / "logs"
+    blocker.write_text("not a directory")
+    log = AccessLog(str(blocker / "access.log"))
+    assert "[AccessLog] Cannot open" in capsys.readouterr().out
+    log.log("GET", "/api/health", 200, 10, None, 0.001, "c")
+    log.close()
+
+    stats = log.get_stats()
+    assert stats["failing"] and log.failing
+    assert stats["writeErrors"] >= 1 and stats["dropped"] == 1
+    assert stats["lastError"]["error"]
+
+
+def test_client_of_trusts_proxy_only():
+    assert client_of(("127.0.0.1", 5000), {"X-Real-IP": "203.0.113.9"}) == "203.0.113.9"
+    assert client_of(("198.51.100.2", 5000), {"X-Real-IP": "203.0.113.9"}) == "198.51.100.2"
+    assert client_of(None, None) == "-"
@@ -0,0 +1,171 @@
+"""Admission control: classification, shedding and recovery."""
+
+import socket
+import struct
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler
+
+import pytest
+
+import admission
+from admission import (AdmissionHTTPServer, PRIORITY_BULK, PRIORITY_INTERACTIVE,
+                       PRIORITY_STATIC, PMTILES_TILE_DATA_OFFSET_POS)
+
+TILE_DATA_OFFSET = 1024
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def serve_dir(tmp_path):
+    header = bytearray(127)
+    header[:7] = b'PMTiles'
+    header[7] = 3
+    struct.pack_into('<Q', header, PMTILES_TILE_DATA_OFFSET_POS, TILE_DATA_OFFSET)
+    (tmp_path / "flood.pmtiles").write_bytes(bytes(header) + b'\0' * 8192)
+    return tmp_path
+
+
+@pytest.fixture
+def make_server(serve_dir):
+    servers = []
+
+    def make(**kwargs):
+        handler = partial(QuietHandler, directory=str(serve_dir))
+        httpd = AdmissionHTTPServer(('127.0.0.1', 0), handler, serve_dir=str(serve_dir), **kwargs)
+        threading.Thread(target=httpd.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+        servers.append(httpd)
+        return httpd
+
+    yield make
+    for httpd in servers:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def get_status(httpd, path, headers=None, timeout=5.0) -> int:
+    lines = [f"GET {path} HTTP/1.0"] + [f"{k}: {v}" for k, v in (headers or {}).items()]
+    with socket.create_connection(httpd.server_address, timeout=timeout) as sock:
+        sock.sendall(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1'))
+        # Read to EOF: the server has released the request once it closes the connection
+        status_line = sock.makefile('rb').read().split(b"\r\n", 1)[0]
+    return int(status_line.split()[1])
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_classify_priorities(make_server):
+    httpd = make_server(workers=2)
+    httpd._directory_offsets['/flood.pmtiles'] = (time.monotonic(), 0, TILE_DATA_OFFSET)
+    assert httpd._classify('/api/config', None) == PRIORITY_INTERACTIVE
+    assert httpd._classify('/api/raster/0/12/1/1.png', None) == PRIORITY_STATIC
+    assert httpd._classify('/viewer.html', None) == PRIORITY_STATIC
+    assert httpd._classify('/flood.pmtiles', 0) == PRIORITY_INTERACTIVE
+    assert httpd._classify('/flood.pmtiles', TILE_DATA_OFFSET + 10) == PRIORITY_BULK
+    assert httpd._classify('/flood.pmtiles', None) == PRIORITY_BULK
+
+
+def test_tile_data_offset_is_read_by_workers(make_server):
+    httpd = make_server(workers=2)
+    assert '/flood.pmtiles' not in httpd._directory_offsets
+    assert get_status(httpd, '/flood.pmtiles', {"Range": "bytes=0-99"}) == 200
+    assert wait_for(lambda: '/flood.pmtiles' in httpd._directory_offsets)
+    assert httpd._directory_offsets['/flood.pmtiles'][2] == TILE_DATA_OFFSET
+
+
+def test_bulk_ranges_admitted_again_after_queue_drains(make_server, monkeypatch):
+    monkeypatch.setattr(admission, "QUEUE_DELAY_HALF_LIFE", 0.05)
+    httpd = make_server(workers=8, queue_target_ms=250)
+    get_status(httpd, '/flood.pmtiles', {"Range": "bytes=0-99"})
+    assert wait_for(lambda: '/flood.pmtiles' in httpd._directory_offsets)
+    bulk = {"Range": f"bytes={TILE_DATA_OFFSET + 100}-{TILE_DATA_OFFSET + 199}"}
+
+    # State right after an overload burst: queue delay far above target
+    with httpd._lock:
+        httpd._queue_delay = 1.0
+        httpd._queue_delay_at = time.monotonic()
+    assert get_status(httpd, '/flood.pmtiles', bulk) == 503
+
+    # Nothing is dequeued while bulk requests are refused; the delay must still decay
+    time.sleep(0.6)
+    assert [get_status(httpd, '/flood.pmtiles', bulk) for _ in range(5)] == [200] * 5
+    assert httpd.get_stats()["queueDelayMs"] < 250
+
+
+def test_silent_clients_do_not_block_accepts(make_server):
+    httpd = make_server(workers=4)
+    silent = [socket.create_connection(httpd.server_address) for _ in range(3)]
+    try:
+        started = time.monotonic()
+        assert get_status(httpd, '/api/anything') == 404
+        assert time.monotonic() - started < 0.5
+    finally:
+        for sock in silent:
+            sock.close()
+
+
+def test_max_per_client_capped_at_worker_share():
+    httpd = AdmissionHTTPServer(('127.0.0.1', 0), QuietHandler, workers=8, max_per_client=64)
+    try:
+        assert httpd.max_per_client == 2
+        assert httpd.get_stats()["maxPerClient"] == 2
+    finally:
+        httpd.server_close()
+    httpd = AdmissionHTTPServer(('127.0.0.1', 0), QuietHandler, workers=2, max_per_client=64)
+    try:
+        assert httpd.max_per_client == 1
+    finally:
+        httpd.server_close()
+
+
+def test_idle_connections_never_reach_workers(make_server, monkeypatch):
+    monkeypatch.setattr(admission, "HEAD_WAIT_TIMEOUT", 0.2)
+    httpd = make_server(workers=4)
+    idle = [socket.create_connection(httpd.server_address) for _ in range(4)]
+    try:
+        assert wait_for(lambda: httpd.get_stats()["closedIdle"] == 4)
+        for sock in idle:
+            sock.settimeout(1.0)
+            assert sock.recv(1) == b''  # Closed by the server
+        assert get_status(httpd, '/api/anything') == 404
+        stats = httpd.get_stats()
+        assert stats["admitted"] == 1 and stats["shedClientLimit"] == 0
+    finally:
+        for sock in idle:
+            sock.close()
+
+
+def test_handler_timeout_frees_worker_from_stalled_client(make_server, monkeypatch):
+    import server
+    assert 0 < server.APIRequestHandler.timeout <= 60
+
+    # A partial head is admitted; the handler's timeout must release the worker
+    monkeypatch.setattr(QuietHandler, "timeout", 0.3, raising=False)
+    httpd = make_server(workers=4)
+    with socket.create_connection(httpd.server_address) as stalled:
+        stalled.sendall(b"GET /flood.pmtiles HTTP/1.0\r\n")
+        assert wait_for(lambda: httpd.get_stats()["served"] == 1, timeout=3.0)
+
+
+def test_shed_requests_are_logged(make_server):
+    records = []
+    httpd = make_server(workers=2, max_queue=0)
+    httpd.shed_log = lambda *record: records.append(record)
+
+    assert get_status(httpd, '/flood.pmtiles', {"Range": "bytes=0-99"}) == 503
+    assert wait_for(lambda: records)
+
+    method, path, status, size, range_header, duration, client = records[0]
+    assert (method, path, status, range_header, client) == ('GET', '/flood.pmtiles', 503, 'bytes=0-99', '127.0.0.1')
+    assert size > 0
+    assert httpd.get_stats()["shedQueueFull"] == 1
@@ -0,0 +1,128 @@
+"""Depth export: parameter validation, feature selection and the three formats."""
+
+import json
+import struct
+from io import BytesIO
+
+import numpy as np
+import pytest
+
+import config
+from conftest import BATCH_ZOOM
+from depth_export import (COLUMNAR_MAGIC, parse_export_params, prepare_export,
+                          union_features)
+from flood_data import shutdown_process_pool
+
+SIZE = config.BATCH_SIZE
+
+
+@pytest.fixture
+def project(tmp_path, write_batch, two_batch_window):
+    """Two batches; G2 only exists in the second one."""
+    first, second = two_batch_window
+    write_batch(tmp_path / first["path"], {
+        "G0": ((0, 0), [0.1] * SIZE),
+        "G1": ((1, 0), [0.2] * SIZE),
+    })
+    write_batch(tmp_path / second["path"], {
+        "G0": ((0, 0), [1.1] * SIZE),
+        "G1": ((1, 0), [1.2] * SIZE),
+        "G2": ((2, 0), [1.3] * SIZE),
+    })
+    yield tmp_path
+    shutdown_process_pool()
+
+
+def export(project, **query):
+    params = parse_export_params({k: [v] for k, v in query.items()})
+    result = prepare_export(project, project / "cache", params)
+    return result, b"".join(result["chunks"])
+
+
+def test_parse_rejects_bad_parameters(two_batch_window):
+    with pytest.raises(ValueError):
+        parse_export_params({"format": ["xlsx"]})
+    with pytest.raises(ValueError):
+        parse_export_params({"bbox": ["1,2,3"]})
+    with pytest.raises(ValueError):
+        parse_export_params({"bbox": ["0,0,1,1"], "polygon": ["[[0,0],[1,0],[1,1]]"]})
+    with pytest.raises(ValueError):
+        parse_export_params({"polygon": ["[[0,0],[1,0]]"]})
+    with pytest.raises(ValueError):
+        parse_export_params({"start": ["203001010000"], "end": ["203001020000"]})
+
+
+def test_parse_accepts_parquet_aliases(two_batch_window):
+    assert parse_export_params({"format": ["parquet-like"]})["format"] == "columnar"
+    assert parse_export_params({"format": ["Parquet"]})["format"] == "columnar"
+
+
+@pytest.mark.parametrize("zoom", ["-3", "99", "x"])
+def test_parse_rejects_bad_zoom(two_batch_window, zoom):
+    with pytest.raises(ValueError):
+        parse_export_params({"zoom": [zoom]})
+
+
+def test_parse_checks_zoom_against_archive(project):
+    assert parse_export_params({"zoom": [str(BATCH_ZOOM)]}, project)["zoom"] == BATCH_ZOOM
+    with pytest.raises(ValueError, match="between 12 and 12"):
+        parse_export_params({"zoom": ["14"]}, project)
+
+
+def test_parse_clamps_window(two_batch_window):
+    params = parse_export_params({"start": ["202507130155"], "end": ["202507130200"]})
+    assert (params["firstSlot"], params["lastSlot"]) == (0, 1)
+    assert params["format"] == "csv"
+
+
+def test_union_features_keeps_first_coordinates():
+    codes, lon, lat = union_features([
+        (np.array(["A", "C"]), np.array([1.0, 3.0]), np.array([10.0, 30.0])),
+        (np.array(["B", "C"]), np.array([2.0, 9.0]), np.array([20.0, 90.0])),
+    ])
+    assert codes.tolist() == ["A", "B", "C"]
+    assert lon.tolist() == [1.0, 2.0, 3.0]
+    assert lat.tolist() == [10.0, 20.0, 30.0]
+
+
+def test_csv_includes_features_of_later_batches(project):
+    # Last slot of the first batch and first slot of the second
+    result, data = export(project, format="csv", start="202507130550", end="202507130555")
+    rows = [line.split(",") for line in data.decode().splitlines()]
+    assert rows[0] == ["geo_code", "timestamp", "depth"]
+    assert result["featureCount"] == 3
+    assert rows[1:] == [
+        ["G0", "202507130550", "0.100"],
+        ["G1", "202507130550", "0.200"],
+        ["G2", "202507130550", ""],
+        ["G0", "202507130555", "1.100"],
+        ["G1", "202507130555", "1.200"],
+        ["G2", "202507130555", "1.300"],
+    ]
+
+
+def test_npy_matches_csv_layout(project):
+    result, data = export(project, format="npy")
+    array = np.load(BytesIO(data))
+    assert array.shape == (2 * SIZE, 3) == (result["slotCount"], result["featureCount"])
+    assert np.isnan(array[:SIZE, 2]).all()
+    np.testing.assert_allclose(array[SIZE], [1.1, 1.2, 1.3], rtol=1e-6)
+
+
+def test_columnar_header_and_columns(project):
+    result, data = export(project, format="columnar", start="202507130555", end="202507130600")
+    assert data[:4] == COLUMNAR_MAGIC
+    (length,) = struct.unpack("<I", data[4:8])
+    header = json.loads(data[8:8 + length])
+    assert header["geoCodes"] == ["G0", "G1", "G2"]
+    assert header["timestamps"] == [202507130555, 202507130600]
+    columns = np.frombuffer(data[8 + length:], dtype="<f4").reshape(header["shape"])
+    np.testing.assert_allclose(columns[1], [1.1, 1.2, 1.3], rtol=1e-6)
+
+
+def test_bbox_selects_across_batches(project):
+    # Only the G2 cell (present in the second batch alone) lies in this box
+    bbox = "76.9851,28.4001,76.9874,28.4024"
+    result, data = export(project, format="csv", bbox=bbox, start="202507130555", end="202507130555")
+    assert result["featureCount"] == 1
+    assert data.decode().splitlines()[1] == "G2,202507130555,1.300"
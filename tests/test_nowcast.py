@@ -0,0 +1,155 @@
+"""Live nowcast ingest: versioned batch files, time index updates and events."""
+
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+import pytest
+
+import config
+import nowcast
+from flood_data import decode_batch
+from nowcast import EventBroadcaster, NowcastIngestor, parse_slot_payload
+
+SIZE = config.BATCH_SIZE
+FIRST_LIVE_SLOT = 202507130955   # First slot after the two static batches
+
+
+@pytest.fixture
+def ingestor(tmp_path, write_batch, two_batch_window):
+    for batch in two_batch_window:
+        write_batch(tmp_path / batch["path"], {
+            "G0": ((0, 0), [0.5] * SIZE),
+            "G1": ((1, 0), [0.5] * SIZE),
+        })
+    ingestor = NowcastIngestor(tmp_path, enabled=True)
+    yield ingestor
+    ingestor.stop()
+
+
+def live_files(ingestor):
+    return sorted(p.name for p in ingestor.flood_dir.glob("*_v*.pmtiles"))
+
+
+def test_parse_slot_payload_formats():
+    assert parse_slot_payload(b'{"timestamp": 202507130955, "depths": {"G0": 1}}') == \
+        (202507130955, {"G0": 1.0})
+    assert parse_slot_payload(b'geo_code,depth\nG0,0.25\nG1,\n', 'text/csv', 202507130955) == \
+        (202507130955, {"G0": 0.25, "G1": None})
+    with pytest.raises(ValueError):
+        parse_slot_payload(b'G0,0.25\n', 'text/csv')
+    with pytest.raises(ValueError):
+        parse_slot_payload(b'{"timestamp": 202507130955, "depths": {"G0": "deep"}}')
+
+
+def test_ingest_writes_new_versions(ingestor):
+    first = ingestor.ingest_slot(FIRST_LIVE_SLOT, {"G0": 1.5})
+    assert first["batchFile"] == "D202507130955_v1.pmtiles"
+    assert config.END_TIME == FIRST_LIVE_SLOT
+
+    live = config.get_batch_files()[-1]
+    assert live["live"] and live["filename"] == first["batchFile"]
+    assert live["startIndex"] == 2 * SIZE
+
+    second = ingestor.ingest_slot(202507131000, {"G0": 2.5, "G1": 0.75})
+    assert second["batchFile"] == "D202507130955_v2.pmtiles"
+    assert config.END_TIME == 202507131000
+    # The previous version stays for viewers that are still loading it
+    assert live_files(ingestor) == ["D202507130955_v1.pmtiles", "D202507130955_v2.pmtiles"]
+
+    batch = decode_batch(ingestor.flood_dir / second["batchFile"])
+    np.testing.assert_allclose(batch.depths[:, :2], [[1.5, 2.5], [np.nan, 0.75]])
+
+    ingestor.ingest_slot(202507131005, {"G0": 3.5})
+    assert live_files(ingestor) == ["D202507130955_v2.pmtiles", "D202507130955_v3.pmtiles"]
+
+
+def test_ingest_restores_after_restart(ingestor, tmp_path):
+    ingestor.ingest_slot(FIRST_LIVE_SLOT, {"G0": 1.5})
+    config.INGEST_BATCH_FILES = {}
+    config.END_TIME = 202507130950
+
+    restarted = NowcastIngestor(tmp_path, enabled=True)
+    restarted.restore()
+    assert config.END_TIME == FIRST_LIVE_SLOT
+    assert config.get_batch_files()[-1]["filename"] == "D202507130955_v1.pmtiles"
+
+    result = restarted.ingest_slot(202507131000, {"G1": 0.5})
+    assert result["batchFile"] == "D202507130955_v2.pmtiles"
+    batch = decode_batch(tmp_path / config.PMTILES_FLOOD_DIR / result["batchFile"])
+    np.testing.assert_allclose(batch.depths[:, :2], [[1.5, np.nan], [np.nan, 0.5]])
+
+
+def test_ingest_rejects_invalid_slots(ingestor):
+    with pytest.raises(FileExistsError):
+        ingestor.ingest_slot(202507130900, {"G0": 1.0})
+    with pytest.raises(ValueError):
+        ingestor.ingest_slot(202507130957, {"G0": 1.0})
+    with pytest.raises(ValueError):
+        # More than MAX_SLOT_GAP slots past END_TIME
+        ingestor.ingest_slot(202507131300, {"G0": 1.0})
+    assert live_files(ingestor) == []
+
+
+def test_batch_files_snapshot_survives_concurrent_ingest(two_batch_window):
+    stop = threading.Event()
+    errors = []
+
+    def read():
+        while not stop.is_set():
+            try:
+                config.get_batch_files()
+            except RuntimeError as e:  # "dictionary changed size during iteration"
+                errors.append(e)
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    try:
+        start = config.parse_time(FIRST_LIVE_SLOT)
+        for i in range(500):
+            batch_start = start + timedelta(minutes=i * SIZE * config.INTERVAL)
+            config.register_batch_file(int(config.format_time(batch_start)), f"x{i}.pmtiles")
+    finally:
+        stop.set()
+        reader.join()
+    assert errors == []
+
+
+class SlowSocket:
+    """Socket stand-in whose peer stops reading after the first send."""
+
+    def __init__(self):
+        self.sent = []
+        self.received = threading.Event()
+
+    def settimeout(self, timeout):
+        pass
+
+    def sendall(self, payload):
+        if self.sent:
+            time.sleep(0.5)
+        self.sent.append(payload)
+        if len(self.sent) > 1:
+            self.received.set()
+
+    def shutdown(self, how):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_publish_does_not_wait_for_slow_subscribers(monkeypatch):
+    monkeypatch.setattr(nowcast, "SSE_KEEPALIVE_SECONDS", 60)
+    events = EventBroadcaster()
+    sock = SlowSocket()
+    events.add(sock)
+    try:
+        started = time.perf_counter()
+        events.publish("slot", {"slot": 1})
+        assert time.perf_counter() - started < 0.2
+        assert sock.received.wait(2)
+        assert sock.sent[-1].startswith(b"event: slot\n")
+    finally:
+        events.close()
@@ -0,0 +1,140 @@
+"""Request timings, slow-request log and profiler parameters."""
+
+import threading
+import time
+
+import pytest
+
+import profiling
+from profiling import (MAX_PROFILE_SECONDS, MAX_SLOW_REQUEST_MS, RequestTimer, RequestTimings,
+                       SamplingProfiler, format_collapsed, parse_profile_params, parse_timings_params,
+                       route_key, top_functions)
+
+
+def query(**params):
+    return {name: [str(value)] for name, value in params.items()}
+
+
+def test_parse_profile_params_defaults():
+    params = parse_profile_params({})
+    assert params == {"seconds": 10.0, "intervalMs": 5.0, "format": "collapsed", "includeIdle": False}
+    assert parse_profile_params(query(seconds=1, interval=2, format="json", idle=1))["includeIdle"]
+
+
+@pytest.mark.parametrize("params", [
+    {"seconds": "nan"}, {"seconds": "inf"}, {"seconds": 0}, {"seconds": MAX_PROFILE_SECONDS + 1},
+    {"interval": "nan"}, {"interval": "inf"}, {"interval": "-inf"}, {"interval": 0.5},
+    {"interval": 5000}, {"interval": "fast"}, {"format": "svg"},
+])
+def test_parse_profile_params_rejects(params):
+    with pytest.raises(ValueError):
+        parse_profile_params(query(**params))
+
+
+def test_parse_timings_params():
+    assert parse_timings_params({}) == {"enabled": None, "slowMs": None}
+    assert parse_timings_params(query(enabled=0, slowMs=250)) == {"enabled": False, "slowMs": 250.0}
+
+
+@pytest.mark.parametrize("params", [
+    {"enabled": "yes"}, {"slowMs": "nan"}, {"slowMs": "inf"}, {"slowMs": -1},
+    {"slowMs": MAX_SLOW_REQUEST_MS + 1}, {"slowMs": "slow"},
+])
+def test_parse_timings_params_rejects(params):
+    with pytest.raises(ValueError):
+        parse_timings_params(query(**params))
+
+
+def test_timings_toggle_and_threshold():
+    entries = []
+    timings = RequestTimings(slow_ms=60_000, slow_sink=entries.append, enabled=False)
+    timings.record("GET", "/api/config", RequestTimer())
+    assert timings.get_stats()["routes"] == {} and not timings.get_stats()["enabled"]
+
+    timings.configure(enabled=True, slow_ms=0)
+    timings.record("GET", "/api/config", RequestTimer())
+    stats = timings.get_stats()
+    assert stats["enabled"] and stats["slowThresholdMs"] == 0
+    assert stats["routes"]["/api/config"]["count"] == 1 and len(entries) == 1
+
+    timings.configure(slow_ms=1000)
+    assert timings.get_stats()["enabled"] and timings.slow_threshold == 1.0
+
+
+def test_route_key():
+    assert route_key("/api/raster/3/12/1/2.png?style=binary") == "/api/raster/*"
+    assert route_key("/api/config?run=b") == "/api/config"
+    assert route_key("/pmtiles/flood/D202507130155.pmtiles") == "pmtiles"
+    assert route_key("/js/main.js") == "static"
+
+
+def test_timer_nested_phases_count_once():
+    timer = RequestTimer()
+    with timer.phase("io"):
+        with timer.phase("serialize"):
+            time.sleep(0.01)
+    breakdown = timer.breakdown()
+    assert breakdown["io"] >= 0.01 and breakdown["serialize"] == 0.0
+    assert breakdown["total"] >= breakdown["io"] + breakdown["handler"] - 1e-9
+
+
+def test_slow_requests_go_to_sink(capsys):
+    entries = []
+    timings = RequestTimings(slow_ms=5, slow_sink=entries.append)
+    fast = RequestTimer()
+    timings.record("GET", "/api/config", fast)
+    slow = RequestTimer()
+    slow.status = 200
+    time.sleep(0.01)
+    timings.record("GET", "/api/export?format=csv", slow)
+
+    assert [e["route"] for e in entries] == ["/api/export"]
+    assert entries[0]["status"] == 200
+    stats = timings.get_stats()
+    assert stats["routes"]["/api/config"]["count"] == 1
+    assert [e["path"] for e in stats["slowRequests"]] == ["/api/export?format=csv"]
+    assert capsys.readouterr().out == ""
+
+
+def test_profiler_samples_busy_thread():
+    stop = threading.Event()
+
+    def busy_loop():
+        while not stop.is_set():
+            sum(range(1000))
+
+    worker = threading.Thread(target=busy_loop, name="busy-1")
+    worker.start()
+    try:
+        profile = SamplingProfiler().run(0.2, 2)
+    finally:
+        stop.set()
+        worker.join()
+    assert profile["samples"] > 0
+    text = format_collapsed(profile)
+    assert any(line.startswith("busy;") and "busy_loop" in line for line in text.splitlines())
+    assert any("busy_loop" in row["function"] for row in top_functions(profile))
+
+
+def test_profiler_rejects_concurrent_runs():
+    profiler = SamplingProfiler()
+    runner = threading.Thread(target=profiler.run, args=(0.3,))
+    runner.start()
+    time.sleep(0.05)
+    try:
+        with pytest.raises(RuntimeError):
+            profiler.run(0.01)
+    finally:
+        runner.join()
+
+
+def test_collapse_without_qualname():
+    class Code:
+        co_filename = "/srv/app/server.py"
+        co_name = "do_GET"
+
+    class Frame:
+        f_code = Code()
+        f_back = None
+
+    assert profiling._collapse(Frame(), "http-worker") == "http-worker;server.py:do_GET"
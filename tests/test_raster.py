@@ -0,0 +1,125 @@
+"""Raster tiles: rasterization, slot lookup, rendering and the disk cache."""
+
+import os
+import time
+
+import numpy as np
+import pytest
+
+import config
+from conftest import BATCH_ZOOM, cell_ring
+from flood_data import shutdown_process_pool
+from pmtiles_reader import lonlat_to_tile
+from raster import (EMPTY_TILE, TILE_SIZE, TileRenderer, depth_colours,
+                    rasterize_polygons, resolve_slot)
+
+SIZE = config.BATCH_SIZE
+
+
+def cell_tile(i: int, j: int) -> tuple:
+    x, y = lonlat_to_tile(BATCH_ZOOM, *cell_ring(i, j)[0])
+    return BATCH_ZOOM, int(x), int(y)
+
+
+@pytest.fixture
+def renderer(tmp_path, write_batch, two_batch_window):
+    for b, batch in enumerate(two_batch_window):
+        write_batch(tmp_path / batch["path"], {
+            "G0": ((0, 0), [0.5 + b] * SIZE),
+            "G1": ((1, 0), [0.0] * SIZE),
+        })
+    renderer = TileRenderer(tmp_path, tmp_path / "cache")
+    yield renderer
+    renderer.close()
+    shutdown_process_pool()
+
+
+def test_rasterize_square_with_hole():
+    outer = [(10, 10), (30, 10), (30, 30), (10, 30)]
+    hole = [(15, 15), (25, 15), (25, 25), (15, 25)]
+    image = rasterize_polygons([outer, hole], [1, 1], size=40)
+    assert image[10:30, 10:30].sum() == 400 - 100
+    assert (image[15:25, 15:25] == 0).all()
+    assert image[:10].sum() == 0 and image[:, 30:].sum() == 0
+
+
+def test_rasterize_keeps_polygon_ids():
+    image = rasterize_polygons([[(0, 0), (4, 0), (4, 4), (0, 4)], [(4, 0), (8, 0), (8, 4), (4, 4)]], [1, 2], size=8)
+    assert (image[:4, :4] == 1).all() and (image[:4, 4:] == 2).all()
+    assert (image[4:] == 0).all()
+
+
+def test_depth_colours_transparent_when_dry():
+    rgba = depth_colours(np.array([np.nan, 0.0, 0.5, 2.0]), "binary")
+    assert rgba[:2, 3].tolist() == [0, 0]
+    assert rgba[2].tolist() == [0x10, 0xb9, 0x81, 255]
+    assert rgba[3].tolist() == [0xef, 0x44, 0x44, 255]
+
+
+def test_resolve_slot(two_batch_window):
+    assert resolve_slot("0") == 0
+    assert resolve_slot("202507130555") == SIZE
+    assert resolve_slot("D202507130600") == SIZE + 1
+    for value in ("-1", str(2 * SIZE), "abc", "202507140000"):
+        with pytest.raises(ValueError):
+            resolve_slot(value)
+
+
+def test_batch_lookup_by_slot_range(two_batch_window):
+    files = [
+        {"startIndex": 0, "endIndex": SIZE - 1, "filename": "a"},
+        {"startIndex": SIZE, "endIndex": 2 * SIZE - 1, "filename": "b"},
+        # Live batch registered off the static grid (e.g. restored from a manifest)
+        {"startIndex": SIZE + 24, "endIndex": 2 * SIZE + 23, "filename": "live"},
+    ]
+    assert TileRenderer._find_batch(files, 0)["filename"] == "a"
+    assert TileRenderer._find_batch(files, SIZE + 23)["filename"] == "b"
+    assert TileRenderer._find_batch(files, SIZE + 24)["filename"] == "live"
+    assert TileRenderer._find_batch(files, 2 * SIZE + 10)["filename"] == "live"
+    assert TileRenderer._find_batch(files, 2 * SIZE + 24) is None
+
+
+def test_batch_for_live_batch(renderer, write_batch):
+    config.register_batch_file(202507130955, "D202507130955_v1.pmtiles")
+    config.extend_end_time(202507131000)
+    write_batch(renderer.project_dir / config.PMTILES_FLOOD_DIR / "D202507130955_v1.pmtiles",
+                {"G0": ((0, 0), [3.0] * SIZE)})
+    batch = renderer._batch_for(2 * SIZE + 1)
+    assert batch["filename"] == "D202507130955_v1.pmtiles" and batch["live"]
+    with pytest.raises(FileNotFoundError):
+        renderer._batch_for(3 * SIZE)
+
+
+def test_render_uses_slot_depths(renderer):
+    z, x, y = cell_tile(0, 0)
+    first, live = renderer.render(0, z, x, y, "binary", prerender=False)
+    assert not live and first != EMPTY_TILE
+    second, _ = renderer.render(SIZE, z, x, y, "binary", prerender=False)
+    assert second != first   # 0.5 m (shallow) vs 1.5 m (flooded)
+
+    index_image, depths = next(iter(renderer._indexes.values()))
+    assert index_image.shape == (TILE_SIZE, TILE_SIZE)
+    assert len(depths) == 2 and depths.shape[1] == SIZE
+
+    assert renderer.render(0, z, x + 5, y, prerender=False)[0] == EMPTY_TILE
+    with pytest.raises(ValueError):
+        renderer.render(0, z, x, y, "sepia")
+
+
+def test_disk_cache_evicts_superseded_versions(renderer, two_batch_window, write_batch):
+    z, x, y = cell_tile(0, 0)
+    renderer.render(0, z, x, y, prerender=False)
+    raster_dir = renderer.cache_dir
+    assert len(list(raster_dir.iterdir())) == 1
+
+    path = renderer.project_dir / two_batch_window[0]["path"]
+    write_batch(path, {"G0": ((0, 0), [2.0] * SIZE)})
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    renderer.render(0, z, x, y, prerender=False)
+
+    deadline = time.monotonic() + 5
+    while len(list(raster_dir.iterdir())) > 1 and time.monotonic() < deadline:
+        time.sleep(0.02)
+    (current,) = raster_dir.iterdir()
+    assert current.name.endswith(f"+{path.stat().st_mtime_ns}")
@@ -0,0 +1,107 @@
+"""Scenario comparison: threshold validation, diff results and the disk cache."""
+
+import numpy as np
+import pytest
+
+import config
+import scenarios
+from flood_data import shutdown_process_pool
+from scenarios import (MAX_FLOOD_THRESHOLD, STATUS_BOTH, STATUS_DRY, STATUS_NEW,
+                       compare_runs, parse_threshold)
+
+SIZE = config.BATCH_SIZE
+
+
+@pytest.fixture
+def project(tmp_path, write_batch, two_batch_window, monkeypatch):
+    """Runs default, b and b-x; in b, G1 floods and G0 peaks later."""
+    monkeypatch.setattr(scenarios, "_memory_cache", type(scenarios._memory_cache)())
+    base = [0.0] * SIZE
+    base_peak = [0.5 if i == 2 else 0.2 for i in range(SIZE)]
+    later_peak = [0.8 if i == 5 else 0.2 for i in range(SIZE)]
+    for batch in two_batch_window:
+        flood_dir = tmp_path / config.PMTILES_FLOOD_DIR
+        write_batch(flood_dir / batch["filename"], {"G0": ((0, 0), base_peak), "G1": ((1, 0), base)})
+        for run in ("b", "b-x"):
+            write_batch(flood_dir / run / batch["filename"],
+                        {"G0": ((0, 0), later_peak), "G1": ((1, 0), [0.3] * SIZE)})
+    yield tmp_path
+    shutdown_process_pool()
+
+
+@pytest.mark.parametrize("value", ["nan", "inf", "-inf", "-0.5", str(MAX_FLOOD_THRESHOLD + 1), "deep", "1e308"])
+def test_parse_threshold_rejects(value):
+    with pytest.raises(ValueError):
+        parse_threshold(value)
+
+
+def test_parse_threshold_defaults_and_rounds():
+    assert parse_threshold(None) == scenarios.FLOOD_THRESHOLD
+    assert parse_threshold("0") == 0.0
+    assert parse_threshold("0.123456") == 0.12
+    assert parse_threshold(str(MAX_FLOOD_THRESHOLD)) == MAX_FLOOD_THRESHOLD
+
+
+def test_compare_runs(project):
+    diff = compare_runs(project, project / "cache", "default", "b", threshold=0.1)
+    assert diff.geo_codes.tolist() == ["G0", "G1"]
+    assert diff.status.tolist() == [STATUS_BOTH, STATUS_NEW]
+    np.testing.assert_allclose(diff.peak_delta, [0.3, 0.3], rtol=1e-6)
+    assert diff.peak_shift[0] == 3 * config.INTERVAL
+    assert len(diff.slot_timestamps) == 2 * SIZE
+
+    dry = compare_runs(project, project / "cache", "default", "b", threshold=1.0)
+    assert dry.status.tolist() == [STATUS_DRY, STATUS_DRY]
+
+
+def test_compare_runs_unions_features_of_all_batches(project, two_batch_window, write_batch):
+    first, second = two_batch_window
+    flood_dir = project / config.PMTILES_FLOOD_DIR
+    # G2 only in the scenario's first batch, G3 only in both runs' second batch
+    write_batch(flood_dir / "b" / first["filename"],
+          {"G0": ((0, 0), [0.2] * SIZE), "G2": ((2, 0), [2.0] * SIZE)})
+    for run_dir in (flood_dir, flood_dir / "b"):
+        write_batch(run_dir / second["filename"],
+              {"G0": ((0, 0), [0.2] * SIZE), "G3": ((3, 0), [0.4] * SIZE)})
+
+    diff = compare_runs(project, project / "cache", "default", "b", threshold=0.1)
+    assert diff.geo_codes.tolist() == ["G0", "G1", "G2", "G3"]
+    assert diff.status[2] == STATUS_NEW
+    np.testing.assert_allclose(diff.peak_scenario[2], 2.0)
+    assert np.isnan(diff.peak_base[2])
+    assert diff.status[3] == STATUS_BOTH
+    assert diff.lon[3] > diff.lon[2] > diff.lon[0]
+
+
+def test_compare_runs_rejects_same_run(project):
+    with pytest.raises(ValueError):
+        compare_runs(project, None, "b", "b")
+    with pytest.raises(FileNotFoundError):
+        compare_runs(project, None, "default", "missing")
+
+
+def test_cache_files_kept_per_pair_and_threshold(project):
+    cache_dir = project / "cache"
+    compare_runs(project, cache_dir, "default", "b", threshold=0.1)
+    compare_runs(project, cache_dir, "default", "b", threshold=0.2)
+    compare_runs(project, cache_dir, "default", "b-x", threshold=0.1)
+    files = sorted(p.name.rsplit("+", 1)[0] for p in (cache_dir / "scenarios").glob("*.npz"))
+    assert files == ["default+b+0.1", "default+b+0.2", "default+b-x+0.1"]
+
+    # Rewriting a batch of run b supersedes only that pair's cache entry at 0.1
+    batch = config.get_batch_files("b")[0]
+    path = project / batch["path"]
+    path.write_bytes(path.read_bytes())
+    compare_runs(project, cache_dir, "default", "b", threshold=0.1)
+    files = sorted(p.name.rsplit("+", 1)[0] for p in (cache_dir / "scenarios").glob("*.npz"))
+    assert files == ["default+b+0.1", "default+b+0.2", "default+b-x+0.1"]
+
+
+def test_failed_comparison_releases_inflight(project, monkeypatch):
+    def fail(*args):
+        raise ValueError("Cannot decode batch")
+
+    monkeypatch.setattr(scenarios, "_compute", fail)
+    with pytest.raises(ValueError):
+        compare_runs(project, None, "default", "b")
+    assert scenarios._inflight == {}